@@ -0,0 +1,544 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#  Benchmarks for Scour
+#
+#  This file is part of Scour, http://www.codedread.com/scour/
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+""" Benchmarks for Scour.
+
+Runs scourString() over the SVG files of one or more corpus directories and over
+synthetic documents that are scaled along several axes (number of paths, path length,
+nesting depth, number of gradients, number of IDs/references and size of style attributes).
+
+For every case the (best) total time, the time spent in the individual stages (see '--profile')
+and the peak memory allocated while scouring (Python 3 only) are reported.
+
+With '--path-parsers' the parsers for path data (see svg_regex.py) are compared on
+megabyte-scale path data instead and with '--xml-backends' the peak RSS of the XML backends
+(see '--xml-backend') is compared on large map-like documents.
+
+Results can be saved as JSON and compared against a previously saved baseline, e.g.
+
+    python benchmark.py --output=baseline.json
+    ... (apply changes)
+    python benchmark.py --compare=baseline.json
+
+Run 'python benchmark.py --help' for all options.
+"""
+from __future__ import division         # use "true" division instead of integer division in Python 2 (see PEP 238)
+from __future__ import print_function   # use print() as a function in Python 2 (see PEP 3105)
+from __future__ import absolute_import  # use absolute imports by default in Python 2 (see PEP 328)
+
+import copy
+import gc
+import json
+import multiprocessing
+import optparse
+import os
+import random
+import shlex
+import sys
+import time
+from collections import OrderedDict
+
+from scour.scour import parse_args, scourString
+from scour.stats import ScourStats
+from scour.svg_regex import FastSVGPathParser, SVGPathParser
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# perf_counter() is not available in Python 2
+timer = getattr(time, 'perf_counter', time.time)
+
+
+# parameters of the synthetic documents
+# (each axis is scaled separately, all other parameters keep their base value)
+BASE_PARAMETERS = OrderedDict([
+    ('paths', 50),
+    ('path_length', 20),
+    ('depth', 2),
+    ('gradients', 5),
+    ('ids', 20),
+    ('style_size', 4),
+])
+SCALING_AXES = OrderedDict([
+    ('paths', [50, 200, 800]),
+    ('path_length', [20, 80, 320]),
+    ('depth', [2, 8, 32]),
+    ('gradients', [5, 20, 80]),
+    ('ids', [20, 80, 320]),
+    ('style_size', [4, 16, 64]),
+])
+
+# sizes of the path data (in MiB) the path data parsers are compared on
+PATH_PARSER_SIZES = [1, 4]
+
+# sizes of the map-like documents (in MiB) the XML backends are compared on
+MAP_SIZES = [4, 16]
+
+# style properties used to pad style attributes (a mix of defaults, inherited and real values)
+STYLE_PROPERTIES = [
+    ('fill', ['#ff0000', 'red', 'rgb(0,0,255)', 'none']),
+    ('fill-opacity', ['1', '0.5', '.25000']),
+    ('stroke', ['#000', 'black', 'none']),
+    ('stroke-width', ['1', '1.000000', '2.5px']),
+    ('stroke-opacity', ['1', '0.75']),
+    ('stroke-linecap', ['butt', 'round']),
+    ('stroke-linejoin', ['miter', 'round']),
+    ('stroke-miterlimit', ['4', '10.0000']),
+    ('opacity', ['1', '0.9']),
+    ('font-family', ['sans-serif', 'Sans']),
+    ('font-size', ['12px', '16.00000px']),
+    ('marker', ['none']),
+    ('display', ['inline']),
+    ('visibility', ['visible']),
+    ('-inkscape-font-specification', ['Sans']),
+]
+
+
+def _number(rnd, scale=100.):
+    # a number with excessive precision as written by many editors
+    return '{:.8f}'.format(rnd.uniform(-scale, scale))
+
+
+# number of coordinates per path command
+_PATH_COMMANDS = {'L': 2, 'l': 2, 'H': 1, 'h': 1, 'V': 1, 'v': 1, 'C': 6, 'c': 6, 'S': 4, 's': 4, 'Q': 4, 'q': 4}
+
+
+def _path_data(rnd, length):
+    data = ['M', _number(rnd), _number(rnd)]
+    for _ in range(length):
+        command = rnd.choice(sorted(_PATH_COMMANDS))
+        data.append(command)
+        data.extend(_number(rnd) for _ in range(_PATH_COMMANDS[command]))
+    data.append('z')
+    return ' '.join(data)
+
+
+def _large_path_data(rnd, size):
+    # path data of about 'size' bytes (including some elliptical arcs)
+    parts = []
+    length = 0
+    while length < size:
+        part = _path_data(rnd, 100)
+        part += ' A {} {} 30 0 1 {} {}'.format(abs(float(_number(rnd))), abs(float(_number(rnd))),
+                                               _number(rnd), _number(rnd))
+        parts.append(part)
+        length += len(part) + 1
+    return ' '.join(parts)
+
+
+def _style(rnd, size):
+    properties = []
+    for _ in range(size):
+        name, values = rnd.choice(STYLE_PROPERTIES)
+        properties.append(name + ':' + rnd.choice(values))
+    return ';'.join(properties)
+
+
+def generate_svg(paths=10, path_length=10, depth=1, gradients=0, ids=0, style_size=0, seed=0):
+    """
+    Generates a synthetic SVG document (deterministic for a given seed).
+
+        paths        number of <path> elements
+        path_length  number of segments per path
+        depth        nesting depth of the <g> elements containing the paths
+        gradients    number of gradients (half of them duplicates, some referencing each other)
+        ids          number of additional elements with IDs (half of them referenced by <use> elements)
+        style_size   number of properties in the style attribute of each path
+    """
+    rnd = random.Random(seed)
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>\n',
+             '<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" '
+             'xmlns:inkscape="http://www.inkscape.org/namespaces/inkscape" '
+             'width="1000.000000px" height="1000.000000px">\n',
+             '<!-- generated by benchmark.py -->\n',
+             '<metadata><rdf>editor data</rdf></metadata>\n',
+             '<defs>\n']
+
+    for i in range(gradients):
+        # every second gradient is a duplicate of the previous one, every third one references another one
+        color_seed = i - (i % 2)
+        color = '#{:06x}'.format(random.Random(color_seed).randint(0, 0xffffff))
+        if i % 3 == 2:
+            parts.append('<linearGradient id="gradient{}" xlink:href="#gradient{}" x1="0.00000" y1="0" '
+                         'x2="1.000000" y2="0"/>\n'.format(i, i - 1))
+        else:
+            parts.append('<linearGradient id="gradient{}" x1="0" y1="0" x2="1" y2="0">'
+                         '<stop offset="0" style="stop-color:{};stop-opacity:1"/>'
+                         '<stop offset="0" style="stop-color:{};stop-opacity:1"/>'
+                         '<stop offset="1.0000" style="stop-color:#ffffff;stop-opacity:1.000"/>'
+                         '</linearGradient>\n'.format(i, color, color))
+
+    for i in range(ids):
+        parts.append('<rect id="element-with-a-long-id-{}" x="{}" y="{}" width="10.00000" height="10"/>\n'.format(
+            i, _number(rnd), _number(rnd)))
+    parts.append('</defs>\n')
+
+    for i in range(0, ids, 2):
+        parts.append('<use xlink:href="#element-with-a-long-id-{}" transform="translate({},{})"/>\n'.format(
+            i, _number(rnd), _number(rnd)))
+
+    for level in range(depth):
+        parts.append('<g id="layer{}" inkscape:label="Layer {}" inkscape:groupmode="layer" '
+                     'style="fill:#000000;stroke:none">\n'.format(level, level))
+
+    for i in range(paths):
+        fill = 'url(#gradient{})'.format(i % gradients) if gradients and i % 4 == 0 else '#{:06x}'.format(i)
+        style = _style(rnd, style_size)
+        parts.append('<path id="path{}" d="{}" fill="{}" style="{}" stroke-width="1.0000"/>\n'.format(
+            i, _path_data(rnd, path_length), fill, style))
+
+    parts.append('</g>\n' * depth)
+    parts.append('</svg>\n')
+    return ''.join(parts)
+
+
+def generate_map_svg(size, seed=0):
+    """
+    Generates a map-like SVG document of about 'size' bytes (deterministic for a given seed),
+    i.e. lots of small paths with an ID, a class and presentation attributes each, grouped into layers.
+    """
+    rnd = random.Random(seed)
+    fills = ['#ffffff', '#eeeeee', '#c0ffee', '#123456']
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>\n',
+             '<svg xmlns="http://www.w3.org/2000/svg" width="1000" height="1000" viewBox="0 0 1000 1000">\n']
+    length = sum(map(len, parts))
+    layer = 0
+    while length < size:
+        part = '<g id="layer{}" class="layer" stroke-linejoin="round">\n'.format(layer)
+        for i in range(100):
+            part += ('<path id="feature{}-{}" class="feature type{}" d="{}" fill="{}" stroke="#000000" '
+                     'stroke-width="0.5" fill-opacity="1"/>\n').format(
+                layer, i, rnd.randint(0, 9), _path_data(rnd, rnd.randint(2, 10)), rnd.choice(fills))
+        part += '</g>\n'
+        parts.append(part)
+        length += len(part)
+        layer += 1
+    parts.append('</svg>\n')
+    return ''.join(parts)
+
+
+def synthetic_cases(axes=None):
+    """
+    Yields (name, SVG string, None) tuples of the synthetic documents for the given scaling axes (default: all).
+    """
+    for axis, values in SCALING_AXES.items():
+        if axes and axis not in axes:
+            continue
+        for value in values:
+            parameters = BASE_PARAMETERS.copy()
+            parameters[axis] = value
+            yield 'synthetic/{}={}'.format(axis, value), generate_svg(**parameters), None
+
+
+def corpus_cases(directory):
+    """
+    Yields (name, SVG bytes, filename) tuples for all SVG files in 'directory' (searched recursively).
+    """
+    for dirpath, dirnames, filenames in os.walk(directory):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if os.path.splitext(filename)[1].lower() == '.svg':
+                path = os.path.join(dirpath, filename)
+                with open(path, 'rb') as f:
+                    yield os.path.relpath(path), f.read(), path
+
+
+def run_case(svg, options, repeat, filename=None):
+    """
+    Scours 'svg' 'repeat' times with and without profiling enabled.
+
+    Returns the best total time, the best time per stage (in ms), the peak memory (in KiB)
+    and the input/output size.
+    """
+    options = copy.copy(options)
+    # relative references (e.g. to raster images) are resolved relative to the input file
+    options.infilename = filename
+    options.profile = False
+    profile_options = copy.copy(options)
+    profile_options.profile = True
+
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        begin = timer()
+        output = scourString(svg, options)
+        times.append(timer() - begin)
+
+    # time the individual stages in separate runs, as counting the visited elements takes some time
+    stages = OrderedDict()
+    for _ in range(repeat):
+        stats = ScourStats()
+        gc.collect()
+        scourString(svg, profile_options, stats)
+        for name, stage in stats.profile.as_dict().items():
+            stages[name] = min(stages.get(name, stage['time_ms']), stage['time_ms'])
+
+    # measure memory in a separate run as tracing slows down execution considerably
+    peak_memory = None
+    if tracemalloc is not None:
+        gc.collect()
+        tracemalloc.start()
+        scourString(svg, options)
+        peak_memory = tracemalloc.get_traced_memory()[1] // 1024
+        tracemalloc.stop()
+
+    return OrderedDict([
+        ('time_ms', round(min(times) * 1000., 3)),
+        ('peak_memory_kib', peak_memory),
+        ('input_size', len(svg)),
+        ('output_size', len(output.encode('utf-8'))),
+        ('stages', stages),
+    ])
+
+
+def run_path_parsers(repeat):
+    """
+    Compares the path data parsers of svg_regex.py on path data of PATH_PARSER_SIZES MiB.
+
+    Returns the best time of each parser (in ms) per size.
+    """
+    rnd = random.Random(0)
+    parsers = [('SVGPathParser', SVGPathParser()), ('FastSVGPathParser', FastSVGPathParser())]
+    results = OrderedDict()
+    for size in PATH_PARSER_SIZES:
+        data = _large_path_data(rnd, size * 1024 * 1024)
+        name = 'path_parsers/size={}MiB'.format(size)
+        times = OrderedDict()
+        outputs = []
+        for parser_name, parser in parsers:
+            best = None
+            for _ in range(repeat):
+                gc.collect()
+                begin = timer()
+                output = parser.parse(data)
+                elapsed = timer() - begin
+                best = elapsed if best is None else min(best, elapsed)
+            outputs.append(output)
+            times[parser_name] = round(best * 1000., 3)
+        if outputs[0] != outputs[1]:
+            raise AssertionError('the path data parsers disagree on {}'.format(name))
+        results[name] = times
+        print('{:<40} {}  (speedup {:.1f}x)'.format(
+            name, ', '.join('{} {:.3f} ms'.format(parser_name, time_ms) for parser_name, time_ms in times.items()),
+            times['SVGPathParser'] / times['FastSVGPathParser']))
+    return results
+
+
+def _scour_peak_rss(svg, args, queue):
+    # scours 'svg' in a separate process (so the peak RSS is not influenced by previous runs) and reports
+    # the peak RSS before and after scouring (in KiB), the time taken and the output
+    def peak_rss():
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak // 1024 if sys.platform == 'darwin' else peak  # (bytes on macOS)
+
+    before = peak_rss()
+    begin = timer()
+    output = scourString(svg, parse_args(args))
+    elapsed = timer() - begin
+    queue.put((before, peak_rss(), elapsed, output))
+
+
+def run_xml_backends():
+    """
+    Compares the XML backends (see '--xml-backend') on map-like documents of MAP_SIZES MiB.
+
+    Returns the peak RSS (in KiB), its increase while scouring and the time (in ms) of each backend per size.
+    """
+    backends = ['minidom', 'etree']
+    results = OrderedDict()
+    for size in MAP_SIZES:
+        svg = generate_map_svg(size * 1024 * 1024)
+        name = 'xml_backends/size={}MiB'.format(size)
+        backend_results = OrderedDict()
+        outputs = []
+        for backend in backends:
+            queue = multiprocessing.Queue()
+            process = multiprocessing.Process(target=_scour_peak_rss, args=(svg, ['--xml-backend=' + backend], queue))
+            process.start()
+            before, peak, elapsed, output = queue.get()
+            process.join()
+            outputs.append(output)
+            backend_results[backend] = OrderedDict([
+                ('peak_rss_kib', peak),
+                ('rss_increase_kib', peak - before),
+                ('time_ms', round(elapsed * 1000., 3)),
+            ])
+        if outputs[0] != outputs[1]:
+            raise AssertionError('the XML backends disagree on {}'.format(name))
+        results[name] = backend_results
+        print('{:<40} {}  (peak RSS {:+.1f}%)'.format(
+            name,
+            ', '.join('{} {} KiB (+{} KiB) {:.3f} ms'.format(
+                backend, result['peak_rss_kib'], result['rss_increase_kib'], result['time_ms'])
+                for backend, result in backend_results.items()),
+            (backend_results['etree']['peak_rss_kib'] / backend_results['minidom']['peak_rss_kib'] - 1) * 100.))
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Compares the results against a baseline.
+
+    Prints the relative change of total time and peak memory of every case (and of stages that
+    changed by more than 'threshold' percent). Returns the number of regressions.
+    """
+    def change(new, old):
+        if new is None or old is None or not old:
+            return None
+        return (new - old) / old * 100.
+
+    def describe(new, old, unit):
+        percent = change(new, old)
+        if percent is None:
+            return 'n/a'
+        return '{} -> {} {} ({:+.1f}%)'.format(old, new, unit, percent)
+
+    regressions = 0
+    print('Comparison with baseline (regression threshold: {}%):'.format(threshold))
+    for name, result in results.items():
+        if name not in baseline:
+            print('  {} (not in baseline)'.format(name))
+            continue
+        old = baseline[name]
+        marks = []
+        for key in ('time_ms', 'peak_memory_kib'):
+            percent = change(result[key], old[key])
+            if percent is not None and percent > threshold:
+                marks.append(key)
+        regressions += len(marks)
+        print('  {}'.format(name))
+        print('    time   {}{}'.format(describe(result['time_ms'], old['time_ms'], 'ms'),
+                                       '  REGRESSION' if 'time_ms' in marks else ''))
+        print('    memory {}{}'.format(describe(result['peak_memory_kib'], old['peak_memory_kib'], 'KiB'),
+                                       '  REGRESSION' if 'peak_memory_kib' in marks else ''))
+        for stage, time_ms in result['stages'].items():
+            percent = change(time_ms, old['stages'].get(stage))
+            # ignore stages that take hardly any time, their relative change is mostly noise
+            if percent is not None and abs(percent) > threshold and max(time_ms, old['stages'][stage]) >= 1:
+                print('      {:<40} {:>9.3f} -> {:>9.3f} ms {:+7.1f}%'.format(
+                    stage, old['stages'][stage], time_ms, percent))
+    return regressions
+
+
+def print_result(name, result):
+    memory = result['peak_memory_kib']
+    print('{:<40} {:>10.3f} ms {:>10} KiB {:>9} -> {:>9} bytes'.format(
+        name, result['time_ms'], 'n/a' if memory is None else memory, result['input_size'], result['output_size']))
+    slowest = sorted(result['stages'].items(), key=lambda stage: stage[1], reverse=True)[:3]
+    print('    slowest stages: ' + ', '.join('{} {:.3f} ms'.format(stage, time_ms) for stage, time_ms in slowest))
+
+
+def main(args=None):
+    parser = optparse.OptionParser(
+        usage="%prog [OPTIONS]",
+        description="Benchmarks scourString() on a corpus of SVG files and on synthetic documents.")
+    parser.add_option("--corpus",
+                      action="append", dest="corpus", default=[], metavar="DIR",
+                      help="benchmark all SVG files in DIR (can be given multiple times)")
+    parser.add_option("--no-synthetic",
+                      action="store_false", dest="synthetic", default=True,
+                      help="don't benchmark the synthetic documents")
+    parser.add_option("--axis",
+                      action="append", dest="axes", default=[], metavar="NAME",
+                      help="only scale the synthetic documents along axis NAME (can be given multiple times; "
+                           "available axes: " + ', '.join(SCALING_AXES) + ")")
+    parser.add_option("--path-parsers",
+                      action="store_true", dest="path_parsers", default=False,
+                      help="compare the path data parsers on large path data instead of benchmarking scourString()")
+    parser.add_option("--xml-backends",
+                      action="store_true", dest="xml_backends", default=False,
+                      help="compare the peak RSS of the XML backends on large map-like documents "
+                           "instead of benchmarking the corpus and synthetic documents")
+    parser.add_option("--repeat",
+                      action="store", type=int, dest="repeat", default=3, metavar="NUM",
+                      help="number of runs per case, the best time is reported (default: %default)")
+    parser.add_option("--scour-options",
+                      action="store", type="string", dest="scour_options", default="", metavar="OPTIONS",
+                      help="command line options for Scour (e.g. \"--shorten-ids --indent=none\")")
+    parser.add_option("--output",
+                      action="store", type="string", dest="output", metavar="FILE",
+                      help="save the results as JSON to FILE (e.g. to use them as a baseline later)")
+    parser.add_option("--compare",
+                      action="store", type="string", dest="baseline", metavar="FILE",
+                      help="compare the results with a baseline previously saved with '--output'")
+    parser.add_option("--threshold",
+                      action="store", type=float, dest="threshold", default=10., metavar="PERCENT",
+                      help="relative slowdown or memory increase reported as regression (default: %default)")
+    options, rargs = parser.parse_args(args)
+    if rargs:
+        parser.error("Additional arguments not handled: %r, see --help" % rargs)
+    for axis in options.axes:
+        if axis not in SCALING_AXES:
+            parser.error("Unknown axis '{}', see --help".format(axis))
+    if options.repeat < 1:
+        parser.error("Number of runs has to be larger than zero, see --help")
+
+    if options.xml_backends and resource is None:
+        parser.error("Measuring the peak RSS is not supported on this platform")
+
+    if options.path_parsers or options.xml_backends:
+        if options.path_parsers:
+            results = run_path_parsers(options.repeat)
+        else:
+            results = run_xml_backends()
+        if options.output:
+            with open(options.output, 'w') as f:
+                json.dump(results, f, indent=1)
+                f.write('\n')
+        return 0
+
+    scour_options = parse_args(shlex.split(options.scour_options))
+
+    cases = []
+    for directory in options.corpus:
+        cases.extend(corpus_cases(directory))
+    if options.synthetic:
+        cases.extend(synthetic_cases(options.axes))
+
+    results = OrderedDict()
+    for name, svg, filename in cases:
+        try:
+            results[name] = run_case(svg, scour_options, options.repeat, filename)
+        except Exception as e:
+            # corpora may contain documents Scour can't handle (e.g. the test files for error handling)
+            print('{:<40} skipped ({})'.format(name, str(e) or type(e).__name__))
+            continue
+        print_result(name, results[name])
+
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(results, f, indent=1)
+            f.write('\n')
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, options.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
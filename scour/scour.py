@@ -49,24 +49,31 @@ from __future__ import division         # use "true" division instead of integer
 from __future__ import print_function   # use print() as a function in Python 2 (see PEP 3105)
 from __future__ import absolute_import  # use absolute imports by default in Python 2 (see PEP 328)
 
+import copy
+import glob
+import hashlib
+import json
 import math
 import optparse
 import os
 import re
 import sys
+import threading
 import time
 import xml.dom.minidom
 from xml.dom import Node, NotFoundErr
-from collections import namedtuple, defaultdict
+from collections import namedtuple, defaultdict, deque, Counter, OrderedDict
 from decimal import Context, Decimal, InvalidOperation, getcontext
 
 import six
 from six.moves import range, urllib
 
-from scour.stats import ScourStats
+from scour.stats import ScourProfile, ScourStats
 from scour.svg_regex import svg_parser
 from scour.svg_transform import svg_transform_parser
+from scour.traversal import child_elements, get_elements_by_tag_name, iter_elements, walk
 from scour.yocto_css import parseCssString
+from scour.xml_backend import BACKENDS as XML_BACKENDS, attribute_nodes, get_backend
 from scour import __version__
 
 
@@ -411,10 +418,10 @@ def is_same_sign(a, b):
     return (a <= 0 and b <= 0) or (a >= 0 and b >= 0)
 
 
-def is_same_direction(x1, y1, x2, y2):
+def is_same_direction(x1, y1, x2, y2, options):
     if is_same_sign(x1, x2) and is_same_sign(y1, y2):
         diff = y1/x1 - y2/x2
-        return scouringContext.plus(1 + diff) == 1
+        return options.scouring_context.plus(1 + diff) == 1
     else:
         return False
 
@@ -537,15 +544,10 @@ def findElementsWithId(node, elems=None):
     """
     if elems is None:
         elems = {}
-    id = node.getAttribute('id')
-    if id != '':
-        elems[id] = node
-    if node.hasChildNodes():
-        for child in node.childNodes:
-            # from http://www.w3.org/TR/DOM-Level-2-Core/idl-definitions.html
-            # we are only really interested in nodes of type Element (1)
-            if child.nodeType == Node.ELEMENT_NODE:
-                findElementsWithId(child, elems)
+    for elem in iter_elements(node):
+        id = elem.getAttribute('id')
+        if id != '':
+            elems[id] = elem
     return elems
 
 
@@ -561,12 +563,28 @@ def findReferencedElements(node, ids=None):
 
     Currently looks at 'xlink:href' and all attributes in 'referencingProps'
     """
-    global referencingProps
     if ids is None:
         ids = {}
     # TODO: input argument ids is clunky here (see below how it is called)
     # GZ: alternative to passing dict, use **kwargs
 
+    # (the children of a style element are its text)
+    for elem in iter_elements(node, _is_not_style_element):
+        findNodeReferences(elem, ids)
+    return ids
+
+
+def _is_not_style_element(node):
+    return not (node.nodeName == 'style' and node.namespaceURI == NS['SVG'])
+
+
+def findNodeReferences(node, ids):
+    """
+    Adds the IDs referenced by node itself (but not by its descendants) to the map ids,
+    see findReferencedElements()
+    """
+    global referencingProps
+
     # if this node is a style element, parse its text into CSS
     if node.nodeName == 'style' and node.namespaceURI == NS['SVG']:
         # one stretch of text, please! (we could use node.normalize(), but
@@ -592,25 +610,14 @@ def findReferencedElements(node, ids=None):
             ids[id] = {node}
 
     # now get all style properties and the fill, stroke, filter attributes
-    styles = node.getAttribute('style').split(';')
-
-    for style in styles:
-        propval = style.split(':')
-        if len(propval) == 2:
-            prop = propval[0].strip()
-            val = propval[1].strip()
-            findReferencingProperty(node, prop, val, ids)
+    for prop, val in six.iteritems(_getStyle(node)):
+        findReferencingProperty(node, prop, val, ids)
 
     for attr in referencingProps:
         val = node.getAttribute(attr).strip()
         if not val:
             continue
         findReferencingProperty(node, attr, val, ids)
-
-    if node.hasChildNodes():
-        for child in node.childNodes:
-            if child.nodeType == Node.ELEMENT_NODE:
-                findReferencedElements(child, ids)
     return ids
 
 
@@ -639,72 +646,242 @@ def findReferencingProperty(node, prop, val, ids):
                     ids[id] = {node}
 
 
-def removeUnusedDefs(doc, defElem, elemsToRemove=None, referencedIDs=None):
-    if elemsToRemove is None:
-        elemsToRemove = []
-
-    # removeUnusedDefs do not change the XML itself; therefore there is no point in
-    # recomputing findReferencedElements when we recurse into child nodes.
-    if referencedIDs is None:
-        referencedIDs = findReferencedElements(doc.documentElement)
-
-    keepTags = ['font', 'style', 'metadata', 'script', 'title', 'desc']
-    for elem in defElem.childNodes:
-        # only look at it if an element and not referenced anywhere else
-        if elem.nodeType != Node.ELEMENT_NODE:
-            continue
+class ReferenceIndex(object):
+    """
+    Index of the elements of a document by ID and tag name and of the nodes referencing IDs.
 
-        elem_id = elem.getAttribute('id')
+    The index is built once and then kept up to date by the passes as they insert or remove nodes,
+    change references or rename IDs, so the document does not need to be searched again
+    each time (see findElementsWithId(), findReferencedElements() and getElementsByTagName()).
 
-        if elem_id == '' or elem_id not in referencedIDs:
-            # we only inspect the children of a group in a defs if the group
-            # is not referenced anywhere else
-            if elem.nodeName == 'g' and elem.namespaceURI == NS['SVG']:
-                elemsToRemove = removeUnusedDefs(doc, elem, elemsToRemove, referencedIDs=referencedIDs)
-            # we only remove if it is not one of our tags we always keep (see above)
-            elif elem.nodeName not in keepTags:
-                elemsToRemove.append(elem)
-    return elemsToRemove
+    - elements maps each ID to the element declaring it
+    - referrers maps each referenced ID to the set of nodes referencing it
+      (IDs that are no longer referenced are removed)
+    - elements_with_tag() returns the elements with a given tag name
 
+    The lists of elements by tag name are kept in document order, so elements moved to another
+    position have to be reported with insert(), unless the move keeps the order of all elements
+    (like promoting the children of a group to its position or moving the children of a group
+    to the end of its directly preceding sibling group).
+    """
 
-def remove_unreferenced_elements(doc, keepDefs, stats):
+    def __init__(self, doc):
+        self._doc = doc
+        self.elements = {}
+        # elements declaring the same ID as an earlier element (like findElementsWithId(), the
+        # index has the last one), they take its place when it is removed or loses its ID
+        self._duplicates = {}
+        # tag name -> elements (in document order); removed elements are only filtered out of the
+        # lists of the tag names in _removedTags when they are needed next, the lists of the tag names
+        # in _insertedTags are collected from the document again
+        self._tags = defaultdict(list)
+        self._removed = set()
+        self._removedTags = set()
+        self._insertedTags = set()
+        for elem in iter_elements(doc.documentElement):
+            self._tags[elem.nodeName].append(elem)
+            id = elem.getAttribute('id')
+            if id != '':
+                if id in self.elements:
+                    self._duplicates.setdefault(id, []).append(self.elements[id])
+                self.elements[id] = elem
+        self.referrers = findReferencedElements(doc.documentElement)
+        # the IDs referenced by each node (i.e. referrers the other way round)
+        self._references = defaultdict(set)
+        for id, nodes in six.iteritems(self.referrers):
+            for node in nodes:
+                self._references[node].add(id)
+
+    def _add_referrer(self, id, node):
+        if id in self.referrers:
+            self.referrers[id].add(node)
+        else:
+            self.referrers[id] = {node}
+
+    def _discard_referrer(self, id, node):
+        nodes = self.referrers.get(id)
+        if nodes is not None:
+            nodes.discard(node)
+            if not nodes:
+                del self.referrers[id]
+
+    def update(self, node):
+        """
+        Updates the references of node (but not those of its descendants) after they were changed.
+
+        Returns the IDs whose set of referencing nodes changed.
+        """
+        references = set(findNodeReferences(node, {}))
+        oldReferences = self._references.pop(node, set())
+        for id in oldReferences - references:
+            self._discard_referrer(id, node)
+        for id in references - oldReferences:
+            self._add_referrer(id, node)
+        if references:
+            self._references[node] = references
+        return references ^ oldReferences
+
+    def remove(self, node):
+        """
+        Removes the IDs declared and the references made by node and its descendants.
+
+        Must be called when node is removed from the document.
+        Returns the IDs that lost referencing nodes (and may not be referenced anymore).
+        """
+        changed = set()
+        elems = [node]
+        if node.nodeType == Node.ELEMENT_NODE:
+            elems.extend(get_elements_by_tag_name(node, '*'))
+        for elem in elems:
+            if elem.nodeType != Node.ELEMENT_NODE:
+                continue
+            self._removed.add(elem)
+            self._removedTags.add(elem.nodeName)
+            id = elem.getAttribute('id')
+            if id != '':
+                self._remove_element(id, elem)
+            references = self._references.pop(elem, ())
+            for rid in references:
+                self._discard_referrer(rid, elem)
+            changed.update(references)
+        return changed
+
+    def insert(self, elem):
+        """
+        Adds the element elem after it was inserted into the document (or moved to another position).
+
+        Its descendants (if any) have to be in the index already.
+        """
+        self._insertedTags.add(elem.nodeName)
+        id = elem.getAttribute('id')
+        if id != '' and id not in self.elements:
+            self.elements[id] = elem
+        self.update(elem)
+
+    def elements_with_tag(self, name):
+        """
+        Returns a list of the elements with the tag name 'name' (in document order), like getElementsByTagName().
+        """
+        if name in self._insertedTags:
+            self._insertedTags.discard(name)
+            self._removedTags.discard(name)
+            self._tags[name] = get_elements_by_tag_name(self._doc, name)
+        elif name in self._removedTags:
+            self._removedTags.discard(name)
+            self._tags[name] = [elem for elem in self._tags[name] if elem not in self._removed]
+        if not self._removedTags:
+            self._removed.clear()
+        return list(self._tags.get(name, ()))
+
+    def _remove_element(self, id, elem):
+        duplicates = self._duplicates.get(id)
+        if self.elements.get(id) is elem:
+            if duplicates:
+                self.elements[id] = duplicates.pop()
+            else:
+                del self.elements[id]
+        elif duplicates and elem in duplicates:
+            duplicates.remove(elem)
+
+    def remove_id(self, id):
+        """
+        Removes an ID after the id attribute of its element was removed (references to it are kept).
+        """
+        self._remove_element(id, self.elements[id])
+
+    def rename(self, renamedIDs):
+        """
+        Updates the index after IDs were renamed as given by the map renamedIDs (old ID -> new ID).
+
+        All IDs are renamed at once, i.e. the new ID of one element may be the old ID of another.
+        """
+        elements = {}
+        for id, elem in six.iteritems(self.elements):
+            elements[renamedIDs.get(id, id)] = elem
+        # elements with a duplicate ID keep it
+        for id in renamedIDs:
+            if self._duplicates.get(id) and id not in elements:
+                elements[id] = self._duplicates[id].pop()
+        self.elements = elements
+
+        referrers = {}
+        for id, nodes in six.iteritems(self.referrers):
+            referrers.setdefault(renamedIDs.get(id, id), set()).update(nodes)
+        self.referrers = referrers
+
+        for node, ids in six.iteritems(self._references):
+            self._references[node] = set(renamedIDs.get(id, id) for id in ids)
+
+
+def remove_unreferenced_elements(doc, keepDefs, stats, ref_index):
     """
     Removes all unreferenced elements except for <svg>, <font>, <metadata>, <title>, and <desc>.
     Also vacuums the defs of any non-referenced renderable elements.
 
+    Removing an element may leave the elements it referenced unreferenced. These are put
+    on a worklist (see ReferenceIndex.remove()) so the whole cascade is removed in one pass.
+
+    Whether an element is in unused defs (a child of a <defs> element or of a group in <defs> that is not
+    referenced anywhere) is passed down from parent to children as they are put on the worklist instead
+    of each element scanning its ancestors, so deeply nested documents take linear time.
+
     Returns the number of unreferenced elements removed from the document.
     """
     num = 0
 
     # Remove certain unreferenced elements outside of defs
     removeTags = ['linearGradient', 'radialGradient', 'pattern']
-    identifiedElements = findElementsWithId(doc.documentElement)
-    referencedIDs = findReferencedElements(doc.documentElement)
-
+    # Never remove these from defs
+    keepTags = ['font', 'style', 'metadata', 'script', 'title', 'desc']
+    referencedIDs = ref_index.referrers
+
+    # The parents whose child elements are in unused defs: all defs and the groups in them found
+    # unreferenced. References are only removed by this pass, so parents stay in the set once added.
+    # (An element taken from the worklist before its parent was added is put on it again when its
+    # parent is expanded.)
+    unusedDefs = set()
+    # the elements removed from the document along with their descendants
+    removed = set()
+
+    # start with the children of all defs and all elements with an ID
+    worklist = deque()
     if not keepDefs:
-        # Remove most unreferenced elements inside defs
-        defs = doc.documentElement.getElementsByTagName('defs')
-        for aDef in defs:
-            elemsToRemove = removeUnusedDefs(doc, aDef, referencedIDs=referencedIDs)
-            for elem in elemsToRemove:
-                elem.parentNode.removeChild(elem)
-            stats.num_elements_removed += len(elemsToRemove)
-            num += len(elemsToRemove)
+        for aDef in ref_index.elements_with_tag('defs'):
+            unusedDefs.add(aDef)
+            worklist.extend(child for child in aDef.childNodes if child.nodeType == Node.ELEMENT_NODE)
+    worklist.extend(list(ref_index.elements.values()))
+
+    while worklist:
+        elem = worklist.popleft()
+        # skip elements that are referenced or were removed already
+        if elem.getAttribute('id') in referencedIDs or elem in removed:
+            continue
 
-    for id in identifiedElements:
-        if id not in referencedIDs:
-            goner = identifiedElements[id]
-            if (goner is not None and goner.nodeName in removeTags
-                and goner.parentNode is not None
-                    and goner.parentNode.tagName != 'defs'):
-                goner.parentNode.removeChild(goner)
-                num += 1
-                stats.num_elements_removed += 1
+        inUnusedDefs = elem.parentNode in unusedDefs
+        if inUnusedDefs and elem.nodeName == 'g' and elem.namespaceURI == NS['SVG']:
+            # we only inspect the children of a group in a defs if the group
+            # is not referenced anywhere else
+            if elem not in unusedDefs:
+                unusedDefs.add(elem)
+                worklist.extend(child for child in elem.childNodes if child.nodeType == Node.ELEMENT_NODE)
+            continue
+        if not ((inUnusedDefs and elem.nodeName not in keepTags)
+                or (elem.nodeName in removeTags and elem.parentNode.nodeName != 'defs')):
+            continue
+
+        # the elements whose IDs lost a reference are checked (again)
+        for id in ref_index.remove(elem):
+            if id not in referencedIDs and id in ref_index.elements:
+                worklist.append(ref_index.elements[id])
+        removed.update(iter_elements(elem))
+        elem.parentNode.removeChild(elem)
+        num += 1
+        stats.num_elements_removed += 1
 
     return num
 
 
-def shortenIDs(doc, prefix, options):
+def shortenIDs(doc, prefix, options, ref_index):
     """
     Shortens ID names used in the document. ID names referenced the most often are assigned the
     shortest ID names.
@@ -713,12 +890,11 @@ def shortenIDs(doc, prefix, options):
     """
     num = 0
 
-    identifiedElements = findElementsWithId(doc.documentElement)
-    # This map contains maps the (original) ID to the nodes referencing it.
-    # At the end of this function, it will no longer be valid and while we
-    # could keep it up to date, it will complicate the code for no gain
-    # (as we do not reuse the data structure beyond this function).
-    referencedIDs = findReferencedElements(doc.documentElement)
+    # These maps map the (original) IDs to their elements and the nodes referencing them.
+    # They are not changed while renaming (as a new ID may be the original ID of another
+    # element that is renamed later), ref_index is updated with all renamed IDs at the end.
+    identifiedElements = ref_index.elements
+    referencedIDs = ref_index.referrers
 
     # Make idList (list of idnames) sorted by reference count
     # descending, so the highest reference count is first.
@@ -730,7 +906,7 @@ def shortenIDs(doc, prefix, options):
     idList = [rid for count, rid in idList]
 
     # Add unreferenced IDs to end of idList in arbitrary order
-    idList.extend([rid for rid in identifiedElements if rid not in idList])
+    idList.extend([rid for rid in identifiedElements if rid not in referencedIDs])
     # Ensure we do not reuse a protected ID by accident
     protectedIDs = protected_ids(identifiedElements, options)
     # IDs that have been allocated and should not be remapped.
@@ -770,6 +946,7 @@ def shortenIDs(doc, prefix, options):
             need_new_id.append(current_id)
 
     curIdNum = 1
+    renamedIDs = {}
 
     for old_id in need_new_id:
         new_id = intToID(curIdNum, prefix)
@@ -781,8 +958,10 @@ def shortenIDs(doc, prefix, options):
 
         # Now that we have found the first available ID, do the remap.
         num += renameID(old_id, new_id, identifiedElements, referencedIDs.get(old_id))
+        renamedIDs[old_id] = new_id
         curIdNum += 1
 
+    ref_index.rename(renamedIDs)
     return num
 
 
@@ -927,9 +1106,9 @@ def protected_ids(seenIDs, options):
     return protectedIDs
 
 
-def unprotected_ids(doc, options):
-    u"""Returns a list of unprotected IDs within the document doc."""
-    identifiedElements = findElementsWithId(doc.documentElement)
+def unprotected_ids(ref_index, options):
+    u"""Returns a list of unprotected IDs within the document indexed by ref_index."""
+    identifiedElements = dict(ref_index.elements)
     protectedIDs = protected_ids(identifiedElements, options)
     if protectedIDs:
         for id in protectedIDs:
@@ -937,7 +1116,7 @@ def unprotected_ids(doc, options):
     return identifiedElements
 
 
-def remove_unreferenced_ids(referencedIDs, identifiedElements):
+def remove_unreferenced_ids(ref_index, identifiedElements):
     """
     Removes the unreferenced ID attributes.
 
@@ -947,48 +1126,135 @@ def remove_unreferenced_ids(referencedIDs, identifiedElements):
     num = 0
     for id in identifiedElements:
         node = identifiedElements[id]
-        if id not in referencedIDs and node.nodeName not in keepTags:
+        if id not in ref_index.referrers and node.nodeName not in keepTags:
             node.removeAttribute('id')
+            ref_index.remove_id(id)
             num += 1
     return num
 
 
-def removeNamespacedAttributes(node, namespaces):
+class NamespaceIndex(object):
+    """
+    Index of the namespaces used by the elements and of the attribute names in a document.
+
+    Built in a single pass over the document, so namespaced elements and attributes can be found (and
+    namespace declarations can be checked for being unused) without scanning the whole document each time.
+    Has to be kept up to date when such elements or attributes are removed (see remove() and remove_attribute()).
+
+        elements         namespace URI -> set of elements in that namespace
+        attributes       namespace URI -> set of (element, attribute name) for namespaced attributes
+        attribute_names  attribute name -> number of occurrences
+    """
+
+    def __init__(self, doc):
+        self.elements = defaultdict(set)
+        self.attributes = defaultdict(set)
+        self.attribute_names = Counter()
+        for elem in iter_elements(doc.documentElement):
+            self._add(elem)
+
+    def _add(self, elem):
+        self.elements[elem.namespaceURI].add(elem)
+        for attr in elem.attributes.values():
+            self.attribute_names[attr.nodeName] += 1
+            if attr.namespaceURI is not None:
+                self.attributes[attr.namespaceURI].add((elem, attr.nodeName))
+
+    def remove(self, node):
+        """
+        Removes the elements of the subtree rooted at 'node' (which is about to be removed from the document).
+        """
+        for elem in iter_elements(node):
+            self.elements[elem.namespaceURI].discard(elem)
+            for attr in elem.attributes.values():
+                self.remove_attribute(elem, attr)
+
+    def remove_attribute(self, elem, attr):
+        """
+        Removes the attribute node 'attr' of 'elem' (which is about to be removed from the element).
+        """
+        name = attr.nodeName
+        self.attribute_names[name] -= 1
+        if not self.attribute_names[name]:
+            del self.attribute_names[name]
+        if attr.namespaceURI is not None:
+            self.attributes[attr.namespaceURI].discard((elem, name))
+
+    def xmlns_unused(self, prefix, namespace):
+        """
+        Returns whether the namespace declaration xmlns:prefix="namespace" is unused.
+        """
+        if self.elements.get(namespace):
+            return False
+        # (any attribute name starting with the prefix counts as a use)
+        return not any(name.startswith(prefix) for name in self.attribute_names)
+
+
+def _isBelow(elem, node):
+    """
+    Returns whether elem is 'node' or one of its descendants.
+    """
+    while elem is not None:
+        if elem is node:
+            return True
+        elem = elem.parentNode
+    return False
+
+
+def removeNamespacedAttributes(node, namespaces, ns_index=None):
     num = 0
-    if node.nodeType == Node.ELEMENT_NODE:
-        # remove all namespace'd attributes from this element
-        attrList = node.attributes
-        attrsToRemove = []
-        for attrNum in range(attrList.length):
-            attr = attrList.item(attrNum)
-            if attr is not None and attr.namespaceURI in namespaces:
-                attrsToRemove.append(attr.nodeName)
-        for attrName in attrsToRemove:
-            node.removeAttribute(attrName)
-        num += len(attrsToRemove)
-
-        # now recurse for children
-        for child in node.childNodes:
-            num += removeNamespacedAttributes(child, namespaces)
+    if ns_index is not None:
+        # only look at the attributes known to be in one of the namespaces
+        for namespace in namespaces:
+            for elem, attrName in list(ns_index.attributes.get(namespace, ())):
+                if _isBelow(elem, node):
+                    ns_index.remove_attribute(elem, elem.getAttributeNode(attrName))
+                    elem.removeAttribute(attrName)
+                    num += 1
+    elif node.nodeType == Node.ELEMENT_NODE:
+        for elem in iter_elements(node):
+            # remove all namespace'd attributes from this element
+            attrList = elem.attributes
+            attrsToRemove = []
+            for attrNum in range(attrList.length):
+                attr = attrList.item(attrNum)
+                if attr is not None and attr.namespaceURI in namespaces:
+                    attrsToRemove.append(attr.nodeName)
+            for attrName in attrsToRemove:
+                elem.removeAttribute(attrName)
+            num += len(attrsToRemove)
     return num
 
 
-def removeNamespacedElements(node, namespaces):
+def removeNamespacedElements(node, namespaces, ns_index=None):
     num = 0
-    if node.nodeType == Node.ELEMENT_NODE:
-        # remove all namespace'd child nodes from this element
-        childList = node.childNodes
-        childrenToRemove = []
-        for child in childList:
-            if child is not None and child.namespaceURI in namespaces:
-                childrenToRemove.append(child)
-        for child in childrenToRemove:
-            node.removeChild(child)
-        num += len(childrenToRemove)
-
-        # now recurse for children
-        for child in node.childNodes:
-            num += removeNamespacedElements(child, namespaces)
+    if ns_index is not None:
+        # only look at the elements known to be in one of the namespaces;
+        # those nested in another one are removed with it
+        candidates = set()
+        for namespace in namespaces:
+            candidates.update(ns_index.elements.get(namespace, ()))
+        for elem in candidates:
+            parent = elem.parentNode
+            while parent is not None and parent is not node and parent not in candidates:
+                parent = parent.parentNode
+            if parent is node:
+                ns_index.remove(elem)
+                parent = elem.parentNode
+                parent.removeChild(elem)
+                num += 1
+    elif node.nodeType == Node.ELEMENT_NODE:
+        # (the children are only walked after those in the namespaces were removed)
+        for elem in iter_elements(node):
+            # remove all namespace'd child nodes from this element
+            childList = elem.childNodes
+            childrenToRemove = []
+            for child in childList:
+                if child is not None and child.namespaceURI in namespaces:
+                    childrenToRemove.append(child)
+            for child in childrenToRemove:
+                elem.removeChild(child)
+            num += len(childrenToRemove)
     return num
 
 
@@ -1008,7 +1274,7 @@ def remove_descriptive_elements(doc, options):
 
     elementsToRemove = []
     for elementType in elementTypes:
-        elementsToRemove.extend(doc.documentElement.getElementsByTagName(elementType))
+        elementsToRemove.extend(get_elements_by_tag_name(doc.documentElement, elementType))
 
     for element in elementsToRemove:
         element.parentNode.removeChild(element)
@@ -1030,7 +1296,7 @@ def g_tag_is_mergeable(node):
     return True
 
 
-def remove_nested_groups(node, stats):
+def remove_nested_groups(node, stats, ref_index=None):
     """
     This walks further and further down the tree, removing groups
     which do not have any attributes or a title/desc child and
@@ -1038,53 +1304,84 @@ def remove_nested_groups(node, stats):
     """
     num = 0
 
-    groupsToRemove = []
-    # Only consider <g> elements for promotion if this element isn't a <switch>.
-    # (partial fix for bug 594930, required by the SVG spec however)
-    if not (node.nodeType == Node.ELEMENT_NODE and node.nodeName == 'switch'):
-        for child in node.childNodes:
-            if child.nodeName == 'g' and child.namespaceURI == NS['SVG'] and len(child.attributes) == 0:
-                # only collapse group if it does not have a title or desc as a direct descendant,
-                if g_tag_is_mergeable(child):
-                    groupsToRemove.append(child)
-
-    for g in groupsToRemove:
-        while g.childNodes.length > 0:
-            g.parentNode.insertBefore(g.firstChild, g)
-        g.parentNode.removeChild(g)
+    # (the children of each element are only walked after its groups were collapsed)
+    for elem in iter_elements(node):
+        groupsToRemove = []
+        # Only consider <g> elements for promotion if this element isn't a <switch>.
+        # (partial fix for bug 594930, required by the SVG spec however)
+        if not (elem.nodeType == Node.ELEMENT_NODE and elem.nodeName == 'switch'):
+            for child in elem.childNodes:
+                if child.nodeName == 'g' and child.namespaceURI == NS['SVG'] and len(child.attributes) == 0:
+                    # only collapse group if it does not have a title or desc as a direct descendant,
+                    if g_tag_is_mergeable(child):
+                        groupsToRemove.append(child)
+
+        for g in groupsToRemove:
+            # (the children take the place of the group, which keeps the document order for ref_index)
+            while g.childNodes.length > 0:
+                g.parentNode.insertBefore(g.firstChild, g)
+            if ref_index is not None:
+                ref_index.remove(g)
+            g.parentNode.removeChild(g)
+
+        num += len(groupsToRemove)
+        stats.num_elements_removed += len(groupsToRemove)
+    return num
 
-    num += len(groupsToRemove)
-    stats.num_elements_removed += len(groupsToRemove)
 
-    # now recurse for children
-    for child in node.childNodes:
-        if child.nodeType == Node.ELEMENT_NODE:
-            num += remove_nested_groups(child, stats)
-    return num
+# this is most of the inheritable properties from http://www.w3.org/TR/SVG11/propidx.html
+# and http://www.w3.org/TR/SVGTiny12/attributeTable.html
+inheritableProperties = ['clip-rule',
+                         'display-align',
+                         'fill', 'fill-opacity', 'fill-rule',
+                         'font', 'font-family', 'font-size', 'font-size-adjust', 'font-stretch',
+                         'font-style', 'font-variant', 'font-weight',
+                         'letter-spacing',
+                         'pointer-events', 'shape-rendering',
+                         'stroke', 'stroke-dasharray', 'stroke-dashoffset', 'stroke-linecap', 'stroke-linejoin',
+                         'stroke-miterlimit', 'stroke-opacity', 'stroke-width',
+                         'text-anchor', 'text-decoration', 'text-rendering', 'visibility',
+                         'word-spacing', 'writing-mode']
 
 
-def moveCommonAttributesToParentGroup(elem, referencedElements):
+def moveCommonAttributesToParentGroup(elem, ref_index):
     """
-    This recursively calls this function on all children of the passed in element
-    and then iterates over all child elements and removes common inheritable attributes
+    This walks all descendants of the passed in element depth-first and, for each element
+    (after its children), iterates over all child elements and removes common inheritable attributes
     from the children and places them in the parent group.  But only if the parent contains
     nothing but element children and whitespace.  The attributes are only removed from the
     children if the children are not referenced by other elements in the document.
     """
     num = 0
 
-    childElements = []
-    # recurse first into the children (depth-first)
-    for child in elem.childNodes:
-        if child.nodeType == Node.ELEMENT_NODE:
-            # only add and recurse if the child is not referenced elsewhere
-            if not child.getAttribute('id') in referencedElements:
-                childElements.append(child)
-                num += moveCommonAttributesToParentGroup(child, referencedElements)
-        # else if the parent has non-whitespace text children, do not
-        # try to move common attributes
-        elif child.nodeType == Node.TEXT_NODE and child.nodeValue.strip():
-            return num
+    # element -> its child elements processed before it (None if it has non-whitespace text children)
+    childElements = {}
+
+    def children(node):
+        elements = childElements[node] = []
+        for child in node.childNodes:
+            if child.nodeType == Node.ELEMENT_NODE:
+                # only add and descend if the child is not referenced elsewhere
+                if not child.getAttribute('id') in ref_index.referrers:
+                    elements.append(child)
+                    yield child
+            # else if the parent has non-whitespace text children, do not
+            # try to move common attributes (nor descend into the following children)
+            elif child.nodeType == Node.TEXT_NODE and child.nodeValue.strip():
+                childElements[node] = None
+                return
+
+    for node, entering in walk(elem, children):
+        if not entering:
+            elements = childElements.pop(node)
+            if elements is not None:
+                num += _moveCommonAttributesOfChildren(node, elements, ref_index)
+    return num
+
+
+def _moveCommonAttributesOfChildren(elem, childElements, ref_index):
+    # moves the common attributes of the children of elem, see moveCommonAttributesToParentGroup()
+    num = 0
 
     # only process the children if there are more than one element
     if len(childElements) <= 1:
@@ -1098,19 +1395,7 @@ def moveCommonAttributesToParentGroup(elem, referencedElements):
     attrList = childElements[0].attributes
     for index in range(attrList.length):
         attr = attrList.item(index)
-        # this is most of the inheritable properties from http://www.w3.org/TR/SVG11/propidx.html
-        # and http://www.w3.org/TR/SVGTiny12/attributeTable.html
-        if attr.nodeName in ['clip-rule',
-                             'display-align',
-                             'fill', 'fill-opacity', 'fill-rule',
-                             'font', 'font-family', 'font-size', 'font-size-adjust', 'font-stretch',
-                             'font-style', 'font-variant', 'font-weight',
-                             'letter-spacing',
-                             'pointer-events', 'shape-rendering',
-                             'stroke', 'stroke-dasharray', 'stroke-dashoffset', 'stroke-linecap', 'stroke-linejoin',
-                             'stroke-miterlimit', 'stroke-opacity', 'stroke-width',
-                             'text-anchor', 'text-decoration', 'text-rendering', 'visibility',
-                             'word-spacing', 'writing-mode']:
+        if attr.nodeName in inheritableProperties:
             # we just add all the attributes from the first child
             commonAttrs[attr.nodeName] = attr.nodeValue
 
@@ -1140,19 +1425,32 @@ def moveCommonAttributesToParentGroup(elem, referencedElements):
         for child in childElements:
             child.removeAttribute(name)
         elem.setAttribute(name, commonAttrs[name])
+    if commonAttrs:
+        for child in childElements:
+            ref_index.update(child)
+        ref_index.update(elem)
 
     # update our statistic (we remove N*M attributes and add back in M attributes)
     num += (len(childElements) - 1) * len(commonAttrs)
     return num
 
 
-def mergeSiblingGroupsWithCommonAttributes(elem):
+def mergeSiblingGroupsWithCommonAttributes(elem, ref_index=None):
     """
     Merge two or more sibling <g> elements with the identical attributes.
 
-    This function acts recursively on the given element.
+    This function acts on the given element and all its descendants.
     """
 
+    num = 0
+    # (the children of each element are only walked after its groups were merged)
+    for node in iter_elements(elem):
+        num += _mergeSiblingGroups(node, ref_index)
+    return num
+
+
+def _mergeSiblingGroups(elem, ref_index):
+    # merges the sibling groups among the children of elem, see mergeSiblingGroupsWithCommonAttributes()
     num = 0
     i = elem.childNodes.length - 1
     while i >= 0:
@@ -1197,24 +1495,23 @@ def mergeSiblingGroupsWithCommonAttributes(elem):
         primaryGroup = elem.childNodes.item(runStart)
         runStart += 1
         nodes = elem.childNodes[runStart:runEnd+1]
+        # (the run contains no other elements, so appending the children of the following groups to the
+        # primary group keeps the document order for ref_index)
         for node in nodes:
             if node.nodeType == Node.ELEMENT_NODE and node.nodeName == 'g' and node.namespaceURI == NS['SVG']:
                 # Merge
                 for child in node.childNodes[:]:
                     primaryGroup.appendChild(child)
+                if ref_index is not None:
+                    ref_index.remove(node)
                 elem.removeChild(node).unlink()
             else:
                 primaryGroup.appendChild(node)
 
-    # each child gets the same treatment, recursively
-    for childNode in elem.childNodes:
-        if childNode.nodeType == Node.ELEMENT_NODE:
-            num += mergeSiblingGroupsWithCommonAttributes(childNode)
-
     return num
 
 
-def create_groups_for_common_attributes(elem, stats):
+def create_groups_for_common_attributes(elem, stats, ref_index=None):
     """
     Creates <g> elements to contain runs of 3 or more
     consecutive child elements having at least one common attribute.
@@ -1224,23 +1521,21 @@ def create_groups_for_common_attributes(elem, stats):
 
     If all children have a common attribute, an extra <g> is not created.
 
-    This function acts recursively on the given element.
+    This function acts on the given element and all its descendants.
     """
+    # (the children of each element are only walked after they were grouped)
+    for node in iter_elements(elem):
+        _create_groups_of_children(node, stats, ref_index)
+
+
+def _create_groups_of_children(elem, stats, ref_index):
+    # creates the groups among the children of elem, see create_groups_for_common_attributes()
 
     # TODO perhaps all of the Presentation attributes in http://www.w3.org/TR/SVG/struct.html#GElement
     # could be added here
     # Cyn: These attributes are the same as in moveAttributesToParentGroup, and must always be
-    for curAttr in ['clip-rule',
-                    'display-align',
-                    'fill', 'fill-opacity', 'fill-rule',
-                    'font', 'font-family', 'font-size', 'font-size-adjust', 'font-stretch',
-                    'font-style', 'font-variant', 'font-weight',
-                    'letter-spacing',
-                    'pointer-events', 'shape-rendering',
-                    'stroke', 'stroke-dasharray', 'stroke-dashoffset', 'stroke-linecap', 'stroke-linejoin',
-                    'stroke-miterlimit', 'stroke-opacity', 'stroke-width',
-                    'text-anchor', 'text-decoration', 'text-rendering', 'visibility',
-                    'word-spacing', 'writing-mode']:
+    # (i.e. inheritableProperties)
+    for curAttr in inheritableProperties:
         # Iterate through the children in reverse order, so item(i) for
         # items we have yet to visit still returns the correct nodes.
         curChild = elem.childNodes.length - 1
@@ -1325,6 +1620,8 @@ def create_groups_for_common_attributes(elem, stats):
                     # Include the group in elem's children.
                     elem.childNodes.insert(runStart, group)
                     group.parentNode = elem
+                    if ref_index is not None:
+                        ref_index.insert(group)
                     curChild = runStart - 1
                     stats.num_elements_removed -= 1
                 else:
@@ -1332,25 +1629,24 @@ def create_groups_for_common_attributes(elem, stats):
             else:
                 curChild -= 1
 
-    # each child gets the same treatment, recursively
-    for childNode in elem.childNodes:
-        if childNode.nodeType == Node.ELEMENT_NODE:
-            create_groups_for_common_attributes(childNode, stats)
-
 
-def removeUnusedAttributesOnParent(elem):
+def removeUnusedAttributesOnParent(elem, ref_index=None):
     """
-    This recursively calls this function on all children of the element passed in,
-    then removes any unused attributes on this elem if none of the children inherit it
+    This walks all descendants of the element passed in depth-first and (after its children)
+    removes any unused attributes on each element if none of its children inherit it
     """
     num = 0
+    for node, entering in walk(elem):
+        if not entering:
+            num += _removeUnusedAttributes(node, ref_index)
+    return num
 
-    childElements = []
-    # recurse first into the children (depth-first)
-    for child in elem.childNodes:
-        if child.nodeType == Node.ELEMENT_NODE:
-            childElements.append(child)
-            num += removeUnusedAttributesOnParent(child)
+
+def _removeUnusedAttributes(elem, ref_index):
+    # removes the attributes of elem not inherited by its children, see removeUnusedAttributesOnParent()
+    num = 0
+
+    childElements = child_elements(elem)
 
     # only process the children if there are more than one element
     if len(childElements) <= 1:
@@ -1361,17 +1657,7 @@ def removeUnusedAttributesOnParent(elem):
     unusedAttrs = {}
     for index in range(attrList.length):
         attr = attrList.item(index)
-        if attr.nodeName in ['clip-rule',
-                             'display-align',
-                             'fill', 'fill-opacity', 'fill-rule',
-                             'font', 'font-family', 'font-size', 'font-size-adjust', 'font-stretch',
-                             'font-style', 'font-variant', 'font-weight',
-                             'letter-spacing',
-                             'pointer-events', 'shape-rendering',
-                             'stroke', 'stroke-dasharray', 'stroke-dashoffset', 'stroke-linecap', 'stroke-linejoin',
-                             'stroke-miterlimit', 'stroke-opacity', 'stroke-width',
-                             'text-anchor', 'text-decoration', 'text-rendering', 'visibility',
-                             'word-spacing', 'writing-mode']:
+        if attr.nodeName in inheritableProperties:
             unusedAttrs[attr.nodeName] = attr.nodeValue
 
     # for each child, if at least one child inherits the parent's attribute, then remove
@@ -1388,18 +1674,20 @@ def removeUnusedAttributesOnParent(elem):
     for name in unusedAttrs:
         elem.removeAttribute(name)
         num += 1
+    if unusedAttrs and ref_index is not None:
+        ref_index.update(elem)
 
     return num
 
 
-def remove_duplicate_gradient_stops(doc, stats):
+def remove_duplicate_gradient_stops(doc, stats, ref_index):
     num = 0
 
     for gradType in ['linearGradient', 'radialGradient']:
-        for grad in doc.getElementsByTagName(gradType):
+        for grad in ref_index.elements_with_tag(gradType):
             stops = {}
             stopsToRemove = []
-            for stop in grad.getElementsByTagName('stop'):
+            for stop in get_elements_by_tag_name(grad, 'stop'):
                 # convert percentages into a floating point number
                 offsetU = SVGLength(stop.getAttribute('offset'))
                 if offsetU.units == Unit.PCT:
@@ -1424,6 +1712,7 @@ def remove_duplicate_gradient_stops(doc, stats):
                 stops[offset] = [color, opacity, style]
 
             for stop in stopsToRemove:
+                ref_index.remove(stop)
                 stop.parentNode.removeChild(stop)
             num += len(stopsToRemove)
             stats.num_elements_removed += len(stopsToRemove)
@@ -1431,16 +1720,27 @@ def remove_duplicate_gradient_stops(doc, stats):
     return num
 
 
-def collapse_singly_referenced_gradients(doc, stats):
+def collapse_singly_referenced_gradients(doc, stats, ref_index):
+    """
+    Collapses gradients that are only referenced by one other gradient into it.
+
+    Collapsing changes the references of the gradients involved, the IDs concerned are
+    put on a worklist and checked again so chains of gradients are collapsed in one pass.
+
+    Returns the number of gradients removed.
+    """
     num = 0
 
-    identifiedElements = findElementsWithId(doc.documentElement)
+    identifiedElements = ref_index.elements
 
-    # make sure to reset the ref'ed ids for when we are running this in testscour
-    for rid, nodes in six.iteritems(findReferencedElements(doc.documentElement)):
+    # (ref_index changes while gradients are collapsed, so look up the referencing nodes for each ID)
+    worklist = deque(ref_index.referrers)
+    while worklist:
+        rid = worklist.popleft()
+        nodes = ref_index.referrers.get(rid)
         # Make sure that there's actually a defining element for the current ID name.
         # (Cyn: I've seen documents with #id references but no element with that ID!)
-        if len(nodes) == 1 and rid in identifiedElements:
+        if nodes is not None and len(nodes) == 1 and rid in identifiedElements:
             elem = identifiedElements[rid]
             if (
                 elem is not None and
@@ -1449,16 +1749,17 @@ def collapse_singly_referenced_gradients(doc, stats):
                 elem.namespaceURI == NS['SVG']
             ):
                 # found a gradient that is referenced by only 1 other element
-                refElem = nodes.pop()
+                refElem = next(iter(nodes))
                 if refElem.nodeType == Node.ELEMENT_NODE and refElem.nodeName in ['linearGradient', 'radialGradient'] \
                         and refElem.namespaceURI == NS['SVG']:
                     # elem is a gradient referenced by only one other gradient (refElem)
 
                     # add the stops to the referencing gradient (this removes them from elem)
-                    if len(refElem.getElementsByTagName('stop')) == 0:
-                        stopsToAdd = elem.getElementsByTagName('stop')
+                    if len(get_elements_by_tag_name(refElem, 'stop')) == 0:
+                        stopsToAdd = get_elements_by_tag_name(elem, 'stop')
                         for stop in stopsToAdd:
                             refElem.appendChild(stop)
+                            ref_index.insert(stop)
 
                     # adopt the gradientUnits, spreadMethod,  gradientTransform attributes if
                     # they are unspecified on refElem
@@ -1481,17 +1782,26 @@ def collapse_singly_referenced_gradients(doc, stats):
                                 refElem.setAttributeNS(None, attr, elem.getAttribute(attr))
 
                     target_href = elem.getAttributeNS(NS['XLINK'], 'href')
+                    # (refElem may collapse several gradients of a chain, so change the value of its
+                    # xlink:href attribute in place: setAttributeNS() would drop the prefix of the
+                    # attribute, after which minidom fails to remove it)
+                    href = refElem.getAttributeNodeNS(NS['XLINK'], 'href')
                     if target_href:
                         # If the elem node had an xlink:href, then the
                         # refElem have to point to it as well to
                         # preserve the semantics of the image.
-                        refElem.setAttributeNS(NS['XLINK'], 'href', target_href)
-                    else:
+                        if href is not None:
+                            href.value = target_href
+                        else:
+                            refElem.setAttributeNS(NS['XLINK'], 'href', target_href)
+                    elif href is not None:
                         # The elem node had no xlink:href reference,
                         # so we can simply remove the attribute.
-                        refElem.removeAttributeNS(NS['XLINK'], 'href')
+                        refElem.removeAttributeNode(href)
+                    worklist.extend(ref_index.update(refElem))
 
                     # now delete elem
+                    worklist.extend(ref_index.remove(elem))
                     elem.parentNode.removeChild(elem)
                     stats.num_elements_removed += 1
                     num += 1
@@ -1511,7 +1821,7 @@ def computeGradientBucketKey(grad):
     # radialGradient (and vice versa)
     subKeys = [grad.getAttribute(a) for a in gradBucketAttr]
     subKeys.append(grad.getAttributeNS(NS['XLINK'], 'href'))
-    stops = grad.getElementsByTagName('stop')
+    stops = get_elements_by_tag_name(grad, 'stop')
     if stops.length:
         for i in range(stops.length):
             stop = stops.item(i)
@@ -1572,7 +1882,7 @@ def detect_duplicate_gradients(*grad_lists):
             yield master_id, duplicates_ids, duplicates
 
 
-def dedup_gradient(master_id, duplicates_ids, duplicates, referenced_ids):
+def dedup_gradient(master_id, duplicates_ids, duplicates, ref_index):
     func_iri = None
     for dup_id, dup_grad in zip(duplicates_ids, duplicates):
         # if the duplicate gradient no longer has a parent that means it was
@@ -1582,12 +1892,13 @@ def dedup_gradient(master_id, duplicates_ids, duplicates, referenced_ids):
 
         # With --keep-unreferenced-defs, we can end up with
         # unreferenced gradients.  See GH#156.
-        if dup_id in referenced_ids:
+        if dup_id in ref_index.referrers:
             if func_iri is None:
                 # matches url(#<ANY_DUP_ID>), url('#<ANY_DUP_ID>') and url("#<ANY_DUP_ID>")
                 dup_id_regex = "|".join(duplicates_ids)
                 func_iri = re.compile('url\\([\'"]?#(?:' + dup_id_regex + ')[\'"]?\\)')
-            for elem in referenced_ids[dup_id]:
+            # (copied as updating ref_index changes the set of referencing nodes)
+            for elem in list(ref_index.referrers[dup_id]):
                 # find out which attribute referenced the duplicate gradient
                 for attr in ['fill', 'stroke']:
                     v = elem.getAttribute(attr)
@@ -1603,80 +1914,152 @@ def dedup_gradient(master_id, duplicates_ids, duplicates, referenced_ids):
                     if n > 0:
                         styles[style] = v_new
                 _setStyle(elem, styles)
+                ref_index.update(elem)
 
         # now that all referencing elements have been re-mapped to the master
         # it is safe to remove this gradient from the document
+        ref_index.remove(dup_grad)
         dup_grad.parentNode.removeChild(dup_grad)
 
-    # If the gradients have an ID, we update referenced_ids to match the newly remapped IDs.
-    # This enable us to avoid calling findReferencedElements once per loop, which is helpful as it is
-    # one of the slowest functions in scour.
-    if master_id:
-        try:
-            master_references = referenced_ids[master_id]
-        except KeyError:
-            master_references = set()
-
-        for dup_id in duplicates_ids:
-            references = referenced_ids.pop(dup_id, None)
-            if references is None:
-                continue
-            master_references.update(references)
-
-        # Only necessary but needed if the master gradient did
-        # not have any references originally
-        referenced_ids[master_id] = master_references
 
-
-def removeDuplicateGradients(doc):
+def removeDuplicateGradients(doc, ref_index):
     prev_num = -1
     num = 0
 
-    # get a collection of all elements that are referenced and their referencing elements
-    referenced_ids = findReferencedElements(doc.documentElement)
-
     while prev_num != num:
         prev_num = num
 
-        linear_gradients = doc.getElementsByTagName('linearGradient')
-        radial_gradients = doc.getElementsByTagName('radialGradient')
+        linear_gradients = ref_index.elements_with_tag('linearGradient')
+        radial_gradients = ref_index.elements_with_tag('radialGradient')
 
         for master_id, duplicates_ids, duplicates in detect_duplicate_gradients(linear_gradients, radial_gradients):
-            dedup_gradient(master_id, duplicates_ids, duplicates, referenced_ids)
+            dedup_gradient(master_id, duplicates_ids, duplicates, ref_index)
             num += len(duplicates)
 
     return num
 
 
-def _getStyle(node):
-    u"""Returns the style attribute of a node as a dictionary."""
-    if node.nodeType != Node.ELEMENT_NODE:
-        return {}
-    style_attribute = node.getAttribute('style')
-    if style_attribute:
-        styleMap = {}
-        rawStyles = style_attribute.split(';')
-        for style in rawStyles:
+class StyleMap(dict):
+    u"""
+    The parsed style attribute of an element (as returned by ``_getStyle()``).
+
+    Remembers the attribute value it was parsed from ('source') and whether it was
+    changed since ('dirty'), so ``_setStyle()`` only has to write it back if necessary.
+    """
+
+    __slots__ = ('source', 'dirty')
+
+    def __init__(self, source=''):
+        dict.__init__(self)
+        for style in source.split(';'):
             propval = style.split(':')
             if len(propval) == 2:
-                styleMap[propval[0].strip()] = propval[1].strip()
+                dict.__setitem__(self, propval[0].strip(), propval[1].strip())
+        self.source = source
+        # values that are not in normalized form need to be written back even if nothing is changed
+        self.dirty = source != self.serialize()
+
+    def serialize(self):
+        return ';'.join(prop + ':' + self[prop] for prop in self)
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self.dirty = True
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self.dirty = True
+
+    def pop(self, *args):
+        self.dirty = True
+        return dict.pop(self, *args)
+
+    def popitem(self):
+        self.dirty = True
+        return dict.popitem(self)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        dict.update(self, *args, **kwargs)
+        self.dirty = True
+
+    def clear(self):
+        dict.clear(self)
+        self.dirty = True
+
+    def copy(self):
+        styleMap = StyleMap()
+        dict.update(styleMap, self)
+        styleMap.source = self.source
+        styleMap.dirty = self.dirty
         return styleMap
-    else:
+
+
+def _getStyle(node):
+    u"""
+    Returns the style attribute of a node as a dictionary.
+
+    Each distinct value of a style attribute is only parsed once (see STYLE_CACHE_SIZE). The returned
+    ``StyleMap`` is a copy owned by the caller, so changes made to it only take effect when they are
+    written back by ``_setStyle()``.
+    """
+    if node.nodeType != Node.ELEMENT_NODE:
         return {}
+    style_attribute = node.getAttribute('style')
+    if not style_attribute:
+        return StyleMap()
+    styleMap = _style_cache.get(style_attribute)
+    if styleMap is None:
+        styleMap = StyleMap(style_attribute)
+        _style_cache.put(style_attribute, styleMap)
+    return styleMap.copy()
 
 
 def _setStyle(node, styleMap):
     u"""Sets the style attribute of a node to the dictionary ``styleMap``."""
-    fixedStyle = ';'.join(prop + ':' + styleMap[prop] for prop in styleMap)
+    if (isinstance(styleMap, StyleMap) and not styleMap.dirty
+            and styleMap.source == node.getAttribute('style')):
+        # unchanged since it was parsed from the current value
+        return node
+    if isinstance(styleMap, StyleMap):
+        fixedStyle = styleMap.serialize()
+    else:
+        fixedStyle = ';'.join(prop + ':' + styleMap[prop] for prop in styleMap)
     if fixedStyle != '':
         node.setAttribute('style', fixedStyle)
     elif node.getAttribute('style'):
         node.removeAttribute('style')
+    if isinstance(styleMap, StyleMap):
+        styleMap.source = fixedStyle
+        styleMap.dirty = False
     return node
 
 
-def repairStyle(node, options):
+def repairStyle(node, options, inherited=None, computedStyles=None):
+    num = 0
+
+    # whether the properties of each element are inherited by its children is answered from a summary
+    # computed in advance (repairStyle() only changes elements after their ancestors, so it stays valid)
+    if inherited is None:
+        inherited = {}
+        summarizeStylesInheritedByChildren(node, inherited)
+    # the values inherited from the parents are resolved (once per element) when they are needed
+    if computedStyles is None:
+        computedStyles = ComputedStyles()
+
+    for elem in iter_elements(node):
+        num += _repairStyleOfElement(elem, options, inherited, computedStyles)
+    return num
+
+
+def _repairStyleOfElement(node, options, inherited, computedStyles):
+    # repairs the style of node alone, see repairStyle()
     num = 0
+
     styleMap = _getStyle(node)
     if styleMap:
 
@@ -1700,7 +2083,7 @@ def repairStyle(node, options):
                 for uselessStyle in ['fill', 'fill-opacity', 'fill-rule', 'stroke', 'stroke-linejoin',
                                      'stroke-opacity', 'stroke-miterlimit', 'stroke-linecap', 'stroke-dasharray',
                                      'stroke-dashoffset', 'stroke-opacity']:
-                    if uselessStyle in styleMap and not styleInheritedByChild(node, uselessStyle):
+                    if uselessStyle in styleMap and not styleInheritedByChild(node, uselessStyle, summary=inherited):
                         del styleMap[uselessStyle]
                         num += 1
 
@@ -1709,19 +2092,19 @@ def repairStyle(node, options):
         if 'stroke' in styleMap and styleMap['stroke'] == 'none':
             for strokestyle in ['stroke-width', 'stroke-linejoin', 'stroke-miterlimit',
                                 'stroke-linecap', 'stroke-dasharray', 'stroke-dashoffset', 'stroke-opacity']:
-                if strokestyle in styleMap and not styleInheritedByChild(node, strokestyle):
+                if strokestyle in styleMap and not styleInheritedByChild(node, strokestyle, summary=inherited):
                     del styleMap[strokestyle]
                     num += 1
             # we need to properly calculate computed values
-            if not styleInheritedByChild(node, 'stroke'):
-                if styleInheritedFromParent(node, 'stroke') in [None, 'none']:
+            if not styleInheritedByChild(node, 'stroke', summary=inherited):
+                if styleInheritedFromParent(node, 'stroke', computedStyles) in [None, 'none']:
                     del styleMap['stroke']
                     num += 1
 
         #  if fill:none, then remove all fill-related properties (fill-rule, etc)
         if 'fill' in styleMap and styleMap['fill'] == 'none':
             for fillstyle in ['fill-rule', 'fill-opacity']:
-                if fillstyle in styleMap and not styleInheritedByChild(node, fillstyle):
+                if fillstyle in styleMap and not styleInheritedByChild(node, fillstyle, summary=inherited):
                     del styleMap[fillstyle]
                     num += 1
 
@@ -1730,7 +2113,8 @@ def repairStyle(node, options):
             fillOpacity = float(styleMap['fill-opacity'])
             if fillOpacity == 0.0:
                 for uselessFillStyle in ['fill', 'fill-rule']:
-                    if uselessFillStyle in styleMap and not styleInheritedByChild(node, uselessFillStyle):
+                    if (uselessFillStyle in styleMap
+                            and not styleInheritedByChild(node, uselessFillStyle, summary=inherited)):
                         del styleMap[uselessFillStyle]
                         num += 1
 
@@ -1740,7 +2124,8 @@ def repairStyle(node, options):
             if strokeOpacity == 0.0:
                 for uselessStrokeStyle in ['stroke', 'stroke-width', 'stroke-linejoin', 'stroke-linecap',
                                            'stroke-dasharray', 'stroke-dashoffset']:
-                    if uselessStrokeStyle in styleMap and not styleInheritedByChild(node, uselessStrokeStyle):
+                    if (uselessStrokeStyle in styleMap
+                            and not styleInheritedByChild(node, uselessStrokeStyle, summary=inherited)):
                         del styleMap[uselessStrokeStyle]
                         num += 1
 
@@ -1750,7 +2135,8 @@ def repairStyle(node, options):
             if strokeWidth.value == 0.0:
                 for uselessStrokeStyle in ['stroke', 'stroke-linejoin', 'stroke-linecap',
                                            'stroke-dasharray', 'stroke-dashoffset', 'stroke-opacity']:
-                    if uselessStrokeStyle in styleMap and not styleInheritedByChild(node, uselessStrokeStyle):
+                    if (uselessStrokeStyle in styleMap
+                            and not styleInheritedByChild(node, uselessStrokeStyle, summary=inherited)):
                         del styleMap[uselessStrokeStyle]
                         num += 1
 
@@ -1801,18 +2187,92 @@ def repairStyle(node, options):
                     del styleMap[propName]
 
         _setStyle(node, styleMap)
-
-    # recurse for our child elements
-    for child in node.childNodes:
-        num += repairStyle(child, options)
+        computedStyles.invalidate(node)
 
     return num
 
 
-def styleInheritedFromParent(node, style):
+class ComputedStyles(object):
+    """
+    Cache of the values of the inheritableProperties of elements, i.e. the values set by their
+    presentation attributes and inline styles or else inherited from their parents.
+
+    The values of an element are resolved (from the values of its parent) the first time they are
+    needed. Passes changing the properties of an element that may be in the cache have to call
+    invalidate() for it.
+
+    Warning: This only considers presentation attributes and inline styles,
+             any style sheets are ignored!
+    """
+
+    properties = frozenset(inheritableProperties)
+
+    def __init__(self):
+        self._values = {}
+
+    def values(self, elem):
+        """
+        Returns a dictionary with the values of the properties of elem (which must not be changed).
+        """
+        values = self._values.get(elem)
+        if values is None:
+            # resolve the values of the ancestors that are not cached yet first (from the top down)
+            ancestors = [elem]
+            values = {}
+            parentNode = elem.parentNode
+            while parentNode is not None and parentNode.nodeType == Node.ELEMENT_NODE:
+                parentValues = self._values.get(parentNode)
+                if parentValues is not None:
+                    values = parentValues
+                    break
+                ancestors.append(parentNode)
+                parentNode = parentNode.parentNode
+            for ancestor in reversed(ancestors):
+                values = self._resolve(ancestor, values)
+        return values
+
+    def _resolve(self, elem, values):
+        # caches and returns the values of elem given the values of its parent
+        # styles take precedence over presentation attributes
+        definedValues = {}
+        for name in self.properties.intersection(elem.attributes.keys()):
+            value = elem.getAttribute(name)
+            if value not in ['', 'inherit']:
+                definedValues[name] = value
+        for name, value in six.iteritems(_getStyle(elem)):
+            if name in self.properties and value != 'inherit':
+                definedValues[name] = value
+        # (elements that don't set any properties share the values of their parent)
+        if definedValues:
+            values = dict(values)
+            values.update(definedValues)
+        self._values[elem] = values
+        return values
+
+    def invalidate(self, elem):
+        """
+        Discards the cached values of elem and its descendants.
+        """
+        # (the values of an element are only cached if those of its parent are)
+        stack = [elem]
+        while stack:
+            elem = stack.pop()
+            if self._values.pop(elem, None) is not None:
+                stack.extend(child_elements(elem))
+
+
+# elements only passing on inherited styles to their children (they don't render anything themselves)
+containerElements = ['a', 'defs', 'glyph', 'g', 'marker', 'mask',
+                     'missing-glyph', 'pattern', 'svg', 'switch', 'symbol']
+
+
+def styleInheritedFromParent(node, style, computedStyles=None):
     """
     Returns the value of 'style' that is inherited from the parents of the passed-in node
 
+    If a ComputedStyles cache is passed in, the value is looked up in it (if it
+    is one of the inheritableProperties) instead of searching the parents.
+
     Warning: This method only considers presentation attributes and inline styles,
              any style sheets are ignored!
     """
@@ -1822,23 +2282,28 @@ def styleInheritedFromParent(node, style):
     if parentNode.nodeType == Node.DOCUMENT_NODE:
         return None
 
-    # check styles first (they take precedence over presentation attributes)
-    styles = _getStyle(parentNode)
-    if style in styles:
-        value = styles[style]
-        if not value == 'inherit':
-            return value
+    if computedStyles is not None and style in computedStyles.properties:
+        return computedStyles.values(parentNode).get(style)
+
+    while parentNode.nodeType != Node.DOCUMENT_NODE:
+        # check styles first (they take precedence over presentation attributes)
+        styles = _getStyle(parentNode)
+        if style in styles:
+            value = styles[style]
+            if not value == 'inherit':
+                return value
 
-    # check attributes
-    value = parentNode.getAttribute(style)
-    if value not in ['', 'inherit']:
-        return parentNode.getAttribute(style)
+        # check attributes
+        value = parentNode.getAttribute(style)
+        if value not in ['', 'inherit']:
+            return parentNode.getAttribute(style)
 
-    # check the next parent recursively if we did not find a value yet
-    return styleInheritedFromParent(parentNode, style)
+        # check the next parent if we did not find a value yet
+        parentNode = parentNode.parentNode
+    return None
 
 
-def styleInheritedByChild(node, style, nodeIsChild=False):
+def styleInheritedByChild(node, style, nodeIsChild=False, summary=None):
     """
     Returns whether 'style' is inherited by any children of the passed-in node
 
@@ -1848,6 +2313,9 @@ def styleInheritedByChild(node, style, nodeIsChild=False):
     If True is returned, the passed-in node should not have its text-based
     attributes removed.
 
+    If a summary computed by summarizeStylesInheritedByChildren() is passed in,
+    the result is looked up instead of searching the children.
+
     Warning: This method only considers presentation attributes and inline styles,
              any style sheets are ignored!
     """
@@ -1855,32 +2323,33 @@ def styleInheritedByChild(node, style, nodeIsChild=False):
     if node.nodeType != Node.ELEMENT_NODE:
         return False
 
+    if summary is not None and not nodeIsChild and node in summary:
+        return _containsStyle(summary[node], style)
+
     if nodeIsChild:
         # if the current child node sets a new value for 'style'
         # we can stop the search in the current branch of the DOM tree
-
-        # check attributes
-        if node.getAttribute(style) not in ['', 'inherit']:
-            return False
-        # check styles
-        styles = _getStyle(node)
-        if (style in styles) and not (styles[style] == 'inherit'):
+        if _definesStyle(node, style):
             return False
     else:
         # if the passed-in node does not have any children 'style' can obviously not be inherited
         if not node.childNodes:
             return False
 
-    # If we have child nodes recursively check those
-    if node.childNodes:
-        for child in node.childNodes:
-            if styleInheritedByChild(child, style, True):
-                return True
+    # If we have child nodes check those: 'style' is inherited by any descendant element not setting it
+    # that is not a container element (container elements pass it on to their children in turn)
+    def passesOnStyle(elem):
+        return elem is node or (elem.nodeName in containerElements and not _definesStyle(elem, style))
+
+    descendants = iter_elements(node, passesOnStyle)
+    next(descendants)
+    for elem in descendants:
+        if elem.nodeName not in containerElements and not _definesStyle(elem, style):
+            return True
 
     # If the current element is a container element the inherited style is meaningless
     # (since we made sure it's not inherited by any of its children)
-    if node.nodeName in ['a', 'defs', 'glyph', 'g', 'marker', 'mask',
-                         'missing-glyph', 'pattern', 'svg', 'switch', 'symbol']:
+    if node.nodeName in containerElements:
         return False
 
     # in all other cases we have to assume the inherited value of 'style' is meaningful and has to be kept
@@ -1888,6 +2357,82 @@ def styleInheritedByChild(node, style, nodeIsChild=False):
     return True
 
 
+def _definesStyle(elem, style):
+    # whether elem sets a new value for 'style' (with an attribute or its style), see styleInheritedByChild()
+    if elem.getAttribute(style) not in ['', 'inherit']:
+        return True
+    styles = _getStyle(elem)
+    return (style in styles) and not (styles[style] == 'inherit')
+
+
+# Sets of properties as used by summarizeStylesInheritedByChildren(), i.e. tuples of
+# (complement, properties) where complement means "all properties except these".
+_NO_STYLES = (False, frozenset())
+_ALL_STYLES = (True, frozenset())
+
+
+def _containsStyle(styles, style):
+    complement, properties = styles
+    return (style not in properties) if complement else (style in properties)
+
+
+def _unionOfStyles(a, b):
+    if a[0] and b[0]:
+        return True, a[1] & b[1]
+    if a[0]:
+        return True, a[1] - b[1]
+    if b[0]:
+        return True, b[1] - a[1]
+    return False, a[1] | b[1]
+
+
+def summarizeStylesInheritedByChildren(node, summary):
+    """
+    Computes styleInheritedByChild(element, style) for all elements of the subtree rooted at node
+    and all styles at once in a single (post-order) traversal and adds the results to the
+    dictionary 'summary' (element -> set of styles inherited by its children).
+
+    Returns the set of styles node itself inherits from its parent, i.e. the result of
+    styleInheritedByChild(node, style, nodeIsChild=True) for all styles.
+
+    The summary is only valid as long as the subtree is not changed (changing an element
+    itself does not invalidate its own entry, though).
+    """
+    if node.nodeType != Node.ELEMENT_NODE:
+        return _NO_STYLES
+
+    # the union of the styles inherited by the children walked so far, for each open element
+    stack = []
+    for elem, entering in walk(node):
+        if entering:
+            stack.append(_NO_STYLES)
+            continue
+
+        inheritedByChildren = stack.pop()
+
+        # (see styleInheritedByChild() for the cases)
+        if elem.nodeName in containerElements:
+            inherited = inheritedByChildren
+        else:
+            inherited = _ALL_STYLES
+        if elem.childNodes:
+            summary[elem] = inherited
+        else:
+            summary[elem] = _NO_STYLES
+
+        # styles set on elem itself are not inherited from its parent
+        definedStyles = set(attr.nodeName for attr in elem.attributes.values()
+                            if attr.nodeValue not in ['', 'inherit'])
+        definedStyles.update(name for name, value in six.iteritems(_getStyle(elem)) if value != 'inherit')
+        if inherited[0]:
+            inheritedFromParent = (True, inherited[1] | definedStyles)
+        else:
+            inheritedFromParent = (False, inherited[1] - definedStyles)
+        if stack:
+            stack[-1] = _unionOfStyles(stack[-1], inheritedFromParent)
+    return inheritedFromParent
+
+
 def mayContainTextNodes(node):
     """
     Returns True if the passed-in node is probably a text element, or at least
@@ -1905,30 +2450,41 @@ def mayContainTextNodes(node):
     except AttributeError:
         pass
 
-    result = True  # Default value
-    # Comment, text and CDATA nodes don't have attributes and aren't containers
-    if node.nodeType != Node.ELEMENT_NODE:
-        result = False
-    # Non-SVG elements? Unknown elements!
-    elif node.namespaceURI != NS['SVG']:
-        result = True
-    # Blacklisted elements. Those are guaranteed not to be text elements.
-    elif node.nodeName in ['rect', 'circle', 'ellipse', 'line', 'polygon',
-                           'polyline', 'path', 'image', 'stop']:
-        result = False
-    # Group elements. If we're missing any here, the default of True is used.
-    elif node.nodeName in ['g', 'clipPath', 'marker', 'mask', 'pattern',
-                           'linearGradient', 'radialGradient', 'symbol']:
-        result = False
-        for child in node.childNodes:
-            if mayContainTextNodes(child):
-                result = True
-    # Everything else should be considered a future SVG-version text element
-    # at best, or an unknown element at worst. result will stay True.
+    # the results of group elements depend on those of their children, so these are determined first
+    for descendant, entering in walk(node, _groupChildrenWithoutResult):
+        if entering:
+            continue
+
+        result = True  # Default value
+        # Comment, text and CDATA nodes don't have attributes and aren't containers
+        if descendant.nodeType != Node.ELEMENT_NODE:
+            result = False
+        # Non-SVG elements? Unknown elements!
+        elif descendant.namespaceURI != NS['SVG']:
+            result = True
+        # Blacklisted elements. Those are guaranteed not to be text elements.
+        elif descendant.nodeName in ['rect', 'circle', 'ellipse', 'line', 'polygon',
+                                     'polyline', 'path', 'image', 'stop']:
+            result = False
+        # Group elements. If we're missing any here, the default of True is used.
+        elif descendant.nodeName in _TEXT_GROUP_ELEMENTS:
+            result = any([child.mayContainTextNodes for child in descendant.childNodes])
+        # Everything else should be considered a future SVG-version text element
+        # at best, or an unknown element at worst. result will stay True.
+
+        # Cache this result.
+        descendant.mayContainTextNodes = result
+    return node.mayContainTextNodes
+
 
-    # Cache this result before returning it.
-    node.mayContainTextNodes = result
-    return result
+_TEXT_GROUP_ELEMENTS = ['g', 'clipPath', 'marker', 'mask', 'pattern', 'linearGradient', 'radialGradient', 'symbol']
+
+
+def _groupChildrenWithoutResult(node):
+    # the children of a group element whose result is not cached yet, see mayContainTextNodes()
+    if node.nodeType == Node.ELEMENT_NODE and node.namespaceURI == NS['SVG'] and node.nodeName in _TEXT_GROUP_ELEMENTS:
+        return [child for child in node.childNodes if not hasattr(child, 'mayContainTextNodes')]
+    return ()
 
 
 # A list of default attributes that are safe to remove if all conditions are fulfilled
@@ -2093,6 +2649,47 @@ for default_attribute in default_attributes:
             default_attributes_per_element[element].append(default_attribute)
 
 
+def run_element_visitors(element, visitors, options, states=None):
+    """
+    Runs several per-element rewrites in a single pre-order traversal of 'element' and its descendant elements.
+
+    Each visitor is called as visitor(element, options, state) and returns a tuple (num, child_state):
+    'num' is added to the visitor's total and 'child_state' is passed to the visitor for the children of
+    the element (the visitors get the corresponding item of 'states' for 'element' itself, None by default).
+    All visitors run on an element (in the given order) before its children are visited, so they see the
+    results of the previous visitors on the same element and of all visitors on its ancestors.
+
+    Returns the list of totals (one per visitor).
+    """
+    totals = [0] * len(visitors)
+    _run_element_visitors(element, visitors, options, states or [None] * len(visitors), totals)
+    return totals
+
+
+def _run_element_visitors(element, visitors, options, states, totals):
+    # the states for the children of the elements from element down to the current one
+    stack = [states]
+    for elem, entering in walk(element):
+        if entering:
+            stack.append(visit_element(elem, visitors, options, stack[-1], totals))
+        else:
+            stack.pop()
+
+
+def visit_element(element, visitors, options, states, totals):
+    """
+    Runs the visitors (see run_element_visitors()) on 'element' alone, adding their results to 'totals'.
+
+    Returns the states for the children of the element.
+    """
+    childStates = []
+    for i, visitor in enumerate(visitors):
+        num, state = visitor(element, options, states[i])
+        totals[i] += num
+        childStates.append(state)
+    return childStates
+
+
 def taint(taintedSet, taintedAttribute):
     u"""Adds an attribute to a set of attributes.
 
@@ -2138,12 +2735,18 @@ def removeDefaultAttributeValues(node, options, tainted=None):
     u"""'tainted' keeps a set of attributes defined in parent nodes.
 
     For such attributes, we don't delete attributes with default values."""
-    num = 0
     if node.nodeType != Node.ELEMENT_NODE:
         return 0
+    return run_element_visitors(node, [remove_default_attribute_values_visitor], options, [tainted])[0]
+
 
-    if tainted is None:
-        tainted = set()
+def remove_default_attribute_values_visitor(node, options, tainted):
+    u"""Removes the default attribute values of a single element (see removeDefaultAttributeValues()).
+
+    Returns the attributes defined on the element or its parents as the state for the children."""
+    num = 0
+    # (every child continues with its own copy of the attributes defined by its parents)
+    tainted = set() if tainted is None else tainted.copy()
 
     # Conditionally remove all default attributes defined in 'default_attributes' (a list of 'DefaultAttribute's)
     #
@@ -2157,7 +2760,7 @@ def removeDefaultAttributeValues(node, options, tainted=None):
             num += removeDefaultAttributeValue(node, attribute)
 
     # Summarily get rid of default properties
-    attributes = [node.attributes.item(i).nodeName for i in range(node.attributes.length)]
+    attributes = [attr.nodeName for attr in attribute_nodes(node)]
     for attribute in attributes:
         if attribute not in tainted:
             if attribute in default_properties:
@@ -2178,11 +2781,7 @@ def removeDefaultAttributeValues(node, options, tainted=None):
                     tainted = taint(tainted, attribute)
     _setStyle(node, styles)
 
-    # recurse for our child elements
-    for child in node.childNodes:
-        num += removeDefaultAttributeValues(child, options, tainted.copy())
-
-    return num
+    return num, tainted
 
 
 rgb = re.compile(r"\s*rgb\(\s*(\d+)\s*,\s*(\d+)\s*,\s*(\d+)\s*\)\s*")
@@ -2222,13 +2821,22 @@ def convertColor(value):
 
 def convertColors(element):
     """
-       Recursively converts all color properties into #RRGGBB format if shorter
+       Converts all color properties of the element and its descendants into #RRGGBB format if shorter
     """
     numBytes = 0
 
     if element.nodeType != Node.ELEMENT_NODE:
         return 0
 
+    for elem in iter_elements(element):
+        numBytes += _convertColorsOfElement(elem)
+    return numBytes
+
+
+def _convertColorsOfElement(element):
+    # converts the color properties of element alone, see convertColors()
+    numBytes = 0
+
     # set up list of color attributes for each element type
     attrsToConvert = []
     if element.nodeName in ['rect', 'circle', 'ellipse', 'polygon',
@@ -2261,12 +2869,106 @@ def convertColors(element):
                 numBytes += (oldBytes - newBytes)
     _setStyle(element, styles)
 
-    # now recurse for our child elements
-    for child in element.childNodes:
-        numBytes += convertColors(child)
-
     return numBytes
 
+
+class LRUCache(object):
+    """
+    A mapping holding at most 'size' entries, discarding the least recently used entry when full.
+
+    Counts the hits and misses of get() and may be used from several threads at the same time
+    (like a Scourer, see there).
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            # re-insert as the most recently used entry
+            self._entries[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            if len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class BoundedCache(object):
+    """
+    A mapping holding at most 'size' entries, which simply forgets all entries when full.
+
+    A lot cheaper than an LRUCache (a miss costs hardly more than not caching at all), so it suits
+    small values looked up very often. Counts the hits and misses of get(); as there is no locking,
+    the counts are only approximate if used from several threads at the same time.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+
+    def get(self, key, default=None):
+        value = self._entries.get(key, default)
+        if value is default:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if len(self._entries) >= self.size:
+            self._entries.clear()
+        self._entries[key] = value
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Cleaned path data (see clean_path()), kept for the lifetime of the process, i.e. across all
+# documents of a batch or server run. Only path data up to PATH_CACHE_MAX_LENGTH characters is
+# cached (paths repeated within or across documents like icons, markers or glyphs are usually short,
+# while keeping very long ones around could use large amounts of memory).
+PATH_CACHE_SIZE = 1024
+PATH_CACHE_MAX_LENGTH = 16384
+_path_cache = LRUCache(PATH_CACHE_SIZE)
+
+# Scoured numbers (see scourUnitlessLength()), also kept for the lifetime of the process.
+NUMBER_CACHE_SIZE = 4096
+_number_cache = BoundedCache(NUMBER_CACHE_SIZE)
+
+# Parsed style attributes (see _getStyle()), also kept for the lifetime of the process.
+STYLE_CACHE_SIZE = 4096
+_style_cache = BoundedCache(STYLE_CACHE_SIZE)
+
 # TODO: go over what this method does and see if there is a way to optimize it
 # TODO: go over the performance of this method and see if I can save memory/speed by
 #       reusing data structures, etc
@@ -2277,9 +2979,7 @@ def clean_path(element, options, stats):
        Cleans the path string (d attribute) of the element
     """
 
-    # this gets the parser object from svg_regex.py
     oldPathStr = element.getAttribute('d')
-    path = svg_parser.parse(oldPathStr)
     style = _getStyle(element)
 
     # This determines whether the stroke has round or square linecaps.  If it does, we do not want to collapse empty
@@ -2298,6 +2998,25 @@ def clean_path(element, options, stats):
         or 'marker-mid' in style
     )
 
+    # the same path data is always cleaned the same way for the same options (affecting the output) and flags,
+    # so take the result (and the statistics) from the cache if it was already cleaned before
+    cache_key = None
+    if len(oldPathStr) <= PATH_CACHE_MAX_LENGTH:
+        cache_key = (oldPathStr, options.scouring_context.prec, options.scouring_context_c.prec,
+                     options.renderer_workaround, has_round_or_square_linecaps, has_intermediate_markers)
+        cached = _path_cache.get(cache_key)
+        if cached is not None:
+            newPathStr, num_path_segments_removed = cached
+            stats.num_path_segments_removed += num_path_segments_removed
+            if len(newPathStr) <= len(oldPathStr):
+                stats.num_bytes_saved_in_path_data += (len(oldPathStr) - len(newPathStr))
+                element.setAttribute('d', newPathStr)
+            return
+    num_path_segments_removed = stats.num_path_segments_removed
+
+    # this gets the parser object from svg_regex.py
+    path = svg_parser.parse(oldPathStr)
+
     # The first command must be a moveto, and whether it's relative (m)
     # or absolute (M), the first set of coordinates *is* absolute. So
     # the first iteration of the loop below will get x,y and startx,starty.
@@ -2710,7 +3429,7 @@ def clean_path(element, options, stats):
             elif cmd == 'l' and len(data) >= 4:
                 coordIndex = 0
                 while coordIndex+2 < len(data):
-                    if is_same_direction(*data[coordIndex:coordIndex+4]):
+                    if is_same_direction(*data[coordIndex:coordIndex+4], options=options):
                         data[coordIndex] += data[coordIndex+2]
                         data[coordIndex+1] += data[coordIndex+3]
                         del data[coordIndex+2]  # delete the next two elements
@@ -2723,7 +3442,7 @@ def clean_path(element, options, stats):
             elif cmd == 'm' and len(data) >= 6:
                 coordIndex = 2
                 while coordIndex+2 < len(data):
-                    if is_same_direction(*data[coordIndex:coordIndex+4]):
+                    if is_same_direction(*data[coordIndex:coordIndex+4], options=options):
                         data[coordIndex] += data[coordIndex+2]
                         data[coordIndex+1] += data[coordIndex+3]
                         del data[coordIndex+2]  # delete the next two elements
@@ -2759,6 +3478,8 @@ def clean_path(element, options, stats):
     path = newPath
 
     newPathStr = serializePath(path, options)
+    if cache_key is not None:
+        _path_cache.put(cache_key, (newPathStr, stats.num_path_segments_removed - num_path_segments_removed))
 
     # if for whatever reason we actually made the path longer don't use it
     # TODO: maybe we could compare path lengths after each optimization step and use the shortest
@@ -2895,11 +3616,11 @@ def serializePath(pathObj, options):
                    for cmd, data in pathObj)
 
 
-def serializeTransform(transformObj):
+def serializeTransform(transformObj, options):
     """
        Reserializes the transform data with some cleanups.
     """
-    return ' '.join(command + '(' + ' '.join(scourUnitlessLength(number) for number in numbers) + ')'
+    return ' '.join(command + '(' + ' '.join(scourUnitlessLength(number, options) for number in numbers) + ')'
                     for command, numbers in transformObj)
 
 
@@ -2917,7 +3638,7 @@ def scourCoordinates(data, options, force_whitespace=False, control_points=[], f
         previousCoord = ''
         for coord in data:
             is_control_point = c in control_points
-            scouredCoord = scourUnitlessLength(coord,
+            scouredCoord = scourUnitlessLength(coord, options,
                                                renderer_workaround=options.renderer_workaround,
                                                is_control_point=is_control_point)
             # don't output a space if this number starts with a dot (.) or minus sign (-); we only need a space if
@@ -2955,32 +3676,49 @@ def scourCoordinates(data, options, force_whitespace=False, control_points=[], f
     return ''
 
 
-def scourLength(length):
+def scourLength(length, options):
     """
     Scours a length. Accepts units.
     """
     length = SVGLength(length)
 
-    return scourUnitlessLength(length.value) + Unit.str(length.units)
+    return scourUnitlessLength(length.value, options) + Unit.str(length.units)
 
 
-def scourUnitlessLength(length, renderer_workaround=False, is_control_point=False):  # length is of a numeric type
+def scourUnitlessLength(length, options, renderer_workaround=False, is_control_point=False):  # length is numeric
     """
     Scours the numeric part of a length only. Does not accept units.
 
     This is faster than scourLength on elements guaranteed not to
     contain units.
+
+    The results are memoized (see NUMBER_CACHE_SIZE), as documents tend to use the same numbers over and over.
     """
+    if is_control_point:
+        context = options.scouring_context_c
+    else:
+        context = options.scouring_context
+
+    # (other numbers are converted from their string representation anyway, and while negative zeros
+    # are equal to zero, they are kept as such)
+    if not isinstance(length, Decimal) or not length:
+        length = str(length)
+    key = (length, context.prec, renderer_workaround)
+    return_value = _number_cache.get(key)
+    if return_value is None:
+        return_value = _scourUnitlessLength(length, context, renderer_workaround)
+        _number_cache.put(key, return_value)
+    return return_value
+
+
+def _scourUnitlessLength(length, context, renderer_workaround):
     if not isinstance(length, Decimal):
-        length = getcontext().create_decimal(str(length))
+        length = getcontext().create_decimal(length)
     initial_length = length
 
     # reduce numeric precision
     # plus() corresponds to the unary prefix plus operator and applies context precision and rounding
-    if is_control_point:
-        length = scouringContextC.plus(length)
-    else:
-        length = scouringContext.plus(length)
+    length = context.plus(length)
 
     # remove trailing zeroes as we do not care for significance
     intLength = length.to_integral_value()
@@ -3017,18 +3755,25 @@ def scourUnitlessLength(length, renderer_workaround=False, is_control_point=Fals
     return return_value
 
 
-def reducePrecision(element):
+def reducePrecision(element, options):
     """
     Because opacities, letter spacings, stroke widths and all that don't need
     to be preserved in SVG files with 9 digits of precision.
 
     Takes all of these attributes, in the given element node and its children,
-    and reduces their precision to the current Decimal context's precision.
+    and reduces their precision to the precision given in the options.
     Also checks for the attributes actually being lengths, not 'inherit', 'none'
     or anything that isn't an SVGLength.
 
     Returns the number of bytes saved after performing these reductions.
     """
+    return run_element_visitors(element, [reduce_precision_visitor], options)[0]
+
+
+def reduce_precision_visitor(element, options, state):
+    """
+    Reduces the precision of the attributes of a single element (see reducePrecision()).
+    """
     num = 0
 
     styles = _getStyle(element)
@@ -3041,7 +3786,7 @@ def reducePrecision(element):
         if val != '':
             valLen = SVGLength(val)
             if valLen.units != Unit.INVALID:  # not an absolute/relative size or inherit, can be % though
-                newVal = scourLength(val)
+                newVal = scourLength(val, options)
                 if len(newVal) < len(val):
                     num += len(val) - len(newVal)
                     element.setAttribute(lengthAttr, newVal)
@@ -3050,17 +3795,13 @@ def reducePrecision(element):
             val = styles[lengthAttr]
             valLen = SVGLength(val)
             if valLen.units != Unit.INVALID:
-                newVal = scourLength(val)
+                newVal = scourLength(val, options)
                 if len(newVal) < len(val):
                     num += len(val) - len(newVal)
                     styles[lengthAttr] = newVal
     _setStyle(element, styles)
 
-    for child in element.childNodes:
-        if child.nodeType == Node.ELEMENT_NODE:
-            num += reducePrecision(child)
-
-    return num
+    return num, None
 
 
 def optimizeAngle(angle):
@@ -3257,6 +3998,13 @@ def optimizeTransforms(element, options):
 
     Returns the number of bytes saved after performing these reductions.
     """
+    return run_element_visitors(element, [optimize_transforms_visitor], options)[0]
+
+
+def optimize_transforms_visitor(element, options, state):
+    """
+    Optimises the transform specifications of a single element (see optimizeTransforms()).
+    """
     num = 0
 
     for transformAttr in ['transform', 'patternTransform', 'gradientTransform']:
@@ -3266,7 +4014,7 @@ def optimizeTransforms(element, options):
 
             optimizeTransform(transform)
 
-            newVal = serializeTransform(transform)
+            newVal = serializeTransform(transform, options)
 
             if len(newVal) < len(val):
                 if len(newVal):
@@ -3275,11 +4023,7 @@ def optimizeTransforms(element, options):
                     element.removeAttribute(transformAttr)
                 num += len(val) - len(newVal)
 
-    for child in element.childNodes:
-        if child.nodeType == Node.ELEMENT_NODE:
-            num += optimizeTransforms(child, options)
-
-    return num
+    return num, None
 
 
 def remove_comments(element, stats):
@@ -3292,8 +4036,10 @@ def remove_comments(element, stats):
         stats.num_comments_removed += 1
         element.parentNode.removeChild(element)
     else:
-        for subelement in element.childNodes[:]:
-            remove_comments(subelement, stats)
+        for node in iter_elements(element):
+            for subelement in node.childNodes[:]:
+                if isinstance(subelement, xml.dom.minidom.Comment):
+                    remove_comments(subelement, stats)
 
 
 def embed_rasters(element, options):
@@ -3332,13 +4078,13 @@ def embed_rasters(element, options):
                 else:
                     href_fixed = 'file:' + href_fixed
 
-            # relative local paths are relative to the input file, therefore temporarily change the working dir
-            working_dir_old = None
+            # relative local paths are relative to the input file, therefore resolve them against its directory
+            # (not by changing the working directory as that would affect all other threads of the process)
             if parsed_href.scheme == 'file' and parsed_href.path[0] != '/':
                 if options.infilename:
-                    working_dir_old = os.getcwd()
-                    working_dir_new = os.path.abspath(os.path.dirname(options.infilename))
-                    os.chdir(working_dir_new)
+                    input_dir = os.path.abspath(os.path.dirname(options.infilename)) + os.sep
+                    base_url = urllib.parse.urljoin('file:', urllib.request.pathname2url(input_dir))
+                    href_fixed = urllib.parse.urljoin(base_url, href_fixed)
 
             # open/download the file
             try:
@@ -3350,10 +4096,6 @@ def embed_rasters(element, options):
                       "The raster image will be kept as a reference but might be invalid. "
                       "(Exception details: " + str(e) + ")", file=options.ensure_value("stdout", sys.stdout))
                 rasterdata = ''
-            finally:
-                # always restore initial working directory if we changed it above
-                if working_dir_old is not None:
-                    os.chdir(working_dir_old)
 
             # TODO: should we remove all images which don't resolve?
             #   then we also have to consider unreachable remote locations (i.e. if there is no internet connection)
@@ -3419,6 +4161,15 @@ def remapNamespacePrefix(node, oldprefix, newprefix):
     if node is None or node.nodeType != Node.ELEMENT_NODE:
         return
 
+    # (the children of each element are remapped before they are walked)
+    for elem in iter_elements(_remapElementPrefix(node, oldprefix, newprefix)):
+        for child in elem.childNodes:
+            if child.nodeType == Node.ELEMENT_NODE:
+                _remapElementPrefix(child, oldprefix, newprefix)
+
+
+def _remapElementPrefix(node, oldprefix, newprefix):
+    # replaces node by an element with the new prefix (if it has the old one), returns the replacement
     if node.prefix == oldprefix:
         localName = node.localName
         namespace = node.namespaceURI
@@ -3437,18 +4188,16 @@ def remapNamespacePrefix(node, oldprefix, newprefix):
             attr = attrList.item(i)
             newNode.setAttributeNS(attr.namespaceURI, attr.name, attr.nodeValue)
 
-        # clone and add all the child nodes
-        for child in node.childNodes:
-            newNode.appendChild(child.cloneNode(True))
+        # move all the child nodes
+        while node.firstChild is not None:
+            newNode.appendChild(node.firstChild)
 
         # replace old node with new node
         parent.replaceChild(newNode, node)
         # set the node to the new node in the remapped namespace prefix
         node = newNode
 
-    # now do all child nodes
-    for child in node.childNodes:
-        remapNamespacePrefix(child, oldprefix, newprefix)
+    return node
 
 
 def make_well_formed(text, quote_dict=None):
@@ -3506,33 +4255,17 @@ def _attribute_sort_key_function(attribute):
 def attributes_ordered_for_output(element):
     if not element.hasAttributes():
         return []
-    attribute = element.attributes
-    # The .item(i) call is painfully slow (bpo#40689). Therefore we ensure we
-    # call it at most once per attribute.
-    # - it would be many times faster to use `attribute.values()` but sadly
-    #   that is an "experimental" interface.
-    return sorted((attribute.item(i) for i in range(attribute.length)),
-                  key=_attribute_sort_key_function)
+    return sorted(attribute_nodes(element), key=_attribute_sort_key_function)
 
 
-# hand-rolled serialization function that has the following benefits:
-# - pretty printing
-# - somewhat judicious use of whitespace
-# - ensure id attributes are first
-def serializeXML(element, options, indent_depth=0, preserveWhitespace=False):
-    outParts = []
-
-    indent_type = ''
-    newline = ''
-    if options.newlines:
-        if options.indent_type == 'tab':
-            indent_type = '\t'
-        elif options.indent_type == 'space':
-            indent_type = ' '
-        indent_type *= options.indent_depth
-        newline = '\n'
+def serializeStartTag(element, options, indent_depth, preserveWhitespace, outParts):
+    """
+    Appends the start tag of 'element' without the closing '>' (i.e. the indentation, name and attributes)
+    to the list 'outParts', see serializeXML().
 
-    outParts.extend([(indent_type * indent_depth), '<', element.nodeName])
+    Returns whether whitespace has to be preserved in the content of the element.
+    """
+    outParts.extend([(options.indentation * indent_depth), '<', element.nodeName])
 
     # now serialize the other attributes
     attrs = attributes_ordered_for_output(element)
@@ -3562,25 +4295,98 @@ def serializeXML(element, options, indent_depth=0, preserveWhitespace=False):
             elif attrValue == 'default':
                 preserveWhitespace = False
 
-    children = element.childNodes
-    if children.length == 0:
-        outParts.append('/>')
-    else:
-        outParts.append('>')
+    return preserveWhitespace
+
+
+# hand-rolled serialization function that has the following benefits:
+# - pretty printing
+# - somewhat judicious use of whitespace
+# - ensure id attributes are first
+def serializeXML(element, options, indent_depth=0, preserveWhitespace=False):
+    outParts = []
+    _serialize_element(element, _serialization_options(options), indent_depth, preserveWhitespace, outParts)
+    return "".join(outParts)
+
 
-        onNewLine = False
-        for child in element.childNodes:
+def writeXML(element, options, writer, indent_depth=0, preserveWhitespace=False):
+    """
+    Serializes 'element' like serializeXML() but writes the output to the OutputWriter 'writer'
+    (in chunks while serializing) instead of returning it as a string.
+    """
+    _serialize_element(element, _serialization_options(options), indent_depth, preserveWhitespace, writer.parts,
+                       writer)
+
+
+def _indentation(options):
+    # returns the indentation (of a single level) and the line break used for serializing
+    indentation = ''
+    newline = ''
+    if options.newlines:
+        if options.indent_type == 'tab':
+            indentation = '\t' * options.indent_depth
+        elif options.indent_type == 'space':
+            indentation = ' ' * options.indent_depth
+        newline = '\n'
+    return indentation, newline
+
+
+def _serialization_options(options):
+    # options not prepared by a Scourer (e.g. as returned by parse_args()) lack the indentation
+    # and line break, which are added to a copy of the options
+    if hasattr(options, 'indentation'):
+        return options
+    options = copy.copy(options)
+    options.indentation, options.newline = _indentation(options)
+    return options
+
+
+# appends the parts of the serialized element to the list 'outParts' (shared by all levels,
+# so the output of each element is only copied once); if 'outParts' belongs to the OutputWriter 'writer'
+# it is written once enough parts have accumulated
+def _serialize_element(element, options, indent_depth, preserveWhitespace, outParts, writer=None):
+    # indentation as prepared by Scourer
+    indent_type = options.indentation
+    newline = options.newline
+
+    preserveWhitespace = serializeStartTag(element, options, indent_depth, preserveWhitespace, outParts)
+    if element.childNodes.length == 0:
+        outParts.append('/>')
+        if writer is not None and len(outParts) >= writer.buffer_parts:
+            writer.flush()
+        return
+    outParts.append('>')
+
+    # the open elements (walked with an explicit stack instead of recursively, so deeply nested documents
+    # can be serialized), for each: [the element, an iterator over its remaining children, its indentation depth,
+    # whether whitespace is preserved in its content, whether its children are put on new lines,
+    # whether a child was put on a new line]
+    stack = [[element, iter(element.childNodes), indent_depth, preserveWhitespace,
+              not (preserveWhitespace or element.nodeName in TEXT_CONTENT_ELEMENTS), False]]
+    while stack:
+        frame = stack[-1]
+        element, children, indent_depth, preserveWhitespace, indentChildren, _ = frame
+        for child in children:
             # element node
             if child.nodeType == Node.ELEMENT_NODE:
                 # do not indent inside text content elements as in SVG there's a difference between
                 #    "text1\ntext2" and
                 #    "text1\n text2"
                 # see https://www.w3.org/TR/SVG/text.html#WhiteSpace
-                if preserveWhitespace or element.nodeName in TEXT_CONTENT_ELEMENTS:
-                    outParts.append(serializeXML(child, options, 0, preserveWhitespace))
+                if indentChildren:
+                    outParts.append(newline)
+                    depth = indent_depth + 1
+                    frame[5] = True
                 else:
-                    outParts.extend([newline, serializeXML(child, options, indent_depth + 1, preserveWhitespace)])
-                    onNewLine = True
+                    depth = 0
+                preserve = serializeStartTag(child, options, depth, preserveWhitespace, outParts)
+                if child.childNodes.length == 0:
+                    outParts.append('/>')
+                else:
+                    # continue with the children of the child
+                    outParts.append('>')
+                    stack.append([child, iter(child.childNodes), depth, preserve,
+                                  not (preserve or child.nodeName in TEXT_CONTENT_ELEMENTS), False])
+                    break
             # text node
             elif child.nodeType == Node.TEXT_NODE:
                 text_content = child.nodeValue
@@ -3608,43 +4414,199 @@ def serializeXML(element, options, indent_depth=0, preserveWhitespace=False):
             # TODO: entities, processing instructions, what else?
             else:  # ignore the rest
                 pass
+        else:
+            # all children are serialized, close the element
+            stack.pop()
+            if frame[5]:
+                outParts.append(newline)
+                outParts.append(indent_type * indent_depth)
+            outParts.extend(['</', element.nodeName, '>'])
 
-        if onNewLine:
-            outParts.append(newline)
-            outParts.append(indent_type * indent_depth)
-        outParts.extend(['</', element.nodeName, '>'])
+            if writer is not None and len(outParts) >= writer.buffer_parts:
+                writer.flush()
 
-    return "".join(outParts)
+
+class OutputWriter(object):
+    """
+    Writes the serialized output UTF-8 encoded to the binary file object 'outfile' (a file,
+    gzip file, socket file, ...), see writeXML().
+
+    Written strings are collected in 'parts' and only encoded and written once 'buffer_parts'
+    of them have accumulated (or on flush()), so the complete output never has to be kept in memory.
+    'size' is the number of bytes written so far.
+    """
+
+    def __init__(self, outfile, buffer_parts=8192):
+        self.outfile = outfile
+        self.buffer_parts = buffer_parts
+        self.parts = []
+        self.size = 0
+
+    def write(self, text):
+        self.parts.append(text)
+        if len(self.parts) >= self.buffer_parts:
+            self.flush()
+
+    def flush(self):
+        if self.parts:
+            data = "".join(self.parts).encode('UTF-8')
+            del self.parts[:]
+            self.size += len(data)
+            self.outfile.write(data)
+
+
+# the elements and attributes whose lengths (including coordinates) are scoured with scourLength()
+LENGTH_ELEMENTS = ['svg', 'image', 'rect', 'circle', 'ellipse', 'line',
+                   'linearGradient', 'radialGradient', 'stop', 'filter']
+LENGTH_ATTRIBUTES = ['x', 'y', 'width', 'height', 'cx', 'cy', 'r', 'rx', 'ry',
+                     'x1', 'y1', 'x2', 'y2', 'fx', 'fy', 'offset']
+
+
+def is_empty_container(elem):
+    """
+    Returns whether the container 'elem' is empty, i.e. has no children other than whitespace-only text nodes.
+    """
+    for child in elem.childNodes:
+        if child.nodeType in [Node.ELEMENT_NODE, Node.CDATA_SECTION_NODE, Node.COMMENT_NODE]:
+            return False
+        elif child.nodeType == Node.TEXT_NODE and not child.nodeValue.isspace():
+            return False
+    return True
+
+
+class _NoProfile(object):
+    # stands in for a ScourProfile if profiling is disabled, so stages don't have to check
+
+    def start(self, name, node=None, calls=1):
+        pass
+
+    def iteration(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+_NO_PROFILE = _NoProfile()
+
+
+class Scourer(object):
+    """
+    Scours SVG documents using a fixed set of options.
+
+    The options are sanitized, validated and prepared only once when creating the Scourer
+    (instead of on every call of scourString()), which saves time when scouring many documents:
+
+        scourer = Scourer(parse_args(['--enable-id-stripping']))
+        for svg in documents:
+            output, stats = scourer.scour(svg)
+
+    Scouring does not modify the Scourer, so it may be used from several threads at the same time.
+    """
+
+    def __init__(self, options=None):
+        # sanitize options (take missing attributes from defaults, discard unknown attributes)
+        options = sanitizeOptions(options)
+
+        if options.digits < 1:
+            raise ValueError("Number of significant digits has to be larger than zero")
+        if options.indent_type not in ['tab', 'space', 'none']:
+            raise ValueError("Invalid value for indent_type: {!r}".format(options.indent_type))
+        if options.xml_backend not in XML_BACKENDS:
+            raise ValueError("Invalid value for xml_backend: {!r}".format(options.xml_backend))
+
+        # default or invalid value
+        if options.cdigits < 0:
+            options.cdigits = options.digits
+
+        # create decimal contexts with reduced precision for scouring numbers
+        # calculations should be done in the default context (precision defaults to 28 significant digits)
+        # to minimize errors
+        # (the contexts are stored with the options instead of globally to keep scouring thread-safe)
+        options.scouring_context = Context(prec=options.digits)
+        options.scouring_context_c = Context(prec=options.cdigits)  # even more reduced precision for control points
+
+        # the XML backend parsing documents into the DOM the passes operate on
+        options.xml_parser = get_backend(options.xml_backend)
+
+        # indentation and line breaks used by serializeXML()
+        options.indentation, options.newline = _indentation(options)
+
+        self.options = options
+
+    def scour(self, in_string, stats=None):
+        """
+        Scours the SVG document in 'in_string' (bytes or string).
+
+        Returns a tuple of the output string and the ScourStats of the run
+        (which are accumulated into 'stats' if given).
+        """
+        if stats is None:
+            stats = ScourStats()
+        return _scour_document(in_string, self.options, stats), stats
+
+    def scour_to_file(self, in_string, outfile, stats=None):
+        """
+        Scours the SVG document in 'in_string' (bytes or string) like scour() but writes the
+        (UTF-8 encoded) output to the binary file object 'outfile' while serializing it,
+        instead of building the complete output string in memory.
+
+        Returns a tuple of the number of bytes written and the ScourStats of the run
+        (which are accumulated into 'stats' if given).
+        """
+        if stats is None:
+            stats = ScourStats()
+        return _scour_document(in_string, self.options, stats, outfile), stats
+
+    def scour_stream(self, infile, outfile, stats=None):
+        """
+        Scours the SVG document read from the binary file 'infile' while writing the (UTF-8 encoded)
+        output to the binary file 'outfile', keeping only small parts of the document in memory
+        (see scour.stream for the optimizations applied in this mode).
+
+        Returns a tuple of the number of bytes read, the number of bytes written and the ScourStats
+        of the run (which are accumulated into 'stats' if given).
+        """
+        from scour.stream import scour_stream
+
+        if stats is None:
+            stats = ScourStats()
+        input_size, output_size = scour_stream(infile, outfile, self.options, stats)
+        return input_size, output_size, stats
 
 
-# this is the main method
-# input is a string representation of the input XML
-# returns a string representation of the output XML
 def scourString(in_string, options=None, stats=None):
-    # sanitize options (take missing attributes from defaults, discard unknown attributes)
-    options = sanitizeOptions(options)
+    """
+    Scours the SVG document in 'in_string' and returns the result as a string.
 
-    if stats is None:
-        # This is easier than doing "if stats is not None:" checks all over the place
-        stats = ScourStats()
+    All state is kept per call (and 'options' is not modified), so scourString() may be called
+    from several threads at the same time, see also scour_strings().
+    Use a Scourer to scour many documents with the same options.
+    """
+    return Scourer(options).scour(in_string, stats)[0]
 
-    # default or invalid value
-    if(options.cdigits < 0):
-        options.cdigits = options.digits
 
-    # create decimal contexts with reduced precision for scouring numbers
-    # calculations should be done in the default context (precision defaults to 28 significant digits)
-    # to minimize errors
-    global scouringContext
-    global scouringContextC  # even more reduced precision for control points
-    scouringContext = Context(prec=options.digits)
-    scouringContextC = Context(prec=options.cdigits)
+# this is the main method
+# input is a string representation of the input XML and the options prepared by Scourer
+# returns a string representation of the output XML or, if the binary file object 'outfile' is given,
+# writes the output (UTF-8 encoded) to it and returns the number of bytes written
+def _scour_document(in_string, options, stats, outfile=None):
+    if options.profile:
+        if stats.profile is None:
+            stats.profile = ScourProfile()
+        profile = stats.profile
+        # (the caches are shared by all runs, so only the lookups of this run are recorded)
+        caches = (('path', _path_cache), ('number', _number_cache), ('style', _style_cache))
+        cache_counts = [(cache.hits, cache.misses) for _, cache in caches]
+    else:
+        profile = _NO_PROFILE
 
-    doc = xml.dom.minidom.parseString(in_string)
+    profile.start('parse')
+    doc = options.xml_parser.parse(in_string)
 
     # determine number of flowRoot elements in input document
     # flowRoot elements don't render at all on current browsers (04/2016)
-    cnt_flowText_el = len(doc.getElementsByTagName('flowRoot'))
+    cnt_flowText_el = len(get_elements_by_tag_name(doc, 'flowRoot'))
     if cnt_flowText_el:
         errmsg = "SVG input document uses {} flow text elements, " \
                  "which won't render on browsers!".format(cnt_flowText_el)
@@ -3654,24 +4616,32 @@ def scourString(in_string, options=None, stats=None):
             print("WARNING: {}".format(errmsg), file=sys.stderr)
 
     # remove descriptive elements
+    profile.start('remove_descriptive_elements', doc.documentElement)
     stats.num_elements_removed += remove_descriptive_elements(doc, options)
 
+    # index the namespaces of elements and the attribute names once, for finding
+    # namespaced elements/attributes and unused namespace declarations below
+    profile.start('NamespaceIndex', doc.documentElement)
+    ns_index = NamespaceIndex(doc)
+
     # remove unneeded namespaced elements/attributes added by common editors
     if options.keep_editor_data is False:
+        profile.start('removeNamespacedElements', doc.documentElement)
         stats.num_elements_removed += removeNamespacedElements(doc.documentElement,
-                                                               unwanted_ns)
+                                                               unwanted_ns, ns_index)
         stats.num_attributes_removed += removeNamespacedAttributes(doc.documentElement,
-                                                                   unwanted_ns)
+                                                                   unwanted_ns, ns_index)
 
         # remove the xmlns: declarations now
         xmlnsDeclsToRemove = []
         attrList = doc.documentElement.attributes
         for index in range(attrList.length):
             if attrList.item(index).nodeValue in unwanted_ns:
-                xmlnsDeclsToRemove.append(attrList.item(index).nodeName)
+                xmlnsDeclsToRemove.append(attrList.item(index))
 
         for attr in xmlnsDeclsToRemove:
-            doc.documentElement.removeAttribute(attr)
+            ns_index.remove_attribute(doc.documentElement, attr)
+            doc.documentElement.removeAttribute(attr.nodeName)
         stats.num_attributes_removed += len(xmlnsDeclsToRemove)
 
     # ensure namespace for SVG is declared
@@ -3681,16 +4651,7 @@ def scourString(in_string, options=None, stats=None):
         # TODO: throw error or warning?
 
     # check for redundant and unused SVG namespace declarations
-    def xmlnsUnused(prefix, namespace):
-        if doc.getElementsByTagNameNS(namespace, "*"):
-            return False
-        else:
-            for element in doc.getElementsByTagName("*"):
-                for attribute in element.attributes.values():
-                    if attribute.name.startswith(prefix):
-                        return False
-        return True
-
+    profile.start('remove_unused_namespace_declarations')
     attrList = doc.documentElement.attributes
     xmlnsDeclsToRemove = []
     redundantPrefixes = []
@@ -3702,7 +4663,7 @@ def scourString(in_string, options=None, stats=None):
             if val == 'http://www.w3.org/2000/svg':
                 redundantPrefixes.append(name[6:])
                 xmlnsDeclsToRemove.append(name)
-            elif xmlnsUnused(name[6:], val):
+            elif ns_index.xmlns_unused(name[6:], val):
                 xmlnsDeclsToRemove.append(name)
 
     for attrName in xmlnsDeclsToRemove:
@@ -3713,6 +4674,7 @@ def scourString(in_string, options=None, stats=None):
         remapNamespacePrefix(doc.documentElement, prefix, '')
 
     if options.strip_comments:
+        profile.start('remove_comments', doc.documentElement)
         remove_comments(doc, stats)
 
     if options.strip_xml_space_attribute and doc.documentElement.hasAttribute('xml:space'):
@@ -3720,124 +4682,145 @@ def scourString(in_string, options=None, stats=None):
         stats.num_attributes_removed += 1
 
     # repair style (remove unnecessary style properties and change them into XML attributes)
+    profile.start('repairStyle', doc.documentElement)
     stats.num_style_properties_fixed = repairStyle(doc.documentElement, options)
 
     # convert colors to #RRGGBB format
     if options.simple_colors:
+        profile.start('convertColors', doc.documentElement)
         stats.num_bytes_saved_in_colors = convertColors(doc.documentElement)
 
+    # index the IDs and references once, the passes below keep it up to date
+    profile.start('ReferenceIndex', doc.documentElement)
+    ref_index = ReferenceIndex(doc)
+
     # remove unreferenced gradients/patterns outside of defs
     # and most unreferenced elements inside of defs
-    while remove_unreferenced_elements(doc, options.keep_defs, stats) > 0:
-        pass
+    profile.start('remove_unreferenced_elements', doc.documentElement)
+    remove_unreferenced_elements(doc, options.keep_defs, stats, ref_index)
 
     # remove empty defs, metadata, g
     # NOTE: these elements will be removed if they just have whitespace-only text nodes
+    profile.start('remove_empty_containers', doc.documentElement)
     for tag in ['defs', 'title', 'desc', 'metadata', 'g']:
-        for elem in doc.documentElement.getElementsByTagName(tag):
-            removeElem = not elem.hasChildNodes()
-            if removeElem is False:
-                for child in elem.childNodes:
-                    if child.nodeType in [Node.ELEMENT_NODE, Node.CDATA_SECTION_NODE, Node.COMMENT_NODE]:
-                        break
-                    elif child.nodeType == Node.TEXT_NODE and not child.nodeValue.isspace():
-                        break
-                else:
-                    removeElem = True
-            if removeElem:
+        for elem in ref_index.elements_with_tag(tag):
+            if is_empty_container(elem):
+                ref_index.remove(elem)
                 elem.parentNode.removeChild(elem)
                 stats.num_elements_removed += 1
 
     if options.strip_ids:
-        referencedIDs = findReferencedElements(doc.documentElement)
-        identifiedElements = unprotected_ids(doc, options)
-        stats.num_ids_removed += remove_unreferenced_ids(referencedIDs,
+        profile.start('remove_unreferenced_ids', doc.documentElement)
+        identifiedElements = unprotected_ids(ref_index, options)
+        stats.num_ids_removed += remove_unreferenced_ids(ref_index,
                                                          identifiedElements)
 
-    while remove_duplicate_gradient_stops(doc, stats) > 0:
-        pass
+    # (stops are only compared with the previous stop of the same offset, so a single pass
+    # removes all duplicates)
+    profile.start('remove_duplicate_gradient_stops', doc.documentElement)
+    remove_duplicate_gradient_stops(doc, stats, ref_index)
 
     # remove gradients that are only referenced by one other gradient
-    while collapse_singly_referenced_gradients(doc, stats) > 0:
-        pass
+    profile.start('collapse_singly_referenced_gradients', doc.documentElement)
+    collapse_singly_referenced_gradients(doc, stats, ref_index)
 
     # remove duplicate gradients
-    stats.num_elements_removed += removeDuplicateGradients(doc)
+    profile.start('removeDuplicateGradients', doc.documentElement)
+    stats.num_elements_removed += removeDuplicateGradients(doc, ref_index)
 
     if options.group_collapse:
-        stats.num_elements_removed += mergeSiblingGroupsWithCommonAttributes(doc.documentElement)
+        profile.start('mergeSiblingGroupsWithCommonAttributes', doc.documentElement)
+        stats.num_elements_removed += mergeSiblingGroupsWithCommonAttributes(doc.documentElement, ref_index)
     # create <g> elements if there are runs of elements with the same attributes.
     # this MUST be before moveCommonAttributesToParentGroup.
     if options.group_create:
-        create_groups_for_common_attributes(doc.documentElement, stats)
+        profile.start('create_groups_for_common_attributes', doc.documentElement)
+        create_groups_for_common_attributes(doc.documentElement, stats, ref_index)
 
     # move common attributes to parent group
     # NOTE: the if the <svg> element's immediate children
     # all have the same value for an attribute, it must not
     # get moved to the <svg> element. The <svg> element
     # doesn't accept fill=, stroke= etc.!
-    referencedIds = findReferencedElements(doc.documentElement)
+    profile.start('moveCommonAttributesToParentGroup', doc.documentElement,
+                  calls=len(doc.documentElement.childNodes))
     for child in doc.documentElement.childNodes:
-        stats.num_attributes_removed += moveCommonAttributesToParentGroup(child, referencedIds)
+        stats.num_attributes_removed += moveCommonAttributesToParentGroup(child, ref_index)
 
     # remove unused attributes from parent
-    stats.num_attributes_removed += removeUnusedAttributesOnParent(doc.documentElement)
+    profile.start('removeUnusedAttributesOnParent', doc.documentElement)
+    stats.num_attributes_removed += removeUnusedAttributesOnParent(doc.documentElement, ref_index)
 
     # Collapse groups LAST, because we've created groups. If done before
     # moveAttributesToParentGroup, empty <g>'s may remain.
     if options.group_collapse:
-        while remove_nested_groups(doc.documentElement, stats) > 0:
-            pass
+        profile.start('remove_nested_groups', doc.documentElement)
+        while remove_nested_groups(doc.documentElement, stats, ref_index) > 0:
+            profile.iteration()
 
     # remove unnecessary closing point of polygons and scour points
-    for polygon in doc.documentElement.getElementsByTagName('polygon'):
+    polygons = ref_index.elements_with_tag('polygon')
+    profile.start('clean_polygon', calls=len(polygons))
+    for polygon in polygons:
         stats.num_points_removed_from_polygon += clean_polygon(polygon, options)
 
     # scour points of polyline
-    for polyline in doc.documentElement.getElementsByTagName('polyline'):
+    polylines = ref_index.elements_with_tag('polyline')
+    profile.start('cleanPolyline', calls=len(polylines))
+    for polyline in polylines:
         cleanPolyline(polyline, options)
 
     # clean path data
-    for elem in doc.documentElement.getElementsByTagName('path'):
+    paths = ref_index.elements_with_tag('path')
+    profile.start('clean_path', calls=len(paths))
+    for elem in paths:
         if elem.getAttribute('d') == '':
+            ref_index.remove(elem)
             elem.parentNode.removeChild(elem)
         else:
             clean_path(elem, options, stats)
 
     # shorten ID names as much as possible
     if options.shorten_ids:
-        stats.num_bytes_saved_in_ids += shortenIDs(doc, options.shorten_ids_prefix, options)
+        profile.start('shortenIDs', doc.documentElement)
+        stats.num_bytes_saved_in_ids += shortenIDs(doc, options.shorten_ids_prefix, options, ref_index)
 
     # scour lengths (including coordinates)
-    for type in ['svg', 'image', 'rect', 'circle', 'ellipse', 'line',
-                 'linearGradient', 'radialGradient', 'stop', 'filter']:
-        for elem in doc.getElementsByTagName(type):
-            for attr in ['x', 'y', 'width', 'height', 'cx', 'cy', 'r', 'rx', 'ry',
-                         'x1', 'y1', 'x2', 'y2', 'fx', 'fy', 'offset']:
+    profile.start('scour_lengths', doc.documentElement)
+    for type in LENGTH_ELEMENTS:
+        for elem in ref_index.elements_with_tag(type):
+            for attr in LENGTH_ATTRIBUTES:
                 if elem.getAttribute(attr) != '':
-                    elem.setAttribute(attr, scourLength(elem.getAttribute(attr)))
+                    elem.setAttribute(attr, scourLength(elem.getAttribute(attr), options))
     viewBox = doc.documentElement.getAttribute('viewBox')
     if viewBox:
         lengths = RE_COMMA_WSP.split(viewBox)
-        lengths = [scourUnitlessLength(length) for length in lengths]
+        lengths = [scourUnitlessLength(length, options) for length in lengths]
         doc.documentElement.setAttribute('viewBox', ' '.join(lengths))
 
-    # more length scouring in this function
-    stats.num_bytes_saved_in_lengths = reducePrecision(doc.documentElement)
-
-    # remove default values of attributes
-    stats.num_attributes_removed += removeDefaultAttributeValues(doc.documentElement, options)
-
-    # reduce the length of transformation attributes
-    stats.num_bytes_saved_in_transforms = optimizeTransforms(doc.documentElement, options)
+    # more length scouring (reducePrecision), remove default values of attributes (removeDefaultAttributeValues)
+    # and reduce the length of transformation attributes (optimizeTransforms)
+    # NOTE: these only rewrite the attributes of each element by itself, so they are run in a single traversal
+    profile.start('optimize_attributes', doc.documentElement)
+    (stats.num_bytes_saved_in_lengths,
+     num_attributes_removed,
+     stats.num_bytes_saved_in_transforms) = run_element_visitors(doc.documentElement,
+                                                                 [reduce_precision_visitor,
+                                                                  remove_default_attribute_values_visitor,
+                                                                  optimize_transforms_visitor],
+                                                                 options)
+    stats.num_attributes_removed += num_attributes_removed
 
     # convert rasters references to base64-encoded strings
     if options.embed_rasters:
-        for elem in doc.documentElement.getElementsByTagName('image'):
+        images = ref_index.elements_with_tag('image')
+        profile.start('embed_rasters', calls=len(images))
+        for elem in images:
             stats.num_rasters_embedded += embed_rasters(elem, options)
 
     # properly size the SVG document (ideally width/height should be 100% with a viewBox)
     if options.enable_viewboxing:
+        profile.start('properlySizeDoc')
         properlySizeDoc(doc.documentElement, options)
 
     # output the document as a pretty string with a single space for indent
@@ -3845,24 +4828,37 @@ def scourString(in_string, options=None, stats=None):
     # http://ronrothman.com/public/leftbraned/xml-dom-minidom-toprettyxml-and-silly-whitespace/
     # rolled our own serialize function here to save on space, put id first, customize indentation, etc
 #  out_string = doc.documentElement.toprettyxml(' ')
-    out_string = serializeXML(doc.documentElement, options) + '\n'
+    profile.start('serializeXML', doc.documentElement)
+    if outfile is None:
+        writer = None
+        outParts = []
+    else:
+        writer = OutputWriter(outfile)
+        outParts = writer.parts
 
-    # return the string with its XML prolog and surrounding comments
+    # output the document with its XML prolog and surrounding comments
     if options.strip_xml_prolog is False:
-        total_output = '<?xml version="1.0" encoding="UTF-8"'
+        outParts.append('<?xml version="1.0" encoding="UTF-8"')
         if doc.standalone:
-            total_output += ' standalone="yes"'
-        total_output += '?>\n'
-    else:
-        total_output = ""
+            outParts.append(' standalone="yes"')
+        outParts.append('?>\n')
 
     for child in doc.childNodes:
         if child.nodeType == Node.ELEMENT_NODE:
-            total_output += out_string
+            _serialize_element(child, options, 0, False, outParts, writer)
+            outParts.append('\n')
         else:  # doctypes, entities, comments
-            total_output += child.toxml() + '\n'
+            outParts.extend([child.toxml(), '\n'])
+    if writer is not None:
+        writer.flush()
+    profile.stop()
+    if options.profile:
+        for (name, cache), (hits, misses) in zip(caches, cache_counts):
+            profile.record_cache(name, cache.hits - hits, cache.misses - misses)
 
-    return total_output
+    if writer is None:
+        return "".join(outParts)
+    return writer.size
 
 
 # used mostly by unit tests
@@ -3885,7 +4881,7 @@ def scourXmlFile(filename, options=None, stats=None):
     # since minidom does not seem to parse DTDs properly
     # manually declare all attributes with name "id" to be of type ID
     # (otherwise things like doc.getElementById() won't work)
-    all_nodes = doc.getElementsByTagName("*")
+    all_nodes = get_elements_by_tag_name(doc, "*")
     for node in all_nodes:
         try:
             node.setIdAttribute('id')
@@ -3895,6 +4891,28 @@ def scourXmlFile(filename, options=None, stats=None):
     return doc
 
 
+def scour_strings(in_strings, options=None, workers=None):
+    """
+    Scours several SVG documents concurrently in a pool of 'workers' threads
+    (default: number of CPUs) using the same options.
+
+    Returns a list of (output string, ScourStats) tuples in the order of 'in_strings'.
+    An exception raised while scouring any of the documents is re-raised.
+
+    Note that most of the work is done in Python code holding the GIL; to make use of
+    several CPU cores use processes instead, e.g. the batch mode of the command line interface.
+    """
+    from multiprocessing.pool import ThreadPool
+
+    scourer = Scourer(options)
+    pool = ThreadPool(workers)
+    try:
+        return pool.map(scourer.scour, in_strings)
+    finally:
+        pool.close()
+        pool.join()
+
+
 # GZ: Seems most other commandline tools don't do this, is it really wanted?
 class HeaderedFormatter(optparse.IndentedHelpFormatter):
     """
@@ -3910,10 +4928,13 @@ class HeaderedFormatter(optparse.IndentedHelpFormatter):
 # GZ: would prefer this to be in a function or class scope, but tests etc need
 #     access to the defaults anyway
 _options_parser = optparse.OptionParser(
-    usage="%prog [INPUT.SVG [OUTPUT.SVG]] [OPTIONS]",
+    usage="%prog [INPUT.SVG [OUTPUT.SVG]] [OPTIONS]\n"
+          "       %prog --output-dir=DIR INPUT [INPUT ...] [OPTIONS]",
     description=("If the input/output files are not specified, stdin/stdout are used. "
                  "If the input/output files are specified with a svgz extension, "
-                 "then compressed SVG is assumed."),
+                 "then compressed SVG is assumed. "
+                 "If an output directory is specified, all inputs (files, directories or glob patterns) "
+                 "are scoured in batch mode."),
     formatter=HeaderedFormatter(max_help_position=33),
     version=VER)
 
@@ -3927,6 +4948,16 @@ _options_parser.add_option("-q", "--quiet",
 _options_parser.add_option("-v", "--verbose",
                            action="store_true", dest="verbose", default=False,
                            help="verbose output (statistics, etc.)")
+_options_parser.add_option("--stats-format",
+                           action="store", type="string", dest="stats_format", default="text", metavar="FORMAT",
+                           help="format of the statistics: text, json, csv (default: %default); "
+                                "json and csv contain all statistics (as with '--verbose')")
+_options_parser.add_option("--profile",
+                           action="store_true", dest="profile", default=False,
+                           help="report time spent and work done in the individual stages of scouring")
+_options_parser.add_option("--profile-format",
+                           action="store", type="string", dest="profile_format", default="text", metavar="FORMAT",
+                           help="format of the profiling report: text, json (default: %default)")
 _options_parser.add_option("-i",
                            action="store", dest="infilename", metavar="INPUT.SVG",
                            help="alternative way to specify input filename")
@@ -3942,6 +4973,17 @@ _option_group_optimization.add_option("--set-c-precision",
                                       action="store", type=int, dest="cdigits", default=-1, metavar="NUM",
                                       help="set number of significant digits for control points "
                                            "(default: same as '--set-precision')")
+_option_group_optimization.add_option("--xml-backend",
+                                      action="store", type="string", dest="xml_backend", default="minidom",
+                                      metavar="BACKEND",
+                                      help="parser used for the document: minidom, etree (lxml if installed, "
+                                           "otherwise xml.etree.ElementTree; only etree builds a compact tree "
+                                           "using less memory) (default: %default)")
+_option_group_optimization.add_option("--stream",
+                                      action="store_true", dest="stream", default=False,
+                                      help="scour the document while reading it, using little memory for very "
+                                           "large documents (only optimizations of single elements are applied, "
+                                           "the input is read twice)")
 _option_group_optimization.add_option("--disable-simplify-colors",
                                       action="store_false", dest="simple_colors", default=True,
                                       help="won't convert colors to #RRGGBB format")
@@ -4041,10 +5083,89 @@ _option_group_compatibility.add_option("--error-on-flowtext",
                                             "(only warn by default)")
 _options_parser.add_option_group(_option_group_compatibility)
 
+_option_group_batch = optparse.OptionGroup(_options_parser, "Batch processing")
+_option_group_batch.add_option("--output-dir",
+                               action="store", type="string", dest="outdir", metavar="DIR",
+                               help="write output files to DIR and treat all arguments as input "
+                                    "(files, directories which are searched recursively, or glob patterns)")
+_option_group_batch.add_option("--input-list",
+                               action="store", type="string", dest="inputlist", metavar="FILE",
+                               help="read additional inputs from FILE (one per line, requires '--output-dir')")
+_option_group_batch.add_option("-j", "--jobs",
+                               action="store", type=int, dest="jobs", default=0, metavar="NUM",
+                               help="number of worker processes for batch processing and server mode "
+                                    "(default: number of CPUs)")
+_option_group_batch.add_option("--manifest",
+                               action="store", type="string", dest="manifest", metavar="FILE",
+                               help="record hashes of the inputs and options in FILE and skip inputs "
+                                    "that did not change since the last run (requires '--output-dir')")
+_option_group_batch.add_option("--slowest",
+                               action="store", type=int, dest="slowest", default=5, metavar="NUM",
+                               help="number of slowest files listed in the summary of a batch run "
+                                    "(with '--verbose' or '--stats-format=json', default: %default)")
+_options_parser.add_option_group(_option_group_batch)
+
+_option_group_server = optparse.OptionGroup(_options_parser, "Server mode")
+_option_group_server.add_option("--serve",
+                                action="store_true", dest="serve", default=False,
+                                help="run as a long-running server scouring SVG documents sent via HTTP POST; "
+                                     "all other options given are used as defaults for the requests")
+_option_group_server.add_option("--listen",
+                                action="store", type="string", dest="listen", default="localhost:8042",
+                                metavar="ADDRESS",
+                                help="address to listen on in server mode: '[HOST:]PORT' or 'unix:PATH' "
+                                     "for a Unix domain socket (default: '%default')")
+_option_group_server.add_option("--queue-depth",
+                                action="store", type=int, dest="queue_depth", default=16, metavar="NUM",
+                                help="number of requests waiting for a worker before new requests are rejected "
+                                     "in server mode (default: %default)")
+_option_group_server.add_option("--max-request-size",
+                                action="store", type=int, dest="max_request_size", default=16 * 1024 * 1024,
+                                metavar="BYTES",
+                                help="maximum size of the documents accepted in server mode (default: %default)")
+_option_group_server.add_option("--allow-embed-rasters",
+                                action="store_true", dest="allow_embed_rasters", default=False,
+                                help="embed rasters in server mode (lets clients make the server read local files "
+                                     "and fetch URLs referenced by their documents)")
+_options_parser.add_option_group(_option_group_server)
+
 
 def parse_args(args=None, ignore_additional_args=False):
     options, rargs = _options_parser.parse_args(args)
 
+    # in batch mode all arguments are inputs and outputs are written to the output directory
+    options.batch_inputs = []
+    if options.outdir:
+        if options.outfilename:
+            _options_parser.error("Output filename and output directory can not be used at the same time")
+        if options.infilename:
+            options.batch_inputs.append(options.infilename)
+            options.infilename = None
+        options.batch_inputs.extend(rargs)
+        rargs = []
+        if options.inputlist:
+            with open(options.inputlist) as f:
+                options.batch_inputs.extend(line.strip() for line in f if line.strip())
+        if not options.batch_inputs:
+            _options_parser.error("No input files specified for batch processing, see --help")
+    elif options.inputlist:
+        _options_parser.error("'--input-list' requires '--output-dir', see --help")
+    elif options.manifest:
+        _options_parser.error("'--manifest' requires '--output-dir', see --help")
+    if options.jobs < 0:
+        _options_parser.error("Number of jobs should be positive (or zero), see --help")
+    if options.serve:
+        if options.outdir:
+            _options_parser.error("Server mode and batch processing can not be used at the same time")
+        if options.infilename or options.outfilename or rargs:
+            _options_parser.error("Input and output files can not be specified in server mode")
+    if options.stream and (options.outdir or options.serve):
+        _options_parser.error("Streaming can not be used in batch processing or server mode")
+    if options.queue_depth < 0:
+        _options_parser.error("Queue depth should be positive (or zero), see --help")
+    if options.max_request_size < 0:
+        _options_parser.error("Maximum request size should be positive (or zero), see --help")
+
     if rargs:
         if not options.infilename:
             options.infilename = rargs.pop(0)
@@ -4060,6 +5181,14 @@ def parse_args(args=None, ignore_additional_args=False):
               "Number of significant digits for control points reset to default value, see --help", file=sys.stderr)
     if options.indent_type not in ['tab', 'space', 'none']:
         _options_parser.error("Invalid value for --indent, see --help")
+    if options.xml_backend not in XML_BACKENDS:
+        _options_parser.error("Invalid value for --xml-backend, see --help")
+    if options.stats_format not in ['text', 'json', 'csv']:
+        _options_parser.error("Invalid value for --stats-format, see --help")
+    if options.slowest < 0:
+        _options_parser.error("Value for --slowest should be positive (or zero), see --help")
+    if options.profile_format not in ['text', 'json']:
+        _options_parser.error("Invalid value for --profile-format, see --help")
     if options.indent_depth < 0:
         _options_parser.error("Value for --nindent should be positive (or zero), see --help")
     if options.infilename and options.outfilename and options.infilename == options.outfilename:
@@ -4084,8 +5213,21 @@ def sanitizeOptions(options=None):
     return sanitizedOptions
 
 
+def plain_options(options=None):
+    """
+    Like sanitizeOptions() but only keeps the plain option values (e.g. not the output stream
+    or methods bound to the original options), so the result can be sent to worker processes.
+    """
+    return optparse.Values(dict((key, value) for key, value in vars(sanitizeOptions(options)).items()
+                                if not callable(value)))
+
+
+def _is_gzip_filename(filename):
+    return os.path.splitext(filename)[1].lower() in (".svgz", ".gz")
+
+
 def maybe_gziped_file(filename, mode="r"):
-    if os.path.splitext(filename)[1].lower() in (".svgz", ".gz"):
+    if _is_gzip_filename(filename):
         import gzip
         return gzip.GzipFile(filename, mode)
     return open(filename, mode)
@@ -4140,6 +5282,99 @@ def generate_report(stats):
     )
 
 
+def generate_profile_report(profile, report_format='text'):
+    if report_format == 'json':
+        return json.dumps(profile.as_dict())
+
+    lines = ['  {:<40} {:>10} {:>8} {:>9} {:>10}'.format('Stage', 'Time [ms]', 'Calls', 'Tree size', 'Iterations')]
+    for name, stage in profile.as_dict().items():
+        lines.append('  {:<40} {:>10.3f} {:>8} {:>9} {:>10}'.format(
+            name, stage['time_ms'], stage['calls'], stage['tree_size'], stage['iterations']))
+    lines.append('  {:<40} {:>10.3f}'.format('Total', profile.total_time() * 1000.))
+    if profile.caches:
+        lines.append('')
+        lines.append('  {:<40} {:>10} {:>8} {:>9}'.format('Cache', 'Hits', 'Misses', 'Hit rate'))
+        for name, cache in profile.cache_stats().items():
+            lines.append('  {:<40} {:>10} {:>8} {:>8.2f}%'.format(
+                name, cache['hits'], cache['misses'], cache['hit_rate']))
+    return os.linesep.join(lines)
+
+
+def stats_record(filename, stats, oldsize, newsize, duration, error=None):
+    """
+    Returns the statistics of scouring a single file as a dictionary (for '--stats-format=json|csv'),
+    i.e. the sizes, the size ratio (new/orig in %), the duration (in ms) and all fields of 'stats'.
+    """
+    record = OrderedDict([
+        ('file', filename),
+        ('input_size', oldsize),
+        ('output_size', newsize),
+        ('ratio', round((newsize / oldsize) * 100., 2) if oldsize else 100.),
+        ('duration_ms', duration),
+    ])
+    record.update(stats.as_dict())
+    if error is not None:
+        record['error'] = error
+    return record
+
+
+_CSV_FIELDS = ('file', 'input_size', 'output_size', 'ratio', 'duration_ms') + ScourStats.counters() + ('error',)
+
+
+def generate_csv(records, header=True):
+    import csv
+
+    buf = six.StringIO()
+    writer = csv.DictWriter(buf, _CSV_FIELDS, extrasaction='ignore', lineterminator='\n')
+    if header:
+        writer.writeheader()
+    writer.writerows(records)
+    return buf.getvalue().rstrip('\n')
+
+
+def _percentile(sorted_values, percent):
+    # nearest-rank percentile of a non-empty sorted list
+    index = int(math.ceil(percent / 100. * len(sorted_values))) - 1
+    return sorted_values[max(index, 0)]
+
+
+def batch_summary(results, skipped, duration, slowest=5):
+    """
+    Aggregates the BatchResults of a batch run: totals of sizes and stats,
+    percentiles of the size ratio (new/orig in %) and the 'slowest' slowest files.
+    """
+    succeeded = [result for result in results if result.error is None]
+    total_stats = ScourStats()
+    for result in succeeded:
+        total_stats += result.stats
+    oldsize = sum(result.oldsize for result in succeeded)
+    newsize = sum(result.newsize for result in succeeded)
+
+    ratios = sorted((result.newsize / result.oldsize) * 100. if result.oldsize else 100. for result in succeeded)
+    percentiles = OrderedDict()
+    if ratios:
+        percentiles['min'] = round(ratios[0], 2)
+        for percent in (50, 90, 95, 99):
+            percentiles['p{}'.format(percent)] = round(_percentile(ratios, percent), 2)
+        percentiles['max'] = round(ratios[-1], 2)
+
+    slowest_results = sorted(succeeded, key=lambda result: result.duration, reverse=True)[:slowest]
+
+    return OrderedDict([
+        ('files', len(results)),
+        ('failed', len(results) - len(succeeded)),
+        ('skipped', skipped),
+        ('input_size', oldsize),
+        ('output_size', newsize),
+        ('ratio', round((newsize / oldsize) * 100., 2) if oldsize else 100.),
+        ('duration_ms', duration),
+        ('stats', total_stats),
+        ('ratio_percentiles', percentiles),
+        ('slowest', [OrderedDict([('file', result.infilename), ('duration_ms', result.duration)])
+                     for result in slowest_results]),
+    ])
+
+
 def start(options, input, output):
     # sanitize options (take missing attributes from defaults, discard unknown attributes)
     options = sanitizeOptions(options)
@@ -4148,9 +5383,12 @@ def start(options, input, output):
     stats = ScourStats()
 
     # do the work
-    in_string = input.read()
-    out_string = scourString(in_string, options, stats=stats).encode("UTF-8")
-    output.write(out_string)
+    if options.stream:
+        oldsize, newsize, _ = Scourer(options).scour_stream(input, output, stats)
+    else:
+        in_string = input.read()
+        newsize, _ = Scourer(options).scour_to_file(in_string, output, stats)
+        oldsize = len(in_string)
 
     # Close input and output files (but do not attempt to close stdin/stdout!)
     if not ((input is sys.stdin) or (hasattr(sys.stdin, 'buffer') and input is sys.stdin.buffer)):
@@ -4163,11 +5401,17 @@ def start(options, input, output):
     # run-time in ms
     duration = int(round((end - start) * 1000.))
 
-    oldsize = len(in_string)
-    newsize = len(out_string)
     sizediff = (newsize / oldsize) * 100.
 
-    if not options.quiet:
+    if options.quiet:
+        pass
+    elif options.stats_format == 'json':
+        print(json.dumps(stats_record(input.name, stats, oldsize, newsize, duration)),
+              file=options.ensure_value("stdout", sys.stdout))
+    elif options.stats_format == 'csv':
+        print(generate_csv([stats_record(input.name, stats, oldsize, newsize, duration)]),
+              file=options.ensure_value("stdout", sys.stdout))
+    else:
         print('Scour processed file "{}" in {} ms: {}/{} bytes new/orig -> {:.1f}%'.format(
             input.name,
             duration,
@@ -4176,10 +5420,308 @@ def start(options, input, output):
             sizediff), file=options.ensure_value("stdout", sys.stdout))
         if options.verbose:
             print(generate_report(stats), file=options.ensure_value("stdout", sys.stdout))
+    # (the profile is part of the statistics in JSON format)
+    if options.profile and options.stats_format != 'json':
+        print(generate_profile_report(stats.profile, options.profile_format),
+              file=options.ensure_value("stdout", sys.stdout))
+
+
+def collect_batch_inputs(inputs):
+    """
+    Expands the inputs given for batch processing.
+
+    Each input may be a file, a directory (which is searched recursively for SVG files)
+    or a glob pattern. Returns a list of (input filename, output filename relative to
+    the output directory) tuples.
+    """
+    files = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for dirpath, dirnames, filenames in os.walk(item):
+                dirnames.sort()
+                for filename in sorted(filenames):
+                    if os.path.splitext(filename)[1].lower() in ('.svg', '.svgz'):
+                        path = os.path.join(dirpath, filename)
+                        files.append((path, os.path.relpath(path, item)))
+        elif os.path.isfile(item):
+            files.append((item, os.path.basename(item)))
+        else:
+            matches = sorted(glob.glob(item))
+            if not matches:
+                raise IOError("No such file or directory: '{}'".format(item))
+            files.extend((path, os.path.basename(path)) for path in matches if os.path.isfile(path))
+
+    seen = {}
+    for infilename, relname in files:
+        if relname in seen and os.path.abspath(seen[relname]) != os.path.abspath(infilename):
+            raise IOError("Input files '{}' and '{}' would be written to the same output file".format(
+                seen[relname], infilename))
+        seen[relname] = infilename
+    return files
+
+
+BatchResult = namedtuple('BatchResult', ['infilename', 'outfilename', 'stats', 'oldsize', 'newsize', 'duration',
+                                         'error', 'input_hash'])
+
+
+def scour_batch_file(infilename, outfilename, options, scourer=None):
+    """
+    Scours a single file of a batch (this is run inside the worker processes).
+
+    If given, 'scourer' is a Scourer prepared for 'options', which is reused for all files of the batch
+    instead of preparing the options again for every file.
+
+    Returns a BatchResult; exceptions are caught and reported in its 'error' field
+    so a single broken file does not abort the whole batch. If a manifest is used, its 'input_hash'
+    field holds the hash of the input as it was read (see file_hash()).
+    """
+    if scourer is None:
+        scourer = Scourer(options)
+    # relative references in the SVG are resolved relative to the input file
+    options = copy.copy(scourer.options)
+    options.infilename = infilename
+
+    begin = time.time()
+    stats = ScourStats()
+    input_hash = None
+    try:
+        # (the file is read only once, so the hash matches the input that was scoured even if the file changes)
+        with open(infilename, 'rb') as infile:
+            in_string = infile.read()
+        if options.manifest:
+            input_hash = hashlib.sha256(in_string).hexdigest()
+        if _is_gzip_filename(infilename):
+            import gzip
+            in_string = gzip.GzipFile(fileobj=six.BytesIO(in_string)).read()
+        out_string = _scour_document(in_string, options, stats).encode("UTF-8")
+        outdir = os.path.dirname(outfilename)
+        if outdir and not os.path.isdir(outdir):
+            try:
+                os.makedirs(outdir)
+            except OSError:
+                # another worker might have created it in the meantime
+                if not os.path.isdir(outdir):
+                    raise
+        with maybe_gziped_file(outfilename, "wb") as outfile:
+            outfile.write(out_string)
+    except Exception as e:
+        return BatchResult(infilename, outfilename, stats, 0, 0, 0, str(e) or type(e).__name__, None)
+    duration = int(round((time.time() - begin) * 1000.))
+
+    return BatchResult(infilename, outfilename, stats, len(in_string), len(out_string), duration, None, input_hash)
+
+
+# the Scourer of a batch worker process, prepared once for the options of the batch (see _init_batch_worker())
+_batch_scourer = None
+
+
+def _init_batch_worker(options):
+    global _batch_scourer
+    _batch_scourer = Scourer(options)
+
+
+def _scour_batch_job(job):
+    infilename, outfilename = job
+    return scour_batch_file(infilename, outfilename, _batch_scourer.options, _batch_scourer)
+
+
+# options that do not influence the output of a single file (and are therefore excluded from the fingerprint)
+_BATCH_ONLY_OPTIONS = ('infilename', 'outfilename', 'quiet', 'verbose', 'outdir', 'inputlist', 'jobs', 'manifest',
+                       'serve', 'listen', 'queue_depth', 'max_request_size', 'allow_embed_rasters', 'profile',
+                       'profile_format', 'stats_format', 'slowest')
+
+# format version of the manifest written by incremental batch runs
+_MANIFEST_VERSION = 1
+
+
+def options_fingerprint(options):
+    """
+    Returns a hash of the effective options (as returned by sanitizeOptions()) and the Scour version,
+    i.e. of everything besides the input itself that determines the output.
+    """
+    values = dict((key, value) for key, value in vars(plain_options(options)).items()
+                  if key not in _BATCH_ONLY_OPTIONS)
+    values['__version__'] = __version__
+    return hashlib.sha256(json.dumps(values, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def file_hash(filename):
+    with open(filename, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def load_manifest(filename):
+    """
+    Loads the manifest of an incremental batch run.
+
+    The manifest maps output filenames (relative to the output directory) to the content hash
+    of the input and the options fingerprint used when the output was written.
+    Returns an empty manifest if the file does not exist (yet).
+    """
+    if not os.path.isfile(filename):
+        return {}
+    try:
+        with open(filename) as f:
+            manifest = json.load(f)
+        if manifest.get('version') != _MANIFEST_VERSION:
+            return {}
+        return manifest['files']
+    except (ValueError, KeyError, AttributeError):
+        print("WARNING: Ignoring invalid manifest '{}'".format(filename), file=sys.stderr)
+        return {}
+
+
+def save_manifest(filename, manifest):
+    with open(filename, 'w') as f:
+        json.dump({'version': _MANIFEST_VERSION, 'files': manifest}, f, indent=1, sort_keys=True)
+        f.write('\n')
+
+
+def start_batch(options, files):
+    """
+    Scours all (input filename, relative output filename) tuples in 'files' into the
+    output directory, using a pool of 'options.jobs' worker processes.
+
+    If a manifest file is given in 'options.manifest', inputs that did not change since the last run
+    (and were scoured with the same options) are skipped and their previous output is kept.
+
+    Prints a combined report aggregating the stats of all files and returns the list of BatchResults.
+    """
+    import multiprocessing
+
+    begin = time.time()
+
+    job_options = plain_options(options)
+    # (also validates the options before starting the workers)
+    scourer = Scourer(job_options)
+    manifest = None
+    if options.manifest:
+        manifest = load_manifest(options.manifest)
+        fingerprint = options_fingerprint(options)
+
+    jobs = []
+    skipped = 0
+    for infilename, relname in files:
+        outfilename = os.path.join(options.outdir, relname)
+        if os.path.abspath(infilename) == os.path.abspath(outfilename):
+            raise IOError("Input file '{}' would be overwritten by its output".format(infilename))
+        if manifest is not None:
+            # skip inputs that did not change since the output was written using the same options
+            # (the manifest records the hash of the input as read by the worker, see scour_batch_file())
+            entry = manifest.get(relname)
+            if (entry and entry.get('input') == file_hash(infilename) and entry.get('options') == fingerprint
+                    and os.path.isfile(outfilename)):
+                skipped += 1
+                continue
+        jobs.append((infilename, outfilename))
+
+    num_workers = options.jobs
+    if not num_workers:
+        num_workers = multiprocessing.cpu_count()
+    num_workers = min(num_workers, len(jobs))
+
+    results = []
+    out = options.ensure_value("stdout", sys.stdout)
+    if options.stats_format == 'csv' and not options.quiet:
+        print(generate_csv([], header=True), file=out)
+    if num_workers > 1:
+        pool = multiprocessing.Pool(num_workers, _init_batch_worker, (job_options,))
+        try:
+            for result in pool.imap(_scour_batch_job, jobs):
+                results.append(result)
+                _report_batch_result(result, options, out)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for infilename, outfilename in jobs:
+            result = scour_batch_file(infilename, outfilename, job_options, scourer)
+            results.append(result)
+            _report_batch_result(result, options, out)
+
+    if manifest is not None:
+        for result in results:
+            relname = os.path.relpath(result.outfilename, options.outdir)
+            if result.error is None:
+                manifest[relname] = {'input': result.input_hash, 'options': fingerprint}
+            else:
+                manifest.pop(relname, None)
+        save_manifest(options.manifest, manifest)
+
+    duration = int(round((time.time() - begin) * 1000.))
+
+    summary = batch_summary(results, skipped, duration, options.slowest)
+    total_stats = summary['stats']
+
+    if options.quiet:
+        pass
+    elif options.stats_format == 'json':
+        summary['stats'] = total_stats.as_dict()
+        print(json.dumps(OrderedDict([
+            ('files', [stats_record(result.infilename, result.stats, result.oldsize, result.newsize,
+                                    result.duration, result.error) for result in results]),
+            ('summary', summary),
+        ])), file=out)
+    elif options.stats_format == 'csv':
+        print(generate_csv([stats_record('TOTAL', total_stats, summary['input_size'], summary['output_size'],
+                                         duration)], header=False), file=out)
+    else:
+        print('Scour processed {} of {} files in {} ms{}: {}/{} bytes new/orig -> {:.1f}%'.format(
+            summary['files'] - summary['failed'],
+            summary['files'],
+            duration,
+            ' ({} unchanged files skipped)'.format(skipped) if skipped else '',
+            summary['output_size'],
+            summary['input_size'],
+            summary['ratio']), file=out)
+        if options.verbose:
+            print(generate_report(total_stats), file=out)
+            if summary['ratio_percentiles']:
+                percentiles = summary['ratio_percentiles'].items()
+                print('  Size ratio new/orig: ' + ', '.join('{} {:.1f}%'.format(name, value)
+                                                            for name, value in percentiles), file=out)
+                print('  Slowest files:', file=out)
+                for entry in summary['slowest']:
+                    print('    {} ms: {}'.format(entry['duration_ms'], entry['file']), file=out)
+    if options.profile and options.stats_format != 'json' and total_stats.profile is not None:
+        print(generate_profile_report(total_stats.profile, options.profile_format), file=out)
+
+    return results
+
+
+def _report_batch_result(result, options, out):
+    if result.error is not None:
+        print('ERROR: Could not process file "{}": {}'.format(result.infilename, result.error), file=sys.stderr)
+    if options.quiet or options.stats_format == 'json':
+        # JSON output is printed all at once in the end
+        pass
+    elif options.stats_format == 'csv':
+        print(generate_csv([stats_record(result.infilename, result.stats, result.oldsize, result.newsize,
+                                         result.duration, result.error)], header=False), file=out)
+    elif result.error is None:
+        print('Scour processed file "{}" in {} ms: {}/{} bytes new/orig -> {:.1f}%'.format(
+            result.infilename,
+            result.duration,
+            result.newsize,
+            result.oldsize,
+            (result.newsize / result.oldsize) * 100. if result.oldsize else 100.), file=out)
 
 
 def run():
     options = parse_args()
+    if options.serve:
+        from scour.server import serve
+        serve(options)
+        return
+    if options.outdir:
+        try:
+            files = collect_batch_inputs(options.batch_inputs)
+            results = start_batch(options, files)
+        except IOError as e:
+            _options_parser.error(str(e))
+        if any(result.error is not None for result in results):
+            sys.exit(1)
+        return
     (input, output) = getInOut(options)
     start(options, input, output)
 
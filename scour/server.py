@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#  Scour server mode
+#
+#  This file is part of Scour, http://www.codedread.com/scour/
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+""" Long-running HTTP server for Scour (started with 'scour --serve').
+
+Keeping a warm process avoids paying for interpreter startup and module initialization
+on every call, which dominates the processing time of small documents.
+
+The server listens on localhost (or a Unix domain socket, see '--listen') and accepts
+SVG documents as the body of POST requests. Options may be given as query parameters
+named after the long command line options and override the options the server was
+started with, e.g.
+
+    curl --data-binary @input.svg 'http://localhost:8042/?set-precision=3&shorten-ids'
+
+The response is a JSON object with the following members:
+
+    svg          the scoured document
+    stats        the statistics of the run (see ScourStats, includes the
+                 timings of the individual stages if 'profile' is requested)
+    duration     the processing time in ms
+    input_size   the size of the input in bytes
+    output_size  the size of the (UTF-8 encoded) output in bytes
+
+Errors are reported with an appropriate HTTP status and a JSON object with an 'error' member.
+Requests are processed by a pool of '--jobs' worker processes; if more than '--queue-depth'
+requests are waiting for a worker, new requests are rejected with '503 Service Unavailable'
+(and requests larger than '--max-request-size' with '413 Payload Too Large').
+
+As the documents come from the clients, rasters referenced by them are only embedded if the server
+is started with '--allow-embed-rasters' (which lets clients make the server read local files and
+fetch arbitrary URLs).
+"""
+from __future__ import absolute_import, division, print_function
+
+import copy
+import json
+import optparse
+import os
+import socket
+import stat
+import sys
+import threading
+import time
+
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import parse_qsl, urlsplit
+
+from scour import __version__
+from scour.scour import Scourer, _options_parser, plain_options
+
+
+# options that only make sense for the server itself or for the command line and can't be set per request
+_SERVER_ONLY_OPTIONS = frozenset(('help', 'version', 'quiet', 'verbose', 'stats-format', 'profile-format',
+                                  'input', 'output', 'input-list', 'output-dir', 'jobs', 'manifest', 'slowest',
+                                  'serve', 'listen', 'queue-depth', 'max-request-size', 'allow-embed-rasters',
+                                  'stream'))
+
+
+class RequestError(Exception):
+
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+def _raise_option_error(msg):
+    raise RequestError(400, msg)
+
+
+def parse_request_options(query, defaults):
+    """
+    Parses the query string of a request into options.
+
+    Each parameter is handled like the long command line option of the same name ('key=value'
+    like '--key=value', a bare 'key' like '--key'), starting from the options in 'defaults'.
+    Raises a RequestError for unknown or invalid options.
+    """
+    # optparse keeps the parsing state on the parser, so every request needs its own (shallow) copy
+    parser = copy.copy(_options_parser)
+    parser.error = _raise_option_error
+
+    args = []
+    for key, value in parse_qsl(query, keep_blank_values=True):
+        # resolve abbreviations first, so server-only options can't be sneaked in
+        try:
+            option = parser._match_long_opt('--' + key)
+        except optparse.BadOptionError as e:
+            raise RequestError(400, str(e))
+        if option[2:] in _SERVER_ONLY_OPTIONS:
+            raise RequestError(400, "option '{}' can not be used in requests".format(key))
+        args.append(option + ('=' + value if value else ''))
+
+    options, rargs = parser.parse_args(args, copy.copy(defaults))
+    if rargs:
+        raise RequestError(400, "invalid option(s): {}".format(', '.join(rargs)))
+    return options
+
+
+# the Scourers of a worker process by the query strings of the requests (see scour_request()), so the options
+# are prepared only once per worker for each distinct set of options instead of for every request
+_scourers = {}
+
+# maximum number of Scourers kept by a worker process (requests may use arbitrary combinations of options)
+_MAX_SCOURERS = 64
+
+
+def _init_worker():
+    _scourers.clear()
+
+
+def scour_request(in_string, options, key=None):
+    """
+    Scours a single document (this is run inside the worker processes).
+
+    If given, 'key' identifies the options (e.g. the query string of the request), which are then
+    prepared only once by the worker process and reused for later requests with the same key.
+
+    Returns a dictionary suitable for the JSON response; errors are returned in its 'error'
+    member (as exceptions can't necessarily be sent back from the worker processes).
+    """
+    begin = time.time()
+    try:
+        scourer = _scourers.get(key)
+        if scourer is None:
+            scourer = Scourer(options)
+            if key is not None:
+                if len(_scourers) >= _MAX_SCOURERS:
+                    _scourers.clear()
+                _scourers[key] = scourer
+        out_string, stats = scourer.scour(in_string)
+    except Exception as e:
+        return {'error': 'could not scour document: {}'.format(str(e) or type(e).__name__)}
+    duration = int(round((time.time() - begin) * 1000.))
+
+    return {
+        'svg': out_string,
+        'stats': stats.as_dict(),
+        'duration': duration,
+        'input_size': len(in_string),
+        'output_size': len(out_string.encode('UTF-8')),
+    }
+
+
+class ScourRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    server_version = 'Scour/' + __version__
+
+    def do_GET(self):
+        # allows to check whether the server is up
+        self._send_json(200, {'version': __version__})
+
+    def do_POST(self):
+        if not self.server.request_slots.acquire(False):
+            self._send_json(503, {'error': 'too many requests'})
+            return
+        try:
+            try:
+                result = self._handle_post()
+                status = 400 if 'error' in result else 200
+            except RequestError as e:
+                status, result = e.status, {'error': str(e)}
+            self._send_json(status, result)
+        finally:
+            self.server.request_slots.release()
+
+    def _handle_post(self):
+        query = urlsplit(self.path).query
+        options = parse_request_options(query, self.server.default_options)
+
+        length = self.headers.get('Content-Length')
+        if length is None:
+            raise RequestError(411, 'missing Content-Length')
+        try:
+            length = int(length)
+        except ValueError:
+            length = -1
+        if length < 0:
+            raise RequestError(400, 'invalid Content-Length')
+        if length > self.server.max_request_size:
+            # (the body is not read, so the connection can't be used any further)
+            self.close_connection = True
+            raise RequestError(413, 'request body too large (maximum: {} bytes)'.format(self.server.max_request_size))
+        in_string = self.rfile.read(length)
+
+        return self.server.pool.apply(scour_request, (in_string, options, query))
+
+    def _send_json(self, status, result):
+        body = json.dumps(result, sort_keys=True).encode('UTF-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # there is no client address for connections via Unix domain sockets
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return 'unix'
+
+    def log_message(self, format, *args):
+        if self.server.default_options.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+# (not derived from object, as the server classes of Python 2 are old-style classes)
+class _ScourServerMixin:
+    daemon_threads = True
+
+    def setup_workers(self, options):
+        import multiprocessing
+
+        self.default_options = plain_options(options)
+        # documents are sent by the clients, so they must not make the server read local files or fetch URLs
+        # unless explicitly allowed (and paths must not be resolved relative to the input file of the server)
+        self.default_options.infilename = self.default_options.outfilename = None
+        if not options.allow_embed_rasters:
+            self.default_options.embed_rasters = False
+        self.max_request_size = options.max_request_size
+        num_workers = options.jobs or multiprocessing.cpu_count()
+        self.pool = multiprocessing.Pool(num_workers, _init_worker)
+        # requests being processed plus requests waiting for a worker
+        self.request_slots = threading.BoundedSemaphore(num_workers + options.queue_depth)
+
+    def server_close(self):
+        socketserver.TCPServer.server_close(self)
+        self.pool.terminate()
+        self.pool.join()
+
+
+class ScourHTTPServer(_ScourServerMixin, socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    pass
+
+
+if hasattr(socket, 'AF_UNIX'):
+    class ScourUnixHTTPServer(_ScourServerMixin, socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+
+        def server_bind(self):
+            # remove a stale socket left behind by a previous server
+            try:
+                if stat.S_ISSOCK(os.stat(self.server_address).st_mode):
+                    os.remove(self.server_address)
+            except OSError:
+                pass
+            socketserver.UnixStreamServer.server_bind(self)
+
+        def server_close(self):
+            _ScourServerMixin.server_close(self)
+            try:
+                os.remove(self.server_address)
+            except OSError:
+                pass
+
+
+def parse_address(address):
+    """
+    Parses the address given with '--listen' into a (family, address) tuple.
+    """
+    if address.startswith('unix:'):
+        if not hasattr(socket, 'AF_UNIX'):
+            raise ValueError("Unix domain sockets are not supported on this platform")
+        return socket.AF_UNIX, address[len('unix:'):]
+
+    host, _, port = address.rpartition(':')
+    try:
+        port = int(port)
+    except ValueError:
+        raise ValueError("invalid address '{}'".format(address))
+    return socket.AF_INET, (host or 'localhost', port)
+
+
+def make_server(options):
+    """
+    Creates a server (without starting it) for the given options, see serve().
+    """
+    family, address = parse_address(options.listen)
+    if family == socket.AF_INET:
+        server = ScourHTTPServer(address, ScourRequestHandler)
+    else:
+        server = ScourUnixHTTPServer(address, ScourRequestHandler)
+    try:
+        server.setup_workers(options)
+    except Exception:
+        socketserver.TCPServer.server_close(server)
+        raise
+    return server
+
+
+def serve(options):
+    """
+    Runs the Scour server until it is interrupted.
+    """
+    try:
+        server = make_server(options)
+    except (ValueError, socket.error) as e:
+        _options_parser.error("Could not start server: {}".format(e))
+
+    if not options.quiet:
+        address = server.server_address
+        if isinstance(address, tuple):
+            address = 'http://{}:{}/'.format(*address[:2])
+        print('Scour server listening on {}'.format(address), file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -1,3 +1,14 @@
+from __future__ import absolute_import
+
+import time
+from collections import OrderedDict
+
+from scour.traversal import get_elements_by_tag_name
+
+# perf_counter() is not available in Python 2
+_timer = getattr(time, 'perf_counter', time.time)
+
+
 class ScourStats(object):
 
     __slots__ = (
@@ -7,16 +18,15 @@ class ScourStats(object):
         'num_bytes_saved_in_colors',
         'num_ids_removed',
         'num_comments_removed',
-        'num_style_properties_fixed',
         'num_rasters_embedded',
         'num_path_segments_removed',
         'num_points_removed_from_polygon',
         'num_bytes_saved_in_path_data',
-        'num_bytes_saved_in_colors',
         'num_bytes_saved_in_comments',
         'num_bytes_saved_in_ids',
         'num_bytes_saved_in_lengths',
         'num_bytes_saved_in_transforms',
+        'profile',
     )
 
     def __init__(self):
@@ -24,5 +34,130 @@ class ScourStats(object):
 
     def reset(self):
         # Set all stats to 0
-        for attr in self.__slots__:
+        for attr in self.counters():
             setattr(self, attr, 0)
+        # ScourProfile (only if profiling was requested)
+        self.profile = None
+
+    @classmethod
+    def counters(cls):
+        # The names of all numeric stats
+        return cls.__slots__[:-1]
+
+    def __iadd__(self, other):
+        # Accumulate the stats of another run (e.g. to aggregate the stats of several files)
+        for attr in self.counters():
+            setattr(self, attr, getattr(self, attr) + getattr(other, attr))
+        if other.profile is not None:
+            if self.profile is None:
+                self.profile = ScourProfile()
+            self.profile += other.profile
+        return self
+
+    def as_dict(self):
+        result = OrderedDict((attr, getattr(self, attr)) for attr in self.counters())
+        if self.profile is not None:
+            result['profile'] = self.profile.as_dict()
+        return result
+
+
+class ScourProfile(object):
+    """
+    Timers and counters for the individual stages of scouring a document.
+
+    For each stage the following is recorded:
+        time        the time spent in the stage (in seconds)
+        calls       how often the function(s) implementing the stage were called
+                    (for stages processing elements one by one: the number of elements)
+        tree_size   the number of elements of the (sub)tree the stage operated on when it started
+                    (which is counted only for that, not recorded by the stage itself)
+        iterations  the number of additional iterations of fixed-point loops
+                    (stages repeated until nothing changes anymore)
+
+    Stages are timed one after the other: start() ends the current stage (if any)
+    and stop() ends the last one.
+
+    Additionally the hits and misses of the caches used while scouring are recorded
+    with record_cache().
+    """
+
+    FIELDS = ('time', 'calls', 'tree_size', 'iterations')
+
+    def __init__(self):
+        self.stages = OrderedDict()
+        self.caches = OrderedDict()
+        self._current = None
+        self._begin = 0
+
+    def start(self, name, node=None, calls=1):
+        """
+        Starts the stage 'name'.
+
+        If 'node' is given, the elements of the subtree rooted at it are counted as the tree size.
+        """
+        self.stop()
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = dict.fromkeys(self.FIELDS, 0)
+        stage['calls'] += calls
+        if node is not None:
+            # (count before starting the timer, so counting does not distort the timing)
+            stage['tree_size'] += len(get_elements_by_tag_name(node, '*')) + 1
+        self._current = stage
+        self._begin = _timer()
+
+    def iteration(self):
+        """
+        Records another iteration of a fixed-point loop in the current stage.
+        """
+        self._current['iterations'] += 1
+        self._current['calls'] += 1
+
+    def stop(self):
+        if self._current is not None:
+            self._current['time'] += _timer() - self._begin
+            self._current = None
+
+    def record_cache(self, name, hits, misses):
+        """
+        Records 'hits' and 'misses' of the cache 'name'.
+        """
+        cache = self.caches.get(name)
+        if cache is None:
+            cache = self.caches[name] = {'hits': 0, 'misses': 0}
+        cache['hits'] += hits
+        cache['misses'] += misses
+
+    def cache_stats(self):
+        # hits, misses and the hit rate (in %) of all caches
+        return OrderedDict((name, OrderedDict([('hits', cache['hits']),
+                                               ('misses', cache['misses']),
+                                               ('hit_rate', _hit_rate(cache))]))
+                           for name, cache in self.caches.items())
+
+    def total_time(self):
+        return sum(stage['time'] for stage in self.stages.values())
+
+    def __iadd__(self, other):
+        for name, other_stage in other.stages.items():
+            stage = self.stages.get(name)
+            if stage is None:
+                stage = self.stages[name] = dict.fromkeys(self.FIELDS, 0)
+            for field in self.FIELDS:
+                stage[field] += other_stage[field]
+        for name, cache in other.caches.items():
+            self.record_cache(name, cache['hits'], cache['misses'])
+        return self
+
+    def as_dict(self):
+        # times are converted to ms
+        return OrderedDict((name, OrderedDict([('time_ms', round(stage['time'] * 1000., 3)),
+                                               ('calls', stage['calls']),
+                                               ('tree_size', stage['tree_size']),
+                                               ('iterations', stage['iterations'])]))
+                           for name, stage in self.stages.items())
+
+
+def _hit_rate(cache):
+    lookups = cache['hits'] + cache['misses']
+    return round(cache['hits'] * 100. / lookups, 2) if lookups else 0.
@@ -0,0 +1,636 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#  Scour streaming mode
+#
+#  This file is part of Scour, http://www.codedread.com/scour/
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+""" Streaming mode for Scour (started with 'scour --stream').
+
+Scours documents too large to be kept in memory as a whole (like maps or plots with hundreds of
+thousands of elements) while reading them, so memory use depends on the size of the largest element
+outside of groups instead of the size of the document. The document is read twice:
+
+  1. A lightweight scan (expat calling back into Python, without building a tree) collects the
+     referenced IDs and the namespaces in use.
+  2. The document is parsed incrementally. The root <svg> element and the <g> elements nested in it
+     (e.g. layers) are kept open as containers, while every other child of a container is built into
+     a DOM subtree once it is complete, scoured, written to the output and discarded.
+
+Only the optimizations of single elements are applied: removing editor data, descriptive elements,
+comments and unreferenced IDs, repairing styles, simplifying colors, cleaning path data and points,
+scouring lengths, reducing precision, removing default attribute values and optimizing transforms.
+Optimizations relating elements to each other throughout the document are not: unreferenced elements
+and duplicate gradients are kept, groups are neither merged, created nor collapsed, common attributes
+are not moved to groups and IDs are not shortened. The styles of the containers are repaired as if all
+of their properties were inherited by their children (as those are not known yet).
+
+Documents are parsed with xml.etree.ElementTree (comments are only kept with Python 3.8 and later), so
+the prefixes of namespaces bound to several prefixes and the internal subset of a document type
+declaration are not kept, and CDATA sections are written as text.
+"""
+from __future__ import absolute_import, print_function
+
+import sys
+import tempfile
+import xml.dom.minidom
+import xml.etree.ElementTree as ElementTree
+
+import six
+
+from scour.scour import (NS, LENGTH_ATTRIBUTES, LENGTH_ELEMENTS, RE_COMMA_WSP, NamespaceIndex, OutputWriter,
+                         ScourProfile, StyleMap, _ALL_STYLES, _number_cache, _path_cache, clean_path, clean_polygon,
+                         cleanPolyline, convertColors, embed_rasters, findReferencingProperty,
+                         is_empty_container, make_well_formed, optimize_transforms_visitor, parseCssString,
+                         properlySizeDoc, protected_ids, reduce_precision_visitor, referencingProps,
+                         remapNamespacePrefix, remove_comments, remove_default_attribute_values_visitor,
+                         remove_descriptive_elements, removeNamespacedAttributes, removeNamespacedElements,
+                         repairStyle, run_element_visitors, scourLength, scourUnitlessLength, serializeStartTag,
+                         unwanted_ns, visit_element, writeXML)
+from scour.traversal import get_elements_by_tag_name
+from scour.xml_backend import ElementTreeBackend, _ElementTreeBuilder, attribute_nodes
+
+
+# the size of the blocks the document is read in
+BLOCK_SIZE = 64 * 1024
+
+# inputs that can't be read twice are kept in a temporary file (in memory up to this size)
+SPOOL_SIZE = 8 * 1024 * 1024
+
+_VISITORS = [reduce_precision_visitor, remove_default_attribute_values_visitor, optimize_transforms_visitor]
+
+_SVG_G = '{' + NS['SVG'] + '}g'
+_SVG_STYLE = '{' + NS['SVG'] + '}style'
+_XLINK_HREF = '{' + NS['XLINK'] + '}href'
+_XML_SPACE = '{http://www.w3.org/XML/1998/namespace}space'
+
+
+class _ReferenceCollector(object):
+    # the parser target of the first pass, collecting the references to IDs like findReferencedElements()
+    # and the namespaces of the elements and attributes that are kept
+
+    def __init__(self, options):
+        self.references = {}
+        self.namespaces = set()
+        self.flow_roots = 0
+        # whether there are elements or attributes in the namespaces of editors to be removed
+        self.editor_data = False
+        self.document_type = None
+        self._removed_namespaces = set() if options.keep_editor_data else set(unwanted_ns)
+        self._removed_tags = set('{' + NS['SVG'] + '}' + tag for tag in _descriptive_tags(options))
+        self._skip = 0
+        self._stylesheet = None
+
+    def start(self, tag, attrib):
+        if tag[0] == '{':
+            uri, _, localname = tag[1:].partition('}')
+        else:
+            uri, localname = None, tag
+        if localname == 'flowRoot':
+            self.flow_roots += 1
+        # (removed elements don't count, as they are gone before the references are looked for)
+        if self._skip or tag in self._removed_tags or uri in self._removed_namespaces:
+            self.editor_data = self.editor_data or uri in self._removed_namespaces
+            self._skip += 1
+            return
+        self.namespaces.add(uri)
+
+        for name in attrib:
+            if name[0] == '{':
+                uri = name[1:].partition('}')[0]
+                self.namespaces.add(uri)
+                self.editor_data = self.editor_data or uri in self._removed_namespaces
+
+        if tag == _SVG_STYLE:
+            self._stylesheet = []
+            return
+        href = attrib.get(_XLINK_HREF, '')
+        if len(href) > 1 and href[0] == '#':
+            self.references.setdefault(href[1:], set())
+        style = attrib.get('style')
+        if style:
+            for prop, val in six.iteritems(StyleMap(style)):
+                findReferencingProperty(None, prop, val, self.references)
+        for attr in referencingProps:
+            val = attrib.get(attr, '').strip()
+            if val:
+                findReferencingProperty(None, attr, val, self.references)
+
+    def end(self, tag):
+        if self._skip:
+            self._skip -= 1
+        elif self._stylesheet is not None:
+            stylesheet = ''.join(self._stylesheet)
+            self._stylesheet = None
+            if stylesheet != '':
+                for rule in parseCssString(stylesheet):
+                    for propname, propval in six.iteritems(rule['properties']):
+                        findReferencingProperty(None, propname, propval, self.references)
+
+    def data(self, data):
+        if self._stylesheet is not None and not self._skip:
+            self._stylesheet.append(data)
+
+    def doctype(self, name, pubid, system):
+        self.document_type = (name, pubid, system)
+
+    def close(self):
+        return self
+
+
+def _descriptive_tags(options):
+    # the elements removed by remove_descriptive_elements()
+    if options.remove_descriptive_elements:
+        return ['title', 'desc', 'metadata']
+    return [tag for tag, remove in [('title', options.remove_titles),
+                                    ('desc', options.remove_descriptions),
+                                    ('metadata', options.remove_metadata)] if remove]
+
+
+class _Container(object):
+    # an element kept open while its children are streamed (the root element or a group in it)
+
+    __slots__ = ('node', 'element', 'parent', 'scope', 'depth', 'states', 'preserveWhitespace', 'start_tag',
+                 'opened', 'onNewLine', 'last')
+
+    def __init__(self, node, element, parent, scope):
+        self.node = node
+        self.element = element
+        self.parent = parent
+        self.scope = scope
+        self.depth = 0 if parent is None else parent.depth + 1
+        self.states = None
+        self.preserveWhitespace = False
+        self.start_tag = None
+        # whether the start tag was written and whether there is an element on a line of its own in it
+        self.opened = False
+        self.onNewLine = False
+        # the last child read (which is followed by the text in its tail)
+        self.last = None
+
+
+class _Streamer(object):
+
+    def __init__(self, options, stats, collector, writer):
+        self.options = options
+        self.stats = stats
+        self.referenced_ids = collector.references
+        self.namespaces = collector.namespaces
+        self.editor_data = collector.editor_data
+        self.writer = writer
+        self.write = writer.write
+        self.builder = _ElementTreeBuilder({})
+        self.redundantPrefixes = []
+
+    def run(self, source):
+        events = ('start-ns', 'start', 'end', 'comment', 'pi')
+        try:
+            parser = ElementTree.XMLParser(target=ElementTree.TreeBuilder(insert_comments=True, insert_pis=True))
+        except TypeError:
+            # (comments and processing instructions are only kept by Python 3.8 and later)
+            parser = ElementTree.XMLParser()
+            events = events[:3]
+
+        declarations = self.builder.declarations
+        containers = []
+        pending = []
+        # the depth of the current element in the child of the innermost container being read
+        depth = 0
+        for event, node in ElementTree.iterparse(source, events, parser):
+            if event == 'start-ns':
+                pending.append(node)
+            elif event == 'start':
+                if pending:
+                    declarations[node] = pending
+                    pending = []
+                if depth:
+                    depth += 1
+                elif not containers:
+                    containers.append(self.start_root(node))
+                else:
+                    container = containers[-1]
+                    self.flush_text(container)
+                    container.last = node
+                    if self.is_container(container, node):
+                        containers.append(self.start_group(container, node))
+                    else:
+                        depth = 1
+            elif event == 'end':
+                if depth:
+                    depth -= 1
+                    if not depth:
+                        self.scour_child(containers[-1], node)
+                else:
+                    self.end_container(containers.pop())
+            elif depth:
+                # (comments and processing instructions within children are part of their tree)
+                pass
+            elif containers:
+                self.add_comment(containers[-1], node)
+            elif node.tag is ElementTree.PI:
+                target, _, data = node.text.partition(' ')
+                self.write(self.builder.document.createProcessingInstruction(target, data).toxml() + '\n')
+            elif not self.remove_comment(node):
+                self.write(self.builder.document.createComment(node.text).toxml() + '\n')
+
+    def start_root(self, node):
+        options = self.options
+        stats = self.stats
+        builder = self.builder
+        document = builder.document
+
+        scope = builder.root_scope
+        declared = builder.declarations.get(node)
+        if declared:
+            scope = scope.declare(declared)
+        root = self.add_start_tag(document, node, builder.root_scope)
+
+        # remove namespaced attributes and namespace declarations like _scour_document() does
+        if options.keep_editor_data is False:
+            stats.num_attributes_removed += removeNamespacedAttributes(root, unwanted_ns)
+            xmlnsDeclsToRemove = [attr.nodeName for attr in attribute_nodes(root) if attr.nodeValue in unwanted_ns]
+            for attrName in xmlnsDeclsToRemove:
+                root.removeAttribute(attrName)
+            stats.num_attributes_removed += len(xmlnsDeclsToRemove)
+
+        if root.getAttribute('xmlns') != NS['SVG']:
+            root.setAttribute('xmlns', NS['SVG'])
+
+        # (the namespaces in use are known from the first pass)
+        xmlnsDeclsToRemove = []
+        for attr in attribute_nodes(root):
+            name = attr.nodeName
+            if name[0:6] == 'xmlns:':
+                if attr.nodeValue == NS['SVG']:
+                    self.redundantPrefixes.append(name[6:])
+                    xmlnsDeclsToRemove.append(name)
+                elif attr.nodeValue not in self.namespaces:
+                    xmlnsDeclsToRemove.append(name)
+        for attrName in xmlnsDeclsToRemove:
+            root.removeAttribute(attrName)
+        stats.num_attributes_removed += len(xmlnsDeclsToRemove)
+        for prefix in self.redundantPrefixes:
+            remapNamespacePrefix(root, prefix, '')
+        root = document.documentElement
+
+        if options.strip_xml_space_attribute and root.hasAttribute('xml:space'):
+            root.removeAttribute('xml:space')
+            stats.num_attributes_removed += 1
+
+        container = _Container(node, root, None, scope)
+        self.scour_container(container, [None] * len(_VISITORS))
+        return container
+
+    def add_start_tag(self, parent, node, scope):
+        # adds the element of a container without its children
+        # (iterparse() reports events a block of the document at a time, so the parser may have added
+        # children to node already)
+        declarations = self.builder.declarations
+        start_tag = ElementTree.Element(node.tag, node.attrib)
+        if node in declarations:
+            declarations[start_tag] = declarations.pop(node)
+        return self.builder.add_element(parent, start_tag, scope)
+
+    def scope(self, parent, node):
+        # the namespaces in scope of a child of a container
+        declared = self.builder.declarations.get(node)
+        if declared:
+            return parent.scope.declare(declared)
+        return parent.scope
+
+    def is_container(self, parent, node):
+        # groups are streamed as well, unless their content has to be kept as is
+        # (or their name has a prefix to be remapped)
+        return (node.tag == _SVG_G and not parent.preserveWhitespace and _XML_SPACE not in node.attrib
+                and self.scope(parent, node).qualify(_SVG_G)[0] == 'g')
+
+    def start_group(self, parent, node):
+        scope = self.scope(parent, node)
+        group = self.add_start_tag(parent.element, node, parent.scope)
+        if self.editor_data:
+            self.stats.num_attributes_removed += removeNamespacedAttributes(group, unwanted_ns)
+
+        container = _Container(node, group, parent, scope)
+        self.scour_container(container, parent.states)
+        return container
+
+    def scour_container(self, container, states):
+        # scours the start tag of a container (before any of its children are known)
+        options = self.options
+        stats = self.stats
+        element = container.element
+
+        element.mayContainTextNodes = True
+        stats.num_style_properties_fixed += repairStyle(element, options, {element: _ALL_STYLES})
+        if options.simple_colors:
+            stats.num_bytes_saved_in_colors += convertColors(element)
+        if options.strip_ids:
+            self.remove_unreferenced_ids([element])
+
+        if container.parent is None:
+            for attr in LENGTH_ATTRIBUTES:
+                if element.getAttribute(attr) != '':
+                    element.setAttribute(attr, scourLength(element.getAttribute(attr), options))
+            viewBox = element.getAttribute('viewBox')
+            if viewBox:
+                lengths = RE_COMMA_WSP.split(viewBox)
+                lengths = [scourUnitlessLength(length, options) for length in lengths]
+                element.setAttribute('viewBox', ' '.join(lengths))
+
+        totals = [0] * len(_VISITORS)
+        container.states = visit_element(element, _VISITORS, options, states, totals)
+        self.add_visitor_totals(totals)
+
+        if container.parent is None and options.enable_viewboxing:
+            properlySizeDoc(element, options)
+
+        outParts = []
+        container.preserveWhitespace = serializeStartTag(element, options, container.depth, False, outParts)
+        container.start_tag = ''.join(outParts)
+
+    def scour_child(self, container, node):
+        # scours a complete child of a container like _scour_document() does (as far as possible)
+        options = self.options
+        stats = self.stats
+        builder = self.builder
+        document = builder.document
+        parent = container.element
+
+        # (the tail may be read already, see add_start_tag())
+        tail = node.tail
+        builder.add_element(parent, node, container.scope)
+        node.tail = tail
+        # (the children of a container are removed once written, so the new one is the only one)
+        del container.node[:]
+        builder.strings.clear()
+
+        stats.num_elements_removed += remove_descriptive_elements(document, options)
+        if self.editor_data:
+            ns_index = NamespaceIndex(document)
+            stats.num_elements_removed += removeNamespacedElements(document.documentElement,
+                                                                   unwanted_ns, ns_index)
+            stats.num_attributes_removed += removeNamespacedAttributes(document.documentElement,
+                                                                       unwanted_ns, ns_index)
+        for prefix in self.redundantPrefixes:
+            remapNamespacePrefix(parent.firstChild, prefix, '')
+        if options.strip_comments:
+            remove_comments(parent, stats)
+
+        element = parent.firstChild
+        if element is None:
+            return
+        stats.num_style_properties_fixed += repairStyle(element, options)
+        if options.simple_colors:
+            stats.num_bytes_saved_in_colors += convertColors(element)
+
+        for tag in ['defs', 'title', 'desc', 'metadata', 'g']:
+            for elem in _elements_with_tag(element, tag):
+                if is_empty_container(elem):
+                    elem.parentNode.removeChild(elem)
+                    stats.num_elements_removed += 1
+        element = parent.firstChild
+        if element is None:
+            return
+
+        if options.strip_ids:
+            self.remove_unreferenced_ids(_elements_with_tag(element, '*'))
+
+        for polygon in _elements_with_tag(element, 'polygon'):
+            stats.num_points_removed_from_polygon += clean_polygon(polygon, options)
+        for polyline in _elements_with_tag(element, 'polyline'):
+            cleanPolyline(polyline, options)
+        for elem in _elements_with_tag(element, 'path'):
+            if elem.getAttribute('d') == '':
+                elem.parentNode.removeChild(elem)
+            else:
+                clean_path(elem, options, stats)
+        element = parent.firstChild
+        if element is None:
+            return
+
+        for type in LENGTH_ELEMENTS:
+            for elem in _elements_with_tag(element, type):
+                for attr in LENGTH_ATTRIBUTES:
+                    if elem.getAttribute(attr) != '':
+                        elem.setAttribute(attr, scourLength(elem.getAttribute(attr), options))
+        self.add_visitor_totals(run_element_visitors(element, _VISITORS, options, container.states))
+        if options.embed_rasters:
+            for elem in _elements_with_tag(element, 'image'):
+                stats.num_rasters_embedded += embed_rasters(elem, options)
+
+        self.open(container)
+        if container.preserveWhitespace:
+            writeXML(element, options, self.writer, 0, True)
+        else:
+            self.write(options.newline)
+            writeXML(element, options, self.writer, container.depth + 1)
+            container.onNewLine = True
+        parent.removeChild(element)
+
+    def add_visitor_totals(self, totals):
+        stats = self.stats
+        stats.num_bytes_saved_in_lengths += totals[0]
+        stats.num_attributes_removed += totals[1]
+        stats.num_bytes_saved_in_transforms += totals[2]
+
+    def remove_unreferenced_ids(self, elements):
+        # like remove_unreferenced_ids() with the references of the whole document collected in the first pass
+        identifiedElements = {}
+        for elem in elements:
+            id = elem.getAttribute('id')
+            if id:
+                identifiedElements[id] = elem
+        for id in protected_ids(identifiedElements, self.options):
+            del identifiedElements[id]
+        for id, node in identifiedElements.items():
+            if id not in self.referenced_ids and node.nodeName != 'font':
+                node.removeAttribute('id')
+                self.stats.num_ids_removed += 1
+
+    def add_comment(self, container, node):
+        # comments (and processing instructions, which are not written) between the children of a container
+        self.flush_text(container)
+        if node.tag is ElementTree.Comment and not self.remove_comment(node):
+            self.open(container)
+            self.write(''.join([self.options.newline, self.options.indentation * (container.depth + 1),
+                                '<!--', node.text, '-->']))
+        container.last = node
+        del container.node[:]
+
+    def remove_comment(self, node):
+        # whether a comment is removed (see remove_comments())
+        if self.options.strip_comments:
+            self.stats.num_bytes_saved_in_comments += len(node.text)
+            self.stats.num_comments_removed += 1
+            return True
+        return False
+
+    def flush_text(self, container):
+        # writes the text preceding the next child of a container (or its end tag) like serializeXML() does
+        if container.last is None:
+            text = container.node.text
+            container.node.text = None
+        else:
+            text = container.last.tail
+            container.last.tail = None
+        if not text:
+            return
+        if not container.preserveWhitespace:
+            text = text.strip()
+        # (whitespace makes the root element non-empty, but empty groups are removed)
+        if text or container.parent is None:
+            self.open(container)
+            self.write(make_well_formed(text))
+
+    def open(self, container):
+        # writes the start tag of a container once it is known to be non-empty
+        # (and those of its ancestors not opened yet, from the top down)
+        unopened = []
+        while container is not None and not container.opened:
+            unopened.append(container)
+            container = container.parent
+        for container in reversed(unopened):
+            parent = container.parent
+            if parent is not None:
+                self.write(self.options.newline)
+                parent.onNewLine = True
+            self.write(container.start_tag + '>')
+            container.opened = True
+
+    def end_container(self, container):
+        self.flush_text(container)
+        element = container.element
+        if container.opened:
+            if container.onNewLine:
+                self.write(self.options.newline + self.options.indentation * container.depth)
+            self.write('</' + element.nodeName + '>')
+        elif container.parent is None:
+            self.write(container.start_tag + '/>')
+        else:
+            self.stats.num_elements_removed += 1
+
+        if container.parent is None:
+            self.write('\n')
+        else:
+            element.parentNode.removeChild(element)
+            del container.parent.node[:]
+
+
+def _elements_with_tag(element, name):
+    # element itself and its descendants with the tag name 'name' (in document order)
+    elements = get_elements_by_tag_name(element, name)
+    if name == '*' or element.nodeName == name:
+        elements.insert(0, element)
+    return elements
+
+
+class _CountingReader(object):
+    # reads the document from a file, counting the bytes and keeping a copy if the file can't be read twice
+
+    def __init__(self, infile, spool):
+        self.infile = infile
+        self.spool = spool
+        self.size = 0
+
+    def read(self, size=-1):
+        data = self.infile.read(size)
+        self.size += len(data)
+        if self.spool is not None:
+            self.spool.write(data)
+        return data
+
+
+def _seekable(infile):
+    try:
+        return infile.seekable()
+    except AttributeError:
+        # (files of Python 2)
+        try:
+            infile.tell()
+            return True
+        except (AttributeError, IOError):
+            return False
+
+
+def scour_stream(infile, outfile, options, stats):
+    """
+    Scours the document read from the binary file 'infile' and writes it to the binary file 'outfile',
+    see Scourer.scour_stream() (which prepares the options).
+
+    Returns a tuple of the number of bytes read and written.
+    """
+    if options.profile:
+        if stats.profile is None:
+            stats.profile = ScourProfile()
+        profile = stats.profile
+        caches = (('path', _path_cache), ('number', _number_cache))
+        cache_counts = [(cache.hits, cache.misses) for _, cache in caches]
+        profile.start('collect_references')
+
+    # first pass: collect the references (and keep the document, if it can't be read again)
+    if _seekable(infile):
+        spool = None
+        position = infile.tell()
+    else:
+        spool = tempfile.SpooledTemporaryFile(SPOOL_SIZE)
+    reader = _CountingReader(infile, spool)
+    collector = _ReferenceCollector(options)
+    parser = ElementTree.XMLParser(target=collector)
+    prolog = reader.read(BLOCK_SIZE)
+    data = prolog
+    while data:
+        parser.feed(data)
+        data = reader.read(BLOCK_SIZE)
+    parser.close()
+
+    if collector.flow_roots:
+        errmsg = "SVG input document uses {} flow text elements, " \
+                 "which won't render on browsers!".format(collector.flow_roots)
+        if options.error_on_flowtext:
+            raise Exception(errmsg)
+        else:
+            print("WARNING: {}".format(errmsg), file=sys.stderr)
+
+    if options.profile:
+        profile.start('stream')
+
+    # second pass: scour the document while parsing it
+    writer = OutputWriter(outfile)
+    if options.strip_xml_prolog is False:
+        standalone = ElementTreeBackend._STANDALONE.match(prolog[:256].decode('UTF-8', 'replace'))
+        writer.write('<?xml version="1.0" encoding="UTF-8"' + (' standalone="yes"' if standalone else '') + '?>\n')
+    if collector.document_type is not None:
+        doctype = xml.dom.minidom.getDOMImplementation().createDocumentType(*collector.document_type)
+        writer.write(doctype.toxml() + '\n')
+
+    if spool is None:
+        infile.seek(position)
+        source = infile
+    else:
+        spool.seek(0)
+        source = spool
+    try:
+        _Streamer(options, stats, collector, writer).run(source)
+        writer.flush()
+    finally:
+        if spool is not None:
+            spool.close()
+
+    if options.profile:
+        profile.stop()
+        for (name, cache), (hits, misses) in zip(caches, cache_counts):
+            profile.record_cache(name, cache.hits - hits, cache.misses - misses)
+
+    return reader.size, writer.size
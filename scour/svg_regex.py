@@ -299,4 +299,105 @@ class SVGPathParser(object):
         return [x, y], token
 
 
-svg_parser = SVGPathParser()
+# the number of arguments of each command (None for arcs, they are handled separately because of their flags)
+_command_arity = {
+    'Z': 0, 'z': 0,
+    'M': 2, 'm': 2, 'L': 2, 'l': 2, 'T': 2, 't': 2,
+    'H': 1, 'h': 1, 'V': 1, 'v': 1,
+    'C': 6, 'c': 6,
+    'S': 4, 's': 4, 'Q': 4, 'q': 4,
+    'A': None, 'a': None,
+}
+_token_re = re.compile('|'.join(regex for name, regex in lexicon if name != 'int'))
+
+
+class FastSVGPathParser(object):
+    """ Parse SVG <path> data into a list of commands (like SVGPathParser, but faster).
+
+    Produces exactly the same output and errors as SVGPathParser (except for arcs missing
+    their flags at the end of the data, which raise a SyntaxError instead of a TypeError).
+    Instead of lexing the data token by token through a generator and dispatching on each
+    token, all tokens are found with a single regex call, grouped by command in a tight loop
+    and the arguments of each command are converted at once.
+    """
+
+    def parse(self, text):
+        """ Parse a string of SVG <path> data.
+        """
+        # (command, [argument, ...]) with the arguments still as strings
+        groups = []
+        numbers = None
+        for token in _token_re.findall(text):
+            if token in _command_arity:
+                numbers = []
+                groups.append((token, numbers))
+            elif numbers is None:
+                raise SyntaxError("expecting a command; got %r" % (('float', token),))
+            else:
+                numbers.append(token)
+
+        create_decimal = getcontext().create_decimal
+        commands = []
+        for i, (command, numbers) in enumerate(groups):
+            arity = _command_arity[command]
+            if arity is None:
+                arguments = self._arc_arguments(numbers, self._next_token(groups, i))
+            else:
+                if arity == 0 and numbers:
+                    raise SyntaxError("expecting a command; got %r" % (('float', numbers[0]),))
+                arguments = list(map(create_decimal, numbers))
+                if arity and len(arguments) % arity:
+                    raise SyntaxError("expecting a number; got %r" % (self._next_token(groups, i),))
+            commands.append((command, arguments))
+        return commands
+
+    def _next_token(self, groups, i):
+        # the token following the arguments of the i-th command (for error messages)
+        if i + 1 < len(groups):
+            return ('command', groups[i + 1][0])
+        return (EOF, None)
+
+    def _arc_arguments(self, numbers, next_token):
+        # (follows SVGPathParser.rule_elliptical_arc(), flags may be run together with the following number)
+        arguments = []
+        numbers = list(numbers)
+        i = 0
+
+        def number(i):
+            if i >= len(numbers):
+                raise SyntaxError("expecting a number; got %r" % (next_token,))
+            return Decimal(numbers[i]) * 1
+
+        def flag(i):
+            if i < len(numbers):
+                token = numbers[i]
+                if token[0] not in ('0', '1'):
+                    raise SyntaxError("expecting a boolean flag; got %r" % (('float', token),))
+            else:
+                token = next_token[1]
+                if not token or token[0] not in ('0', '1'):
+                    raise SyntaxError("expecting a boolean flag; got %r" % (next_token,))
+            if len(token) > 1:
+                numbers[i] = token[1:]
+            else:
+                i += 1
+            return Decimal(token[0]) * 1, i
+
+        while i < len(numbers):
+            rx = number(i)
+            if rx < Decimal("0.0"):
+                raise SyntaxError("expecting a nonnegative number; got %r" % (('float', numbers[i]),))
+            ry = number(i + 1)
+            if ry < Decimal("0.0"):
+                raise SyntaxError("expecting a nonnegative number; got %r" % (('float', numbers[i + 1]),))
+            axis_rotation = number(i + 2)
+            large_arc_flag, i = flag(i + 3)
+            sweep_flag, i = flag(i)
+            x = number(i)
+            y = number(i + 1)
+            i += 2
+            arguments.extend([rx, ry, axis_rotation, large_arc_flag, sweep_flag, x, y])
+        return arguments
+
+
+svg_parser = FastSVGPathParser()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#  Tree traversal for Scour
+#
+#  This file is part of Scour, http://www.codedread.com/scour/
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+""" Iterative traversal of DOM trees.
+
+The passes of Scour walk the document with the functions of this module, which keep the path
+from the root to the current node on an explicit stack instead of recursing. Machine-generated
+documents nesting elements thousands of levels deep therefore don't exceed the recursion limit
+of Python, and no Python frame has to be set up per node.
+
+Like the recursive loops they replace, the walks iterate over the children of a node only when
+descending into it (and over the live lists of children), so a pass may change the children of
+the current node or of its ancestors' following siblings while walking the tree.
+"""
+from __future__ import absolute_import
+
+from xml.dom import Node
+from xml.dom.minicompat import NodeList
+
+
+ELEMENT_NODE = Node.ELEMENT_NODE
+
+
+def child_elements(node):
+    """
+    Returns the child elements of 'node'.
+    """
+    return [child for child in node.childNodes if child.nodeType == ELEMENT_NODE]
+
+
+def walk(node, children=None):
+    """
+    Walks the tree rooted at 'node' in document order, yielding a tuple (node, entering) for each node:
+    (node, True) before its descendants (pre-order) and (node, False) after them (post-order).
+
+    If given, children(node) is called after (node, True) was yielded (so changes of the children made by
+    the caller are taken into account) and returns the nodes to descend into; return an empty sequence
+    to prune the subtree of a node. By default the child elements are walked.
+    """
+    yield node, True
+    stack = [(node, iter(node.childNodes if children is None else children(node)))]
+    while stack:
+        parent, remaining = stack[-1]
+        for child in remaining:
+            if children is None:
+                if child.nodeType != ELEMENT_NODE:
+                    continue
+                yield child, True
+                grandchildren = child.childNodes
+            else:
+                yield child, True
+                grandchildren = children(child)
+            if grandchildren:
+                stack.append((child, iter(grandchildren)))
+                break
+            # (leaves are left right away)
+            yield child, False
+        else:
+            stack.pop()
+            yield parent, False
+
+
+def iter_elements(node, descend=None):
+    """
+    Yields 'node' and its descendant elements in document order (pre-order).
+
+    If given, descend(element) is called after the element was yielded and the descendants
+    of the element are skipped if it returns False.
+    """
+    yield node
+    if descend is not None and not descend(node):
+        return
+    stack = [iter(node.childNodes)]
+    while stack:
+        for child in stack[-1]:
+            if child.nodeType == ELEMENT_NODE:
+                yield child
+                if child.childNodes and (descend is None or descend(child)):
+                    stack.append(iter(child.childNodes))
+                    break
+        else:
+            stack.pop()
+
+
+def get_elements_by_tag_name(node, name):
+    """
+    Returns a NodeList of the descendant elements of 'node' with the tag name 'name' (or all descendant
+    elements if 'name' is '*') in document order, like getElementsByTagName() (which recurses).
+    """
+    elements = NodeList()
+    stack = [iter(node.childNodes)]
+    while stack:
+        for child in stack[-1]:
+            if child.nodeType == ELEMENT_NODE:
+                if name == '*' or child.nodeName == name:
+                    elements.append(child)
+                if child.childNodes:
+                    stack.append(iter(child.childNodes))
+                    break
+        else:
+            stack.pop()
+    return elements
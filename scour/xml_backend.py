@@ -0,0 +1,564 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#  XML backends for Scour
+#
+#  This file is part of Scour, http://www.codedread.com/scour/
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+""" Backends turning SVG documents into the tree Scour operates on (selected with '--xml-backend').
+
+All passes of Scour work on a DOM, i.e. the tree of nodes implemented by xml.dom.minidom
+(and access it through the DOM Level 2 Core interfaces plus the helpers in this module).
+A backend decides how a document is parsed into that tree:
+
+    minidom  parses with xml.dom.minidom (expat calling back into Python for every node)
+    etree    parses with lxml (if installed) or xml.etree.ElementTree, i.e. entirely in C,
+             and builds the DOM from the resulting tree in one go
+
+The 'etree' backend builds the tree through the DOM interfaces from compact nodes (see CompactDocument)
+and shares strings repeated throughout the document, which reduces the memory needed for large documents
+considerably (see 'benchmark.py --xml-backends'). The 'minidom' backend creates the nodes of xml.dom.minidom,
+so this only applies to the 'etree' backend.
+
+Both backends produce the same tree. Documents the 'etree' backend can't represent faithfully are
+parsed with xml.dom.minidom instead: documents with a document type declaration or CDATA sections
+(which are kept by neither library) and documents binding a namespace to several prefixes where the
+prefixes can't be restored (ElementTree does not keep them, lxml only keeps the ones of elements).
+With lxml, documents it refuses to parse (like documents nested more deeply than libxml2 allows) are
+parsed with xml.dom.minidom as well.
+"""
+from __future__ import absolute_import
+
+import io
+import re
+import xml.dom.minidom
+from collections import OrderedDict
+from xml.dom import XML_NAMESPACE, XMLNS_NAMESPACE, expatbuilder
+from xml.parsers import expat
+
+import six
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+import xml.etree.ElementTree as ElementTree
+
+
+def attribute_nodes(element):
+    """
+    Returns the attribute nodes of 'element' in document order.
+
+    (NamedNodeMap.item() copies all attribute names on every call, which makes iterating over the
+    attributes by index quadratic in their number.)
+    """
+    return list(element.attributes.values())
+
+
+class CompactElement(xml.dom.minidom.Element):
+    """
+    An Element with an explicit slot for the value Scour caches on elements
+    (see mayContainTextNodes()).
+    """
+
+    __slots__ = ('mayContainTextNodes',)
+
+
+class CompactAttr(xml.dom.minidom.Attr):
+    """
+    An Attr creating the Text node holding its value (see the DOM) only when it is accessed.
+
+    Scour only uses the value itself, so this more than halves the memory needed for an attribute.
+    As Attr.__init__() creates the Text node right away, the slots of Attr are set like it does
+    (an implementation detail of xml.dom.minidom, so the builders only use the compact nodes if
+    they behave like the nodes of xml.dom.minidom, see COMPACT_NODES).
+    """
+
+    __slots__ = ('_childNodes',)
+
+    def __init__(self, qName, namespaceURI=None, localName=None, prefix=None):
+        self.ownerElement = None
+        self._name = qName
+        self.namespaceURI = namespaceURI
+        self._prefix = prefix
+        if localName is not None:
+            self._localName = localName
+        self._value = ''
+        self._childNodes = None
+
+    @property
+    def childNodes(self):
+        if self._childNodes is None:
+            text = xml.dom.minidom.Text()
+            text.data = self._value
+            text.ownerDocument = self.ownerDocument
+            self._childNodes = xml.dom.minidom.NodeList([text])
+        return self._childNodes
+
+    def _get_value(self):
+        return self._value
+
+    def _set_value(self, value):
+        self._value = value
+        if self._childNodes is not None:
+            self._childNodes[0].data = value
+        if self.ownerElement is not None:
+            # (like Attr, as the value of an ID attribute may have been looked up by getElementById())
+            xml.dom.minidom._clear_id_cache(self.ownerElement)
+
+    nodeValue = value = property(_get_value, _set_value)
+
+
+class CompactDocument(xml.dom.minidom.Document):
+    """
+    A Document whose createElementNS() and createAttributeNS() create a CompactElement
+    and a CompactAttr respectively (sharing the prefixes and local names of attributes).
+    """
+
+    def __init__(self):
+        xml.dom.minidom.Document.__init__(self)
+        self._attribute_names = {}
+
+    def createElementNS(self, namespaceURI, qualifiedName):
+        prefix, separator, _ = qualifiedName.partition(':')
+        element = CompactElement(qualifiedName, namespaceURI, prefix if separator else None)
+        element.ownerDocument = self
+        return element
+
+    def createAttributeNS(self, namespaceURI, qualifiedName):
+        names = self._attribute_names.get(qualifiedName)
+        if names is None:
+            prefix, separator, localName = qualifiedName.partition(':')
+            names = self._attribute_names[qualifiedName] = (prefix, localName) if separator else (None, prefix)
+        attr = CompactAttr(qualifiedName, namespaceURI, names[1], names[0])
+        attr.ownerDocument = self
+        return attr
+
+
+def _build_probe(document):
+    # creates and changes an attribute through the DOM, returning what can be observed of it
+    element = document.createElementNS(None, 'a')
+    attr = document.createAttributeNS('urn:x', 'x:b')
+    attr.value = 'c'
+    element.setAttributeNodeNS(attr)
+    observed = [attr.name, attr.nodeName, attr.localName, attr.prefix, attr.namespaceURI, attr.value,
+                attr.nodeValue, attr.ownerElement is element, element.getAttributeNS('urn:x', 'b')]
+    attr.value = 'd'
+    observed += [attr.firstChild.data, attr.childNodes.length, element.getAttribute('x:b')]
+    element.setAttribute('x:b', 'e')
+    observed += [attr.firstChild.data, attr.value, element.toxml(), element.cloneNode(True).toxml()]
+    element.removeAttributeNode(attr)
+    observed += [attr.ownerElement is element, element.toxml()]
+    return observed
+
+
+def _compact_nodes_work():
+    try:
+        return _build_probe(CompactDocument()) == _build_probe(xml.dom.minidom.Document())
+    except Exception:
+        return False
+
+
+# whether the compact nodes behave like the nodes of xml.dom.minidom, which can only be checked by using them
+# (CompactAttr depends on the implementation of Attr in Python 3, in Python 2 it is a classic class storing
+# its value in its Text node), otherwise the builders create the nodes of xml.dom.minidom
+COMPACT_NODES = _compact_nodes_work()
+
+
+class _TextExpatBuilder(expatbuilder.ExpatBuilderNS):
+    # parses UTF-8 regardless of the declared encoding
+
+    def createParser(self):
+        parser = expat.ParserCreate('UTF-8', namespace_separator=' ')
+        parser.namespace_prefixes = True
+        return parser
+
+
+def _parse_minidom(in_string):
+    # Python 2 can only parse text that is ASCII, so other text is parsed as UTF-8
+    # (ignoring the declared encoding like Python 3 does)
+    if six.PY2 and isinstance(in_string, six.text_type):
+        return _TextExpatBuilder().parseString(in_string.encode('UTF-8'))
+    return xml.dom.minidom.parseString(in_string)
+
+
+class MinidomBackend(object):
+
+    name = 'minidom'
+
+    def parse(self, in_string):
+        return _parse_minidom(in_string)
+
+
+class ElementTreeBackend(object):
+
+    name = 'etree'
+
+    # constructs ElementTree can't keep (see module docstring), looked for in the raw document
+    _UNSUPPORTED = ('<!DOCTYPE', '<![CDATA[')
+    _STANDALONE = re.compile(r'^\s*<\?xml[^>]*\sstandalone\s*=\s*["\']yes["\']')
+
+    def parse(self, in_string):
+        if not self._supported(in_string):
+            return _parse_minidom(in_string)
+        if lxml_etree is not None:
+            doc = self._parse_lxml(in_string)
+        else:
+            doc = self._parse_etree(in_string)
+        if doc is None:
+            return _parse_minidom(in_string)
+
+        prolog = in_string[:256]
+        if not isinstance(prolog, six.text_type):
+            prolog = prolog.decode('UTF-8', 'replace')
+        if self._STANDALONE.match(prolog):
+            doc.standalone = True
+        return doc
+
+    def _supported(self, in_string):
+        if isinstance(in_string, six.text_type):
+            return not any(marker in in_string for marker in self._UNSUPPORTED)
+        # the markers can't be found in encodings that are not a superset of ASCII (which are rare for SVG)
+        if in_string[:2] in (b'\xff\xfe', b'\xfe\xff') or b'\x00' in in_string[:4]:
+            return False
+        return not any(marker.encode('ascii') in in_string for marker in self._UNSUPPORTED)
+
+    def _parse_etree(self, in_string):
+        encoding = None
+        if isinstance(in_string, six.text_type):
+            in_string = in_string.encode('UTF-8')
+            encoding = 'UTF-8'
+        try:
+            parser = ElementTree.XMLParser(target=ElementTree.TreeBuilder(insert_comments=True, insert_pis=True),
+                                           encoding=encoding)
+        except TypeError:
+            # comments and processing instructions are only kept by Python 3.8 and later
+            return None
+
+        # the namespace declarations of an element are reported right before the element itself,
+        # comments and processing instructions are needed only outside of the root element
+        # (inside of it they are part of the tree)
+        declarations = {}
+        pending = []
+        outside = []
+        root = None
+        for event, node in ElementTree.iterparse(io.BytesIO(in_string), ('start-ns', 'start', 'comment', 'pi'),
+                                                 parser):
+            if event == 'start-ns':
+                pending.append(node)
+            elif event == 'start':
+                if root is None:
+                    root = node
+                    outside.append(node)
+                if pending:
+                    declarations[node] = pending
+                    pending = []
+            else:
+                outside.append(node)
+        if self._ambiguous(declarations, in_string):
+            return None
+        if len(outside) > 1:
+            inside = set(map(id, root.iter(ElementTree.Comment)))
+            inside.update(map(id, root.iter(ElementTree.PI)))
+            outside = [node for node in outside if id(node) not in inside]
+
+        builder = _ElementTreeBuilder(declarations)
+        for node in outside:
+            builder.add_node(builder.document, node, builder.root_scope)
+        return builder.document
+
+    def _ambiguous(self, declarations, in_string):
+        # whether the prefixes of names can't be restored as ElementTree does not keep them,
+        # i.e. a namespace is bound to several prefixes (where the default namespace only matters
+        # if the other prefix is used for elements)
+        prefixes = {}
+        for declared in declarations.values():
+            for prefix, uri in declared:
+                prefixes.setdefault(uri, set()).add(prefix)
+        for uri_prefixes in prefixes.values():
+            if len(uri_prefixes) > 1:
+                if len(uri_prefixes) > 2 or '' not in uri_prefixes:
+                    return True
+                prefix, = uri_prefixes - set([''])
+                if ('<' + prefix + ':').encode('UTF-8') in in_string:
+                    return True
+        return False
+
+    def _parse_lxml(self, in_string):
+        if isinstance(in_string, six.text_type):
+            parser = lxml_etree.XMLParser(encoding='UTF-8', huge_tree=True)
+            in_string = in_string.encode('UTF-8')
+        else:
+            parser = lxml_etree.XMLParser(huge_tree=True)
+        try:
+            root = lxml_etree.fromstring(in_string, parser)
+        except lxml_etree.XMLSyntaxError:
+            # (libxml2 limits the depth of documents even with huge_tree, errors of malformed
+            # documents are reported by xml.dom.minidom like with the 'minidom' backend)
+            return None
+
+        builder = _LxmlBuilder()
+        try:
+            for node in reversed(list(root.itersiblings(preceding=True))):
+                builder.add_node(builder.document, node, {})
+            builder.add_node(builder.document, root, {})
+            for node in root.itersiblings():
+                builder.add_node(builder.document, node, {})
+        except _AmbiguousPrefix:
+            return None
+        return builder.document
+
+
+class _AmbiguousPrefix(Exception):
+    # raised if the prefix of an attribute can't be restored
+    pass
+
+
+class _DocumentBuilder(object):
+    # builds a DOM document (of compact nodes, see COMPACT_NODES) through the DOM interfaces, sharing short
+    # strings repeated throughout the document (like attribute values or the whitespace between elements)
+    #
+    # Elements are added to their parents only once all their attributes and children were added:
+    # xml.dom.minidom checks whether a node is part of the document (looking through all its ancestors)
+    # whenever an element or an attribute is added to it.
+
+    SHARED_LENGTH = 32
+
+    def __init__(self):
+        self.document = CompactDocument() if COMPACT_NODES else xml.dom.minidom.Document()
+        self.strings = {}
+
+    def share(self, string):
+        if len(string) <= self.SHARED_LENGTH:
+            string = self.strings.setdefault(string, string)
+        return string
+
+    def attribute(self, element, qname, uri, value):
+        attr = self.document.createAttributeNS(uri, qname)
+        attr.value = self.share(value)
+        element.setAttributeNodeNS(attr)
+
+    def declaration(self, element, prefix, uri):
+        if prefix:
+            self.attribute(element, 'xmlns:' + prefix, XMLNS_NAMESPACE, uri)
+        else:
+            self.attribute(element, 'xmlns', XMLNS_NAMESPACE, uri)
+
+    def text(self, parent, data):
+        parent.appendChild(self.document.createTextNode(self.share(data)))
+
+    def comment(self, parent, data):
+        parent.appendChild(self.document.createComment(data))
+
+    def processing_instruction(self, parent, target, data):
+        parent.appendChild(self.document.createProcessingInstruction(target, data))
+
+
+class _Scope(object):
+    # the namespaces in scope of an ElementTree element and the names qualified with their prefixes
+
+    def __init__(self, bindings):
+        self.bindings = bindings
+        # ElementTree does not keep the prefixes, so the default namespace is preferred for elements,
+        # while attributes need a prefix to be in a namespace
+        self.attribute_prefixes = dict((uri, prefix) for prefix, uri in bindings.items() if prefix)
+        self.element_prefixes = dict(self.attribute_prefixes)
+        if bindings.get(''):
+            self.element_prefixes[bindings['']] = ''
+        self._names = {}
+
+    def declare(self, declarations):
+        bindings = self.bindings.copy()
+        bindings.update(declarations)
+        return _Scope(bindings)
+
+    def qualify(self, name, is_attribute=False):
+        # returns the qualified name and namespace URI of an ElementTree tag or attribute name
+        key = (name, is_attribute)
+        result = self._names.get(key)
+        if result is None:
+            if name[0] == '{':
+                uri, _, localname = name[1:].partition('}')
+                prefix = (self.attribute_prefixes if is_attribute else self.element_prefixes)[uri]
+                result = (prefix + ':' + localname if prefix else localname, uri)
+            else:
+                result = (name, None)
+            self._names[key] = result
+        return result
+
+
+class _ElementTreeBuilder(_DocumentBuilder):
+
+    def __init__(self, declarations):
+        _DocumentBuilder.__init__(self)
+        self.declarations = declarations
+        self.root_scope = _Scope({'xml': XML_NAMESPACE})
+
+    def add_node(self, parent, node, scope):
+        tag = node.tag
+        if tag is ElementTree.Comment:
+            self.comment(parent, node.text)
+        elif tag is ElementTree.PI:
+            target, _, data = node.text.partition(' ')
+            self.processing_instruction(parent, target, data)
+        else:
+            self.add_element(parent, node, scope)
+        if node.tail and parent is not self.document:
+            self.text(parent, node.tail)
+
+    def add_element(self, parent, node, scope):
+        # (the hot path of parsing, so the attributes are created inline)
+        document = self.document
+        strings = self.strings
+        shared_length = self.SHARED_LENGTH
+        root = None
+        # the elements whose children are being added (with an explicit stack instead of recursively,
+        # so deeply nested documents can be parsed), for each: (the node of the ElementTree, the element,
+        # its scope, an iterator over the remaining children)
+        stack = []
+        while node is not None:
+            declared = self.declarations.pop(node, None)
+            if declared:
+                scope = scope.declare(declared)
+            qname, uri = scope.qualify(node.tag)
+            element = document.createElementNS(uri, qname)
+            for prefix, uri in declared or ():
+                self.declaration(element, prefix, uri)
+            for name, value in node.attrib.items():
+                qname, uri = scope.qualify(name, True)
+                attr = document.createAttributeNS(uri, qname)
+                attr.value = strings.setdefault(value, value) if len(value) <= shared_length else value
+                element.setAttributeNodeNS(attr)
+            if root is None:
+                root = element
+            if node.text:
+                self.text(element, node.text)
+            stack.append((node, element, scope, iter(node)))
+
+            # find the next child element to add (adding the other children on the way)
+            # and finish the elements whose children were all added
+            node = None
+            while node is None and stack:
+                current, element, scope, children = stack[-1]
+                for child in children:
+                    tag = child.tag
+                    if tag is ElementTree.Comment or tag is ElementTree.PI:
+                        self.add_node(element, child, scope)
+                    else:
+                        node = child
+                        break
+                else:
+                    stack.pop()
+                    tail = current.tail
+                    # the converted part of the ElementTree is not needed anymore
+                    # (so both trees don't need to be kept in memory completely)
+                    current.clear()
+                    if stack:
+                        stack[-1][1].appendChild(element)
+                        if tail:
+                            self.text(stack[-1][1], tail)
+                    else:
+                        parent.appendChild(element)
+        return root
+
+
+class _LxmlBuilder(_DocumentBuilder):
+
+    def add_node(self, parent, node, parent_namespaces):
+        # the elements whose children are being added (with an explicit stack instead of recursively,
+        # so deeply nested documents can be parsed), for each: (the node of the tree, its parent, the element,
+        # its namespaces, an iterator over the remaining children)
+        stack = []
+        while True:
+            added = self._add_node(parent, node, parent_namespaces)
+            if added is not None:
+                element, namespaces = added
+                stack.append((node, parent, element, namespaces, iter(node)))
+            else:
+                self._add_tail(parent, node)
+
+            # continue with the next child (finishing the elements whose children were all added)
+            while stack:
+                current, currentParent, element, namespaces, children = stack[-1]
+                node = next(children, None)
+                if node is not None:
+                    parent, parent_namespaces = element, namespaces
+                    break
+                stack.pop()
+                currentParent.appendChild(element)
+                self._add_tail(currentParent, current)
+            else:
+                return
+
+    def _add_tail(self, parent, node):
+        if node.tail and parent is not self.document:
+            self.text(parent, node.tail)
+
+    def _add_node(self, parent, node, parent_namespaces):
+        # adds node without its children and tail (an element is only created, see _DocumentBuilder),
+        # returns the element and its namespaces if it is an element
+        tag = node.tag
+        if tag is lxml_etree.Comment:
+            self.comment(parent, node.text)
+        elif tag is lxml_etree.PI:
+            self.processing_instruction(parent, node.target, node.text or '')
+        else:
+            # (lxml keeps the prefixes, unlike ElementTree)
+            namespaces = node.nsmap
+            name = lxml_etree.QName(node)
+            if node.prefix:
+                element = self.document.createElementNS(name.namespace, node.prefix + ':' + name.localname)
+            else:
+                element = self.document.createElementNS(name.namespace, name.localname)
+            declared = [(prefix or '', uri) for prefix, uri in namespaces.items()
+                        if parent_namespaces.get(prefix) != uri]
+            for prefix, uri in declared:
+                self.declaration(element, prefix, uri)
+            prefixes = None
+            for name, value in node.attrib.items():
+                if name[0] == '{':
+                    uri, _, localname = name[1:].partition('}')
+                    if uri == XML_NAMESPACE:
+                        prefix = 'xml'
+                    else:
+                        if prefixes is None:
+                            prefixes = {}
+                            for prefix, namespace in namespaces.items():
+                                if prefix:
+                                    prefixes.setdefault(namespace, []).append(prefix)
+                        if len(prefixes[uri]) > 1:
+                            # (lxml keeps the prefixes of elements, but not the ones of attributes)
+                            raise _AmbiguousPrefix()
+                        prefix = prefixes[uri][0]
+                    self.attribute(element, prefix + ':' + localname, uri, value)
+                else:
+                    self.attribute(element, name, None, value)
+            if node.text:
+                self.text(element, node.text)
+            return element, namespaces
+        return None
+
+
+BACKENDS = OrderedDict((backend.name, backend) for backend in (MinidomBackend, ElementTreeBackend))
+
+
+def get_backend(name):
+    """
+    Returns an instance of the backend 'name' (see BACKENDS).
+    """
+    try:
+        return BACKENDS[name]()
+    except KeyError:
+        raise ValueError("Invalid XML backend: {!r}".format(name))
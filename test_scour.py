@@ -23,16 +23,34 @@
 from __future__ import print_function   # use print() as a function in Python 2 (see PEP 3105)
 from __future__ import absolute_import  # use absolute imports by default in Python 2 (see PEP 328)
 
+import glob
+import json
 import os
+import re
+import shutil
+import socket
 import sys
+import tempfile
 import unittest
+import xml.dom.minidom
+from xml.parsers.expat import ExpatError
+from decimal import Decimal
 
 import six
 from six.moves import map, range
 
-from scour.scour import (make_well_formed, parse_args, scourString, scourXmlFile, start, run,
-                         XML_ENTS_ESCAPE_APOS, XML_ENTS_ESCAPE_QUOT)
-from scour.svg_regex import svg_parser
+from scour.scour import (make_well_formed, parse_args, scourString, scour_strings, scourXmlFile, start, run,
+                         styleInheritedByChild, styleInheritedFromParent, summarizeStylesInheritedByChildren,
+                         ComputedStyles, _getStyle, _setStyle, run_element_visitors,
+                         removeNamespacedAttributes, removeNamespacedElements, unwanted_ns,
+                         NamespaceIndex, ReferenceIndex, Scourer, XML_ENTS_ESCAPE_APOS, XML_ENTS_ESCAPE_QUOT,
+                         scourUnitlessLength, LRUCache, _path_cache,
+                         BoundedCache, _number_cache, _style_cache, mayContainTextNodes, OutputWriter, serializeXML,
+                         writeXML, scour_batch_file, file_hash, mergeSiblingGroupsWithCommonAttributes,
+                         create_groups_for_common_attributes, remove_nested_groups)
+from scour.stats import ScourStats
+from scour.svg_regex import svg_parser, SVGPathParser, FastSVGPathParser
+from scour.xml_backend import get_backend, lxml_etree, CompactAttr, CompactElement, COMPACT_NODES, ElementTreeBackend
 from scour import __version__
 
 
@@ -389,6 +407,18 @@ class DoNotRemoveChainedRefsInDefs(unittest.TestCase):
                          'Chained references not honored in defs')
 
 
+class RemoveChainOfUnreferencedElementsInDefs(unittest.TestCase):
+
+    def runTest(self):
+        stats = ScourStats()
+        doc = scourXmlFile('unittests/unreferenced-chain.svg', stats=stats)
+        for tag in ['pattern', 'g', 'use', 'rect', 'linearGradient']:
+            self.assertEqual(len(doc.getElementsByTagNameNS(SVGNS, tag)), 0,
+                             'Chain of unreferenced elements not removed (%s left)' % tag)
+        self.assertEqual(stats.num_elements_removed, 7,
+                         'Unexpected number of removed elements')
+
+
 class KeepTitleInDefs(unittest.TestCase):
 
     def runTest(self):
@@ -625,6 +655,35 @@ class KeepSodipodiNamespaceDeclarationsWhenKeepEditorData(unittest.TestCase):
         return False
 
 
+class NamespaceIndexRemoval(unittest.TestCase):
+
+    svg = ('<svg xmlns="http://www.w3.org/2000/svg" xmlns:dc="http://purl.org/dc/elements/1.1/"'
+           ' xmlns:inkscape="http://www.inkscape.org/namespaces/inkscape"'
+           ' xmlns:sodipodi="http://sodipodi.sourceforge.net/DTD/sodipodi-0.dtd">'
+           '<sodipodi:namedview><inkscape:grid inkscape:label="x"/></sodipodi:namedview>'
+           '<g inkscape:label="layer"><inkscape:path-effect/><rect sodipodi:type="rect"/></g></svg>')
+
+    def test_same_as_tree_walk(self):
+        walked = xml.dom.minidom.parseString(self.svg)
+        indexed = xml.dom.minidom.parseString(self.svg)
+        ns_index = NamespaceIndex(indexed)
+        self.assertEqual(removeNamespacedElements(indexed.documentElement, unwanted_ns, ns_index),
+                         removeNamespacedElements(walked.documentElement, unwanted_ns))
+        self.assertEqual(removeNamespacedAttributes(indexed.documentElement, unwanted_ns, ns_index),
+                         removeNamespacedAttributes(walked.documentElement, unwanted_ns))
+        self.assertEqual(indexed.toxml(), walked.toxml())
+
+    def test_xmlns_unused(self):
+        doc = xml.dom.minidom.parseString(self.svg)
+        ns_index = NamespaceIndex(doc)
+        self.assertTrue(ns_index.xmlns_unused('dc', 'http://purl.org/dc/elements/1.1/'))
+        self.assertFalse(ns_index.xmlns_unused('sodipodi', 'http://sodipodi.sourceforge.net/DTD/sodipodi-0.dtd'))
+        removeNamespacedElements(doc.documentElement, unwanted_ns, ns_index)
+        removeNamespacedAttributes(doc.documentElement, unwanted_ns, ns_index)
+        self.assertTrue(ns_index.xmlns_unused('sodipodi', 'http://sodipodi.sourceforge.net/DTD/sodipodi-0.dtd'),
+                        'Index not updated when removing namespaced elements/attributes')
+
+
 class KeepReferencedFonts(unittest.TestCase):
 
     def runTest(self):
@@ -778,6 +837,107 @@ class KeepStrokeWidthWhenInheritedByChild(unittest.TestCase):
                          'stroke-width attribute removed despite it being inherited by a child')
 
 
+class StyleInheritedByChildSummary(unittest.TestCase):
+
+    def runTest(self):
+        doc = xml.dom.minidom.parse('unittests/stroke-none.svg')
+        summary = {}
+        summarizeStylesInheritedByChildren(doc.documentElement, summary)
+        for elem in [doc.documentElement] + doc.documentElement.getElementsByTagName('*'):
+            for style in ['stroke', 'stroke-width', 'stroke-opacity', 'fill', 'font-size']:
+                self.assertEqual(styleInheritedByChild(elem, style, summary=summary),
+                                 styleInheritedByChild(elem, style),
+                                 'Summary differs for %s on <%s id="%s">'
+                                 % (style, elem.nodeName, elem.getAttribute('id')))
+
+
+class ComputedStylesCache(unittest.TestCase):
+
+    def setUp(self):
+        self.doc = xml.dom.minidom.parse('unittests/stroke-none.svg')
+
+    def test_values(self):
+        computedStyles = ComputedStyles()
+        for elem in self.doc.documentElement.getElementsByTagName('*'):
+            for style in ['stroke', 'stroke-width', 'fill']:
+                self.assertEqual(styleInheritedFromParent(elem, style, computedStyles),
+                                 styleInheritedFromParent(elem, style),
+                                 'Cached value differs for %s on <%s id="%s">'
+                                 % (style, elem.nodeName, elem.getAttribute('id')))
+
+    def test_invalidate(self):
+        computedStyles = ComputedStyles()
+        child = [path for path in self.doc.getElementsByTagName('path') if path.getAttribute('id') == 'p2'][0]
+        group = child.parentNode
+        self.assertEqual(styleInheritedFromParent(child, 'stroke', computedStyles), 'none')
+        group.setAttribute('style', 'stroke:red')
+        computedStyles.invalidate(group)
+        self.assertEqual(styleInheritedFromParent(child, 'stroke', computedStyles), 'red',
+                         'Cached values not invalidated')
+
+
+class ParsedStyleMaps(unittest.TestCase):
+
+    def setUp(self):
+        self.doc = xml.dom.minidom.parseString('<svg xmlns="http://www.w3.org/2000/svg">'
+                                               '<rect style="fill:red;stroke:blue"/>'
+                                               '<rect style=" fill : red ;"/></svg>')
+        self.normalized, self.unnormalized = self.doc.getElementsByTagName('rect')
+
+    def test_parsed_once(self):
+        _style_cache.clear()
+        styles = _getStyle(self.normalized)
+        self.assertEqual(styles, {'fill': 'red', 'stroke': 'blue'})
+        self.assertEqual(_getStyle(self.normalized), styles)
+        self.assertEqual((_style_cache.hits, _style_cache.misses), (1, 1), 'Style attribute parsed again')
+
+    def test_changes_not_shared(self):
+        styles = _getStyle(self.normalized)
+        del styles['stroke']
+        self.assertEqual(_getStyle(self.normalized), {'fill': 'red', 'stroke': 'blue'},
+                         'Change not written back with _setStyle() returned')
+        self.assertIsNot(_getStyle(self.normalized), _getStyle(self.normalized), 'Style shared between callers')
+
+    def test_write_back(self):
+        attr = self.normalized.getAttributeNode('style')
+        _setStyle(self.normalized, _getStyle(self.normalized))
+        self.assertIs(self.normalized.getAttributeNode('style'), attr, 'Unchanged style written back')
+        styles = _getStyle(self.normalized)
+        del styles['stroke']
+        _setStyle(self.normalized, styles)
+        self.assertEqual(self.normalized.getAttribute('style'), 'fill:red')
+        styles = _getStyle(self.unnormalized)
+        _setStyle(self.unnormalized, styles)
+        self.assertEqual(self.unnormalized.getAttribute('style'), 'fill:red',
+                         'Style not normalized when written back')
+
+    def test_attribute_changed(self):
+        _getStyle(self.normalized)
+        self.normalized.setAttribute('style', 'fill:green')
+        self.assertEqual(_getStyle(self.normalized), {'fill': 'green'}, 'Outdated style returned')
+
+
+class FusedElementVisitors(unittest.TestCase):
+
+    def runTest(self):
+        doc = xml.dom.minidom.parseString('<svg xmlns="http://www.w3.org/2000/svg" id="a">'
+                                          '<g id="b"><rect id="c"/></g><rect id="d"/></svg>')
+        visited = []
+
+        def record(element, options, state):
+            visited.append(element.getAttribute('id'))
+            return 1, None
+
+        def depth(element, options, state):
+            visited.append(state)
+            return state, state + 1
+
+        totals = run_element_visitors(doc.documentElement, [record, depth], None, [0, 0])
+        self.assertEqual(visited, ['a', 0, 'b', 1, 'c', 2, 'd', 1],
+                         'Elements not visited in pre-order or state not passed to children')
+        self.assertEqual(totals, [4, 4])
+
+
 class RemoveStrokeOpacityWhenStrokeNone(unittest.TestCase):
 
     def runTest(self):
@@ -906,6 +1066,19 @@ class PreserveXLinkHrefWhenCollapsingReferencedGradients(unittest.TestCase):
                          'g3 has a xlink:href to g1')
 
 
+class CollapseChainOfSinglyReferencedGradients(unittest.TestCase):
+
+    def runTest(self):
+        doc = scourXmlFile('unittests/collapse-gradients-chain.svg')
+        grads = doc.getElementsByTagNameNS(SVGNS, 'linearGradient')
+        self.assertEqual(len(grads), 1,
+                         'Chain of singly-referenced gradients not collapsed')
+        self.assertEqual(grads[0].getAttributeNS('http://www.w3.org/1999/xlink', 'href'), '',
+                         'Collapsed gradient references a removed gradient')
+        self.assertEqual(len(grads[0].getElementsByTagNameNS(SVGNS, 'stop')), 2,
+                         'Stops not moved to the collapsed gradient')
+
+
 class RemoveTrailingZerosFromPath(unittest.TestCase):
 
     def runTest(self):
@@ -942,6 +1115,238 @@ class UseScientificNotationToShortenCoordsInPath(unittest.TestCase):
                          'Not using scientific notation for path coord when representation is shorter')
 
 
+class FastPathParserMatchesPathParser(unittest.TestCase):
+
+    def test_unittests(self):
+        parser, fastParser = SVGPathParser(), FastSVGPathParser()
+        for filename in glob.glob('unittests/*.svg'):
+            try:
+                doc = xml.dom.minidom.parse(filename)
+            except Exception:
+                continue
+            for path in doc.getElementsByTagNameNS(SVGNS, 'path'):
+                d = path.getAttribute('d')
+                self.assertEqual(fastParser.parse(d), parser.parse(d),
+                                 'Path data parsed differently in %s: %r' % (filename, d))
+
+    def test_edge_cases(self):
+        parser, fastParser = SVGPathParser(), FastSVGPathParser()
+        for d in ['', 'M 0.6051.5', 'M 100-200', 'm1e4 0z', 'M10,20 30,40V50 60 70zm1 1',
+                  'a10 10 0 1150 50', 'A5 5 30 1 0 1.5.5l1 1', 'M,1,2,L3.4,5']:
+            self.assertEqual(fastParser.parse(d), parser.parse(d), 'Path data parsed differently: %r' % d)
+        for d in ['1 2', 'M 1', 'z 5', 'a-1 1 0 0 0 1 1', 'a1 1 0 2 0 1 1', 'C1 2 3 4 L']:
+            with self.assertRaises(SyntaxError):
+                parser.parse(d)
+            with self.assertRaises(SyntaxError):
+                fastParser.parse(d)
+
+
+class ElementTreeXMLBackend(unittest.TestCase):
+
+    def test_unittests(self):
+        for filename in glob.glob('unittests/*.svg'):
+            with open(filename, 'rb') as f:
+                svg = f.read()
+            for args in [[], ['--keep-editor-data', '--keep-unreferenced-defs', '--strip-xml-prolog']]:
+                try:
+                    expected = scourString(svg, parse_args(args))
+                except Exception:
+                    continue
+                self.assertEqual(scourString(svg, parse_args(args + ['--xml-backend=etree'])), expected,
+                                 'Different output with the etree backend for %s %r' % (filename, args))
+
+    def test_tree(self):
+        backend = get_backend('etree')
+        for filename in ['unittests/comments.svg', 'unittests/xml-namespace-attrs.svg', 'unittests/xml-space.svg']:
+            with open(filename, 'rb') as f:
+                svg = f.read()
+            expected = xml.dom.minidom.parseString(svg)
+            doc = backend.parse(svg)
+            self.assertEqual(doc.toxml(), expected.toxml(), 'Different tree for %s' % filename)
+            siblings = [doc.documentElement.firstChild]
+            while siblings[-1].nextSibling is not None:
+                siblings.append(siblings[-1].nextSibling)
+            self.assertEqual(siblings, doc.documentElement.childNodes, 'Siblings not linked for %s' % filename)
+
+    def test_text_input(self):
+        svg = (u'<?xml version="1.0" encoding="ISO-8859-1" standalone="yes"?>\n'
+               u'<svg xmlns="http://www.w3.org/2000/svg"><!--\u00fc--><?pi data?><text>\u00e4</text></svg>')
+        doc = get_backend('etree').parse(svg)
+        self.assertEqual(doc.toxml(), get_backend('minidom').parse(svg).toxml())
+        self.assertEqual(doc.getElementsByTagName('text')[0].firstChild.data, u'\u00e4', 'Text decoded wrongly')
+        self.assertTrue(doc.standalone, 'Standalone declaration not kept')
+
+    def test_ambiguous_prefixes(self):
+        svg = ('<svg xmlns="http://www.w3.org/2000/svg" xmlns:svg="http://www.w3.org/2000/svg">'
+               '<svg:g/><g/></svg>')
+        self.assertEqual(get_backend('etree').parse(svg).toxml(), xml.dom.minidom.parseString(svg).toxml(),
+                         'Prefix not kept')
+
+    @unittest.skipIf(not isinstance(get_backend('etree').parse('<svg/>').documentElement, CompactElement),
+                     "The etree backend falls back to xml.dom.minidom (ElementTree keeps comments since Python 3.8)")
+    def test_compact_nodes(self):
+        doc = get_backend('etree').parse('<svg xmlns="http://www.w3.org/2000/svg"><rect fill="red"/></svg>')
+        rect = doc.documentElement.firstChild
+        self.assertIsInstance(rect, CompactElement)
+        attr = rect.getAttributeNode('fill')
+        self.assertIsInstance(attr, CompactAttr)
+        self.assertEqual((attr.value, attr.firstChild.data), ('red', 'red'))
+        rect.setAttribute('fill', 'blue')
+        self.assertEqual((attr.value, attr.firstChild.data), ('blue', 'blue'), 'Text node of attribute not updated')
+        self.assertEqual(rect.toxml(), '<rect fill="blue"/>')
+        self.assertFalse(mayContainTextNodes(rect))
+        self.assertEqual(rect.mayContainTextNodes, False, 'Result not cached in the slot')
+
+    def test_compact_nodes_supported(self):
+        # (CompactAttr depends on the implementation of xml.dom.minidom, see COMPACT_NODES)
+        self.assertEqual(COMPACT_NODES, not six.PY2, "Compact nodes don't behave like the nodes of xml.dom.minidom")
+
+    def test_invalid_backend(self):
+        options = ScourOptions()
+        options.xml_backend = 'sax'
+        self.assertRaises(ValueError, Scourer, options)
+        self.assertRaises(ValueError, get_backend, 'sax')
+
+
+@unittest.skipIf(lxml_etree is None, "lxml is not installed")
+class LxmlXMLBackend(unittest.TestCase):
+
+    def test_tree(self):
+        backend = ElementTreeBackend()
+        for filename in glob.glob('unittests/*.svg'):
+            with open(filename, 'rb') as f:
+                svg = f.read()
+            if not backend._supported(svg):
+                continue
+            try:
+                expected = xml.dom.minidom.parseString(svg)
+            except Exception:
+                continue
+            doc = backend._parse_lxml(svg)
+            if doc is not None:
+                self.assertEqual(doc.toxml(), expected.toxml(), 'Different tree for %s' % filename)
+
+    def test_prefixes(self):
+        backend = ElementTreeBackend()
+        svg = ('<svg xmlns="http://www.w3.org/2000/svg" xmlns:svg="http://www.w3.org/2000/svg">'
+               '<svg:g/><g/></svg>')
+        self.assertEqual(backend._parse_lxml(svg).toxml(), xml.dom.minidom.parseString(svg).toxml(),
+                         'Prefix of element not kept')
+        svg = ('<svg xmlns="http://www.w3.org/2000/svg" xmlns:a="urn:x" xmlns:b="urn:x">'
+               '<rect a:c="1" b:d="2"/></svg>')
+        self.assertEqual(backend._parse_lxml(svg), None, 'Ambiguous prefixes of attributes not detected')
+        self.assertEqual(backend.parse(svg).toxml(), xml.dom.minidom.parseString(svg).toxml(),
+                         'Prefixes of attributes not kept')
+
+    def test_deep_nesting(self):
+        depth = sys.getrecursionlimit() + 500
+        svg = ('<svg xmlns="http://www.w3.org/2000/svg">' + '<g fill="red">' * depth + '<rect/>' +
+               '</g>' * depth + '</svg>')
+        node = ElementTreeBackend()._parse_lxml(svg).documentElement
+        for _ in range(depth):
+            node = node.firstChild
+            self.assertEqual((node.nodeName, node.getAttribute('fill')), ('g', 'red'), 'Nested group lost')
+        self.assertEqual(node.firstChild.nodeName, 'rect', 'Deeply nested element lost')
+
+    def test_refused_documents(self):
+        # (libxml2 limits the depth of documents)
+        depth = 5000
+        svg = '<svg xmlns="http://www.w3.org/2000/svg">' + '<g>' * depth + '</g>' * depth + '</svg>'
+        node = get_backend('etree').parse(svg).documentElement
+        for _ in range(depth):
+            node = node.firstChild
+            self.assertEqual(node.nodeName, 'g', 'Nested group lost')
+        self.assertRaises(ExpatError, get_backend('etree').parse, '<svg><g></svg>')
+
+
+class StreamingMode(unittest.TestCase):
+
+    # (ElementTree reports comments only with Python 3.8 and later, see scour.stream)
+    keeps_comments = sys.version_info >= (3, 8)
+
+    def _scour_stream(self, svg, args=None, input=None):
+        output = six.BytesIO()
+        scourer = Scourer(parse_args(args or []))
+        input_size, output_size, stats = scourer.scour_stream(input or six.BytesIO(svg), output)
+        self.assertEqual((input_size, output_size), (len(svg), len(output.getvalue())), 'Wrong sizes')
+        return output.getvalue().decode('UTF-8'), stats
+
+    def test_unittests(self):
+        # (documents not changed by the optimizations across elements)
+        for filename in ['unittests/comments.svg', 'unittests/encoding-iso-8859-15.svg', 'unittests/inkscape.svg',
+                         'unittests/path-truncate-zeros.svg', 'unittests/polygon.svg', 'unittests/stroke-none.svg',
+                         'unittests/redundant-svg-namespace.svg', 'unittests/transform-matrix-is-rotate-90.svg',
+                         'unittests/whitespace-defs.svg', 'unittests/xml-space.svg']:
+            with open(filename, 'rb') as f:
+                svg = f.read()
+            for args in [[], ['--enable-id-stripping', '--enable-comment-stripping', '--strip-xml-prolog',
+                              '--indent=tab']]:
+                if filename == 'unittests/comments.svg' and not args and not self.keeps_comments:
+                    continue
+                self.assertEqual(self._scour_stream(svg, args)[0], scourString(svg, parse_args(args)),
+                                 'Different output when streaming %s %r' % (filename, args))
+
+    def test_groups(self):
+        svg = (b'<?xml version="1.0"?>\n<!-- before -->\n'
+               b'<svg xmlns="http://www.w3.org/2000/svg"'
+               b' xmlns:inkscape="http://www.inkscape.org/namespaces/inkscape">\n'
+               b' <g id="layer1" inkscape:label="Layer 1" style="fill:#ff0000">\n'
+               b'  <!-- paths -->\n'
+               b'  <path d="M 10,10 L 20,10 L 30,10"/>\n'
+               b'  <rect width="10.000" height="10" fill="rgb(0,0,255)"/>\n'
+               b' </g>\n'
+               b' <g id="layer2"> <metadata/> </g>\n'
+               b'</svg>\n<!-- after -->\n')
+        output, stats = self._scour_stream(svg, ['--enable-id-stripping', '--remove-metadata'])
+        expected = ('<?xml version="1.0" encoding="UTF-8"?>\n<!-- before -->\n'
+                    '<svg xmlns="http://www.w3.org/2000/svg">\n'
+                    ' <g fill="#f00">\n'
+                    '  <!-- paths -->\n'
+                    '  <path d="m10 10h10 10"/>\n'
+                    '  <rect width="10" height="10" fill="#00f"/>\n'
+                    ' </g>\n'
+                    '</svg>\n<!-- after -->\n')
+        if not self.keeps_comments:
+            expected = re.sub(r' *<!-- \w+ -->\n', '', expected)
+        self.assertEqual(output, expected)
+        self.assertEqual((stats.num_ids_removed, stats.num_elements_removed), (2, 2))
+
+    def test_references(self):
+        svg = (b'<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink">'
+               b'<defs><linearGradient id="a"/><linearGradient id="b"/>'
+               b'<path id="c" d="M0 0h1"/><path id="d" d="M0 0h1"/></defs>'
+               b'<style>rect { fill: url(#b) }</style>'
+               b'<g><rect id="e" fill="url(#a)"/><use id="f" xlink:href="#c"/></g></svg>')
+        output = self._scour_stream(svg, ['--enable-id-stripping'])[0]
+        for id in ['a', 'b', 'c']:
+            self.assertTrue('id="%s"' % id in output, 'Referenced ID %s removed' % id)
+        for id in ['d', 'e', 'f']:
+            self.assertFalse('id="%s"' % id in output, 'Unreferenced ID %s kept' % id)
+
+    def test_non_seekable_input(self):
+        class Pipe(object):
+            def __init__(self, data):
+                self._file = six.BytesIO(data)
+
+            def read(self, size=-1):
+                return self._file.read(size)
+
+            def seekable(self):
+                return False
+
+        with open('unittests/ids.svg', 'rb') as f:
+            svg = f.read()
+        self.assertEqual(self._scour_stream(svg, input=Pipe(svg))[0], self._scour_stream(svg)[0])
+
+    def test_flowtext(self):
+        with open('unittests/flowtext.svg', 'rb') as f:
+            svg = f.read()
+        output = six.BytesIO()
+        self.assertRaises(Exception, Scourer(parse_args(['--error-on-flowtext'])).scour_stream,
+                          six.BytesIO(svg), output)
+        self.assertEqual(output.getvalue(), b'', 'Output written for invalid document')
+
+
 class ConvertAbsoluteToRelativePathCommands(unittest.TestCase):
 
     def runTest(self):
@@ -953,6 +1358,81 @@ class ConvertAbsoluteToRelativePathCommands(unittest.TestCase):
                          'Absolute V value not converted to relative v value')
 
 
+class CleanPathCache(unittest.TestCase):
+
+    def setUp(self):
+        _path_cache.clear()
+
+    def test_repeated_path_data(self):
+        svg = ('<svg xmlns="http://www.w3.org/2000/svg">' + '<path d="M10 10H20 30"/>' * 3 +
+               '<path d="M10 10H20 30" marker-mid="url(#m)"/></svg>')
+        stats = ScourStats()
+        output = scourString(svg, stats=stats)
+        self.assertEqual(output.count('d="m10 10h20"'), 3, 'Repeated path data not cleaned the same way')
+        self.assertIn('d="m10 10h10 10" marker-mid="url(#m)"', output,
+                      'Path data with intermediate markers cleaned like path data without')
+        self.assertEqual((_path_cache.hits, _path_cache.misses), (2, 2), 'Unexpected use of the cache')
+        self.assertEqual(stats.num_path_segments_removed, 3, 'Statistics not taken from the cache')
+        self.assertEqual(stats.num_bytes_saved_in_path_data, 9, 'Statistics not taken from the cache')
+
+    def test_options(self):
+        svg = '<svg xmlns="http://www.w3.org/2000/svg"><path d="M1.234567 1L3.000 3.000"/></svg>'
+        self.assertIn('d="m1.2346 1 1.7654 2"', scourString(svg))
+        self.assertIn('d="m1.23 1 1.77 2"', scourString(svg, parse_args(['--set-precision=3'])),
+                      'Cached path data used for a different precision')
+
+    def test_lru(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (1, None, 3),
+                         'Least recently used entry not discarded')
+        self.assertEqual((len(cache), cache.hits, cache.misses), (2, 3, 1))
+
+
+class NumberCache(unittest.TestCase):
+
+    def setUp(self):
+        _number_cache.clear()
+
+    def test_repeated_numbers(self):
+        options = Scourer().options
+        self.assertEqual([scourUnitlessLength(number, options) for number in ('1.50', '1.50', Decimal('1.5'))],
+                         ['1.5'] * 3)
+        self.assertEqual((_number_cache.hits, _number_cache.misses), (1, 2), 'Unexpected use of the cache')
+
+    def test_negative_zero(self):
+        options = Scourer().options
+        self.assertEqual(scourUnitlessLength(Decimal('0'), options), '0')
+        self.assertEqual(scourUnitlessLength(Decimal('-0'), options), '-0',
+                         'Negative zero looked up as zero')
+
+    def test_options(self):
+        options = Scourer(parse_args(['--set-precision=3', '--set-c-precision=2'])).options
+        self.assertEqual(scourUnitlessLength('1.234', options), '1.23')
+        self.assertEqual(scourUnitlessLength('1.234', options, is_control_point=True), '1.2',
+                         'Cached number used for a different precision')
+        self.assertEqual(scourUnitlessLength('1.234', Scourer().options), '1.234',
+                         'Cached number used for a different precision')
+
+    def test_bounded(self):
+        cache = BoundedCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.put('c', 3)
+        self.assertEqual((len(cache), cache.get('a'), cache.get('c')), (1, None, 3), 'Cache not bounded')
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_profile(self):
+        stats = ScourStats()
+        svg = '<svg xmlns="http://www.w3.org/2000/svg"><rect width="10.0" height="10.00"/></svg>'
+        scourString(svg, parse_args(['--profile']), stats)
+        self.assertEqual(stats.profile.cache_stats()['number'],
+                         {'hits': 1, 'misses': 1, 'hit_rate': 50.}, 'Cache statistics not recorded')
+
+
 class RoundPathData(unittest.TestCase):
 
     def runTest(self):
@@ -2068,6 +2548,81 @@ class ShortenIDsStableOutput(unittest.TestCase):
                          '--shorten-ids pointlessly reassigned ids')
 
 
+class ReferenceIndexUpdates(unittest.TestCase):
+
+    def setUp(self):
+        self.doc = xml.dom.minidom.parseString(
+            '<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink">'
+            '<defs><linearGradient id="a"/><linearGradient id="b" xlink:href="#a"/></defs>'
+            '<g id="g" fill="url(#b)"><rect id="r" style="stroke:url(#a)"/></g></svg>')
+        self.index = ReferenceIndex(self.doc)
+
+    def test_build(self):
+        self.assertEqual(sorted(self.index.elements), ['a', 'b', 'g', 'r'])
+        self.assertEqual(sorted(self.index.referrers), ['a', 'b'])
+        self.assertEqual(len(self.index.referrers['a']), 2)
+
+    def test_remove(self):
+        g = self.doc.getElementsByTagName('g')[0]
+        self.index.remove(g)
+        g.parentNode.removeChild(g)
+        self.assertEqual(sorted(self.index.elements), ['a', 'b'])
+        self.assertEqual(sorted(self.index.referrers), ['a'])
+
+    def test_update(self):
+        rect = self.doc.getElementsByTagName('rect')[0]
+        rect.setAttribute('style', 'stroke:url(#b)')
+        self.index.update(rect)
+        self.assertEqual(len(self.index.referrers['a']), 1)
+        self.assertEqual(len(self.index.referrers['b']), 2)
+
+    def test_rename(self):
+        self.index.rename({'a': 'b', 'b': 'a'})
+        self.assertEqual(self.index.elements['b'].getAttribute('id'), 'a')
+        self.assertEqual(len(self.index.referrers['b']), 2)
+        self.assertEqual(len(self.index.referrers['a']), 1)
+
+    def test_moves_keep_order(self):
+        doc = xml.dom.minidom.parseString(
+            '<svg xmlns="http://www.w3.org/2000/svg">'
+            '<g fill="red"><rect id="a"/><g><rect id="b"/></g></g><!-- c --><g fill="red"><rect id="c"/></g>'
+            '<rect id="d" fill="blue"/><rect id="e" fill="blue"/><rect id="h" fill="blue"/>'
+            '<g><g><rect id="f"/></g><rect id="g"/></g></svg>')
+        index = ReferenceIndex(doc)
+        mergeSiblingGroupsWithCommonAttributes(doc.documentElement, index)
+        create_groups_for_common_attributes(doc.documentElement, ScourStats(), index)
+        remove_nested_groups(doc.documentElement, ScourStats(), index)
+        for tag in ['rect', 'g']:
+            self.assertEqual(index.elements_with_tag(tag), doc.getElementsByTagName(tag),
+                             "Elements with tag '%s' not in document order" % tag)
+
+    def test_elements_with_tag(self):
+        self.assertEqual([elem.getAttribute('id') for elem in self.index.elements_with_tag('linearGradient')],
+                         ['a', 'b'])
+        gradient = self.index.elements['a']
+        self.index.remove(gradient)
+        gradient.parentNode.removeChild(gradient)
+        self.assertEqual([elem.getAttribute('id') for elem in self.index.elements_with_tag('linearGradient')],
+                         ['b'])
+        group = self.doc.createElementNS(SVGNS, 'g')
+        self.doc.documentElement.insertBefore(group, self.index.elements['g'])
+        self.index.insert(group)
+        self.assertEqual(self.index.elements_with_tag('g'), [group, self.index.elements['g']])
+
+
+class ShortenIDsWithDuplicateIDs(unittest.TestCase):
+
+    def runTest(self):
+        doc = scourXmlFile('unittests/xml-namespace-attrs.svg',
+                           parse_args(['--shorten-ids']))
+        ids = [grad.getAttribute('id') for grad in doc.getElementsByTagNameNS(SVGNS, 'linearGradient')]
+        self.assertNotIn('linearGradient841', ids,
+                         'Did not shorten an ID declared twice after removing the duplicate')
+        for rect in doc.getElementsByTagNameNS(SVGNS, 'rect'):
+            self.assertIn(rect.getAttribute('fill')[5:-1], ids,
+                          'Reference to a shortened ID not updated')
+
+
 class MustKeepGInSwitch(unittest.TestCase):
 
     def runTest(self):
@@ -2688,6 +3243,365 @@ class CommandLineUsage(unittest.TestCase):
         self.assertEqual(result.stdout.count(': 0'), 14,
                          "Statistics output not as expected when '--verbose' option was used")
 
+    def test_profile(self):
+        sys.argv.extend(['-q', '--profile', '--profile-format=json', '-i', 'unittests/minimal.svg',
+                         '-o', self.TEMP_SVG_FILE])
+
+        result = self._run_scour()
+        os.remove(self.TEMP_SVG_FILE)
+
+        self.assertEqual(result.status, 0, "Execution of 'scour --profile ...' errored")
+        profile = json.loads(result.stdout)
+        self.assertEqual(profile['serializeXML']['calls'], 1, "Unexpected profile output for '--profile'")
+
+    def test_stream(self):
+        sys.argv.extend(['--stream', '-v', '-i', 'unittests/ids.svg', '-o', self.TEMP_SVG_FILE])
+
+        result = self._run_scour()
+        with open(self.TEMP_SVG_FILE, 'rb') as file:
+            file_content = file.read()
+        os.remove(self.TEMP_SVG_FILE)
+
+        self.assertEqual(result.status, 0, "Execution of 'scour --stream ...' errored")
+        with open('unittests/ids.svg', 'rb') as file:
+            expected = scourString(file.read())
+        self.assertEqual(file_content.decode('UTF-8'), expected, "Unexpected SVG output for '--stream'")
+        self.assertEqual(result.stdout.count('Number'), 14,
+                         "Statistics output not as expected when '--stream' option was used")
+
+    def test_stream_batch(self):
+        sys.argv.extend(['--stream', '--output-dir', 'testscour_temp', 'unittests/ids.svg'])
+
+        result = self._run_scour()
+
+        self.assertEqual(result.status, 2, "'--stream' with '--output-dir' should exit with status '2'")
+
+    def test_profile_invalid_format(self):
+        sys.argv.extend(['--profile', '--profile-format=xml', 'unittests/minimal.svg'])
+
+        result = self._run_scour()
+
+        self.assertEqual(result.status, 2, "Invalid '--profile-format' should exit with status '2'")
+
+    def test_stats_format_json(self):
+        sys.argv.extend(['--stats-format=json', '-i', 'unittests/ids.svg', '-o', self.TEMP_SVG_FILE])
+
+        result = self._run_scour()
+        os.remove(self.TEMP_SVG_FILE)
+
+        self.assertEqual(result.status, 0, "Execution of 'scour --stats-format=json ...' errored")
+        record = json.loads(result.stdout)
+        self.assertEqual(record['file'], 'unittests/ids.svg', "Filename missing in JSON statistics")
+        self.assertEqual(record['input_size'], os.path.getsize('unittests/ids.svg'),
+                         "Input size missing in JSON statistics")
+        for field in ScourStats.counters() + ('output_size', 'ratio', 'duration_ms'):
+            self.assertTrue(field in record, "Field '%s' missing in JSON statistics" % field)
+
+    def test_stats_format_csv(self):
+        sys.argv.extend(['--stats-format=csv', '-i', 'unittests/ids.svg', '-o', self.TEMP_SVG_FILE])
+
+        result = self._run_scour()
+        os.remove(self.TEMP_SVG_FILE)
+
+        self.assertEqual(result.status, 0, "Execution of 'scour --stats-format=csv ...' errored")
+        lines = result.stdout.splitlines()
+        self.assertEqual(len(lines), 2, "Unexpected number of lines in CSV statistics")
+        header = lines[0].split(',')
+        row = dict(zip(header, lines[1].split(',')))
+        self.assertEqual(row['file'], 'unittests/ids.svg', "Unexpected filename in CSV statistics")
+        self.assertEqual(len(header), len(ScourStats.counters()) + 6, "Unexpected fields in CSV statistics")
+
+    def test_stats_format_invalid(self):
+        sys.argv.extend(['--stats-format=xml', 'unittests/minimal.svg'])
+
+        result = self._run_scour()
+
+        self.assertEqual(result.status, 2, "Invalid '--stats-format' should exit with status '2'")
+
+    def test_batch_stats_format_json(self):
+        outdir = tempfile.mkdtemp()
+        sys.argv.extend(['-j', '1', '--stats-format=json', '--slowest=2', '--output-dir', outdir,
+                         'unittests/minimal.svg', 'unittests/ids.svg', 'unittests/path-precision.svg'])
+
+        try:
+            result = self._run_scour()
+        finally:
+            shutil.rmtree(outdir)
+
+        self.assertEqual(result.status, 0, "Batch processing with '--stats-format=json' errored")
+        report = json.loads(result.stdout)
+        self.assertEqual(len(report['files']), 3, "Unexpected number of files in JSON statistics")
+        summary = report['summary']
+        self.assertEqual(summary['files'], 3, "Unexpected number of files in summary")
+        self.assertEqual(summary['input_size'], sum(record['input_size'] for record in report['files']),
+                         "Unexpected total input size in summary")
+        self.assertEqual(summary['stats']['num_bytes_saved_in_path_data'],
+                         sum(record['num_bytes_saved_in_path_data'] for record in report['files']),
+                         "Unexpected total statistics in summary")
+        ratios = sorted(record['ratio'] for record in report['files'])
+        self.assertEqual(summary['ratio_percentiles']['min'], ratios[0], "Unexpected minimum size ratio")
+        self.assertEqual(summary['ratio_percentiles']['p50'], ratios[1], "Unexpected median size ratio")
+        self.assertEqual(summary['ratio_percentiles']['max'], ratios[2], "Unexpected maximum size ratio")
+        self.assertEqual(len(summary['slowest']), 2, "Unexpected number of slowest files")
+        self.assertTrue(summary['slowest'][0]['duration_ms'] >= summary['slowest'][1]['duration_ms'],
+                        "Slowest files not sorted by duration")
+
+    def test_batch_stats_format_csv(self):
+        outdir = tempfile.mkdtemp()
+        sys.argv.extend(['-j', '1', '--stats-format=csv', '--output-dir', outdir,
+                         'unittests/minimal.svg', 'unittests/ids.svg'])
+
+        try:
+            result = self._run_scour()
+        finally:
+            shutil.rmtree(outdir)
+
+        self.assertEqual(result.status, 0, "Batch processing with '--stats-format=csv' errored")
+        lines = result.stdout.splitlines()
+        self.assertEqual(len(lines), 4, "Expected header, one row per file and a total row in CSV statistics")
+        self.assertTrue(lines[0].startswith('file,') and lines[3].startswith('TOTAL,'),
+                        "Unexpected CSV statistics in batch mode")
+
+    def test_batch_directory(self):
+        outdir = tempfile.mkdtemp()
+        sys.argv.extend(['-j', '2', '--output-dir', outdir, 'unittests/minimal.svg', 'unittests/ids.svg'])
+
+        try:
+            result = self._run_scour()
+
+            self.assertEqual(result.status, 0, "Batch processing with '--output-dir' errored")
+            with open(os.path.join(outdir, 'minimal.svg')) as file:
+                self.assertEqual(file.read(), self.MINIMAL_SVG, "Unexpected SVG output in generated file")
+            self.assertTrue(os.path.isfile(os.path.join(outdir, 'ids.svg')), "Output file missing in batch mode")
+            self.assertTrue('Scour processed 2 of 2 files' in result.stdout,
+                            "Batch summary not as expected")
+        finally:
+            shutil.rmtree(outdir)
+
+    def test_batch_input_list_and_glob(self):
+        outdir = tempfile.mkdtemp()
+        inputlist = os.path.join(outdir, 'inputs.txt')
+        with open(inputlist, 'w') as file:
+            file.write('unittests/minimal.svg\n\n')
+        sys.argv.extend(['-j', '1', '-v', '--output-dir', os.path.join(outdir, 'out'),
+                         '--input-list', inputlist, 'unittests/remove-unused-attributes-on-parent*.svg'])
+
+        try:
+            result = self._run_scour()
+
+            self.assertEqual(result.status, 0, "Batch processing with '--input-list' errored")
+            self.assertEqual(sorted(os.listdir(os.path.join(outdir, 'out'))),
+                             ['minimal.svg', 'remove-unused-attributes-on-parent.svg'],
+                             "Unexpected output files in batch mode")
+            self.assertEqual(result.stdout.count('Number'), 14,
+                             "Aggregated statistics not printed when '--verbose' option was used")
+        finally:
+            shutil.rmtree(outdir)
+
+    def test_batch_error(self):
+        outdir = tempfile.mkdtemp()
+        broken = os.path.join(outdir, 'broken.svg')
+        with open(broken, 'w') as file:
+            file.write('<svg')
+        sys.argv.extend(['-q', '-j', '1', '--output-dir', os.path.join(outdir, 'out'),
+                         broken, 'unittests/minimal.svg'])
+
+        try:
+            result = self._run_scour()
+
+            self.assertEqual(result.status, 1, "Failed files in batch mode should exit with status '1'")
+            self.assertTrue('ERROR' in result.stderr, "Failed files in batch mode not reported")
+            with open(os.path.join(outdir, 'out', 'minimal.svg')) as file:
+                self.assertEqual(file.read(), self.MINIMAL_SVG, "Remaining files not processed in batch mode")
+        finally:
+            shutil.rmtree(outdir)
+
+    def test_batch_manifest(self):
+        tempdir = tempfile.mkdtemp()
+        indir = os.path.join(tempdir, 'in')
+        outdir = os.path.join(tempdir, 'out')
+        manifest = os.path.join(tempdir, 'manifest.json')
+        os.makedirs(os.path.join(indir, 'sub'))
+        shutil.copy('unittests/minimal.svg', indir)
+        shutil.copy('unittests/ids.svg', os.path.join(indir, 'sub'))
+        args = ['-j', '1', '--output-dir', outdir, '--manifest', manifest, indir]
+
+        try:
+            sys.argv = ['scour'] + args
+            result = self._run_scour()
+            self.assertEqual(result.status, 0, "Batch processing with '--manifest' errored")
+            self.assertTrue('processed 2 of 2 files' in result.stdout, "Not all files processed in first run")
+            self.assertTrue(os.path.isfile(os.path.join(outdir, 'sub', 'ids.svg')),
+                            "Directory structure not preserved in batch mode")
+
+            # nothing changed, so nothing should be processed
+            self.temp_stdout.truncate(0)
+            self.temp_stdout.seek(0)
+            result = self._run_scour()
+            self.assertTrue('processed 0 of 0 files' in result.stdout and '2 unchanged files skipped' in result.stdout,
+                            "Unchanged files not skipped when using '--manifest'")
+
+            # changed inputs, missing outputs and changed options trigger re-processing
+            with open(os.path.join(indir, 'minimal.svg'), 'a') as file:
+                file.write('<!-- changed -->\n')
+            self.temp_stdout.truncate(0)
+            self.temp_stdout.seek(0)
+            result = self._run_scour()
+            self.assertTrue('processed 1 of 1 files' in result.stdout and '1 unchanged files skipped' in result.stdout,
+                            "Changed input not re-processed when using '--manifest'")
+
+            os.remove(os.path.join(outdir, 'sub', 'ids.svg'))
+            self.temp_stdout.truncate(0)
+            self.temp_stdout.seek(0)
+            result = self._run_scour()
+            self.assertTrue('processed 1 of 1 files' in result.stdout, "Missing output not re-created")
+
+            sys.argv = ['scour', '--shorten-ids'] + args
+            self.temp_stdout.truncate(0)
+            self.temp_stdout.seek(0)
+            result = self._run_scour()
+            self.assertTrue('processed 2 of 2 files' in result.stdout,
+                            "Files not re-processed after options changed when using '--manifest'")
+        finally:
+            shutil.rmtree(tempdir)
+
+    def test_batch_invalid_arguments(self):
+        sys.argv.extend(['--output-dir', 'foo', '-o', self.TEMP_SVG_FILE, 'unittests/minimal.svg'])
+
+        result = self._run_scour()
+
+        self.assertEqual(result.status, 2, "'--output-dir' together with '-o' should exit with status '2'")
+
+
+class ServerMode(unittest.TestCase):
+
+    def _start_server(self, args):
+        import threading
+        from scour.server import make_server
+
+        server = make_server(parse_args(['--serve', '-j', '1'] + args))
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+
+        def stop():
+            server.shutdown()
+            thread.join()
+            server.server_close()
+        self.addCleanup(stop)
+        return server
+
+    def _post(self, server, query, data):
+        from six.moves.urllib.error import HTTPError
+        from six.moves.urllib.request import urlopen
+
+        url = 'http://{}:{}/?{}'.format(server.server_address[0], server.server_address[1], query)
+        try:
+            response = urlopen(url, data)
+        except HTTPError as error:
+            response = error
+        status = response.getcode()
+        try:
+            return status, json.loads(response.read().decode('UTF-8'))
+        finally:
+            response.close()
+
+    def test_scour_request(self):
+        server = self._start_server(['--listen', '127.0.0.1:0', '--shorten-ids'])
+        with open('unittests/ids.svg', 'rb') as f:
+            data = f.read()
+
+        status, result = self._post(server, 'set-precision=3&indent=none', data)
+
+        self.assertEqual(status, 200, "Request to Scour server failed")
+        self.assertEqual(result['svg'], scourString(data, parse_args(['--shorten-ids', '--set-precision=3',
+                                                                      '--indent=none'])),
+                         "Unexpected output of Scour server")
+        self.assertEqual(result['input_size'], len(data), "Unexpected input size reported by Scour server")
+        self.assertTrue(result['stats']['num_bytes_saved_in_ids'] > 0, "Unexpected stats reported by Scour server")
+
+    def test_scourer_reused(self):
+        from scour.server import _scourers, parse_request_options, scour_request
+
+        defaults = parse_args([])
+        with open('unittests/ids.svg', 'rb') as f:
+            data = f.read()
+        results = []
+        for query in ['shorten-ids', 'shorten-ids', 'indent=none']:
+            results.append(scour_request(data, parse_request_options(query, defaults), query))
+        self.addCleanup(_scourers.clear)
+        self.assertEqual(results[0], dict(results[1], duration=results[0]['duration']),
+                         "Unexpected output of reused Scourer")
+        self.assertNotEqual(results[0]['svg'], results[2]['svg'], "Scourer reused for different options")
+        self.assertEqual(sorted(_scourers), ['indent=none', 'shorten-ids'], "Scourers not reused per query")
+
+    def test_invalid_requests(self):
+        server = self._start_server(['--listen', '127.0.0.1:0'])
+
+        status, result = self._post(server, 'no-such-option', b'<svg/>')
+        self.assertEqual(status, 400, "Unknown option in request not rejected")
+        for query in ['output-dir=/tmp', 'input=unittests/ids.svg', 'output=/tmp/out.svg', 'allow-embed-rasters']:
+            status, result = self._post(server, query, b'<svg/>')
+            self.assertEqual(status, 400, "Server-only option in request not rejected: %s" % query)
+        status, result = self._post(server, '', b'<svg')
+        self.assertEqual(status, 400, "Invalid SVG in request not rejected")
+        self.assertTrue('error' in result, "Error not reported by Scour server")
+
+    def test_queue_full(self):
+        server = self._start_server(['--listen', '127.0.0.1:0', '--queue-depth', '0'])
+        server.request_slots.acquire()  # occupy the only worker
+
+        status, result = self._post(server, '', b'<svg/>')
+        self.assertEqual(status, 503, "Request not rejected when the queue is full")
+        server.request_slots.release()
+
+    def test_request_too_large(self):
+        server = self._start_server(['--listen', '127.0.0.1:0', '--max-request-size', '10'])
+
+        status, result = self._post(server, '', b'<svg/>' * 2)
+        self.assertEqual(status, 413, "Request larger than '--max-request-size' not rejected")
+        self.assertTrue('error' in result, "Error not reported by Scour server")
+        status, result = self._post(server, '', b'<svg/>')
+        self.assertEqual(status, 200, "Request smaller than '--max-request-size' rejected")
+
+    def test_embed_rasters(self):
+        href = 'file://' + os.path.abspath('unittests/raster.png')
+        data = ('<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink">'
+                '<image xlink:href="%s"/></svg>' % href).encode('UTF-8')
+
+        status, result = self._post(self._start_server(['--listen', '127.0.0.1:0']), '', data)
+        self.assertEqual(status, 200, "Request to Scour server failed")
+        self.assertTrue(href in result['svg'], "Raster image embedded without '--allow-embed-rasters'")
+
+        status, result = self._post(self._start_server(['--listen', '127.0.0.1:0', '--allow-embed-rasters']), '', data)
+        self.assertEqual(status, 200, "Request to Scour server failed")
+        self.assertTrue('data:image/png;base64,' in result['svg'],
+                        "Raster image not embedded with '--allow-embed-rasters'")
+
+    @unittest.skipIf(not hasattr(socket, 'AF_UNIX'), "Unix domain sockets not supported on this platform")
+    def test_unix_socket(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        path = os.path.join(tempdir, 'scour.sock')
+        self._start_server(['--listen', 'unix:' + path])
+        with open('unittests/minimal.svg', 'rb') as f:
+            data = f.read()
+
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(path)
+        client.sendall(b'POST / HTTP/1.0\r\nContent-Length: ' + str(len(data)).encode() + b'\r\n\r\n' + data)
+        response = b''
+        while True:
+            chunk = client.recv(4096)
+            if not chunk:
+                break
+            response += chunk
+        client.close()
+
+        headers, body = response.split(b'\r\n\r\n', 1)
+        self.assertTrue(headers.startswith(b'HTTP/1.0 200'), "Request via Unix domain socket failed")
+        self.assertEqual(json.loads(body.decode('UTF-8'))['svg'], CommandLineUsage.MINIMAL_SVG,
+                         "Unexpected output of Scour server via Unix domain socket")
+
 
 class EmbedRasters(unittest.TestCase):
 
@@ -2772,6 +3686,262 @@ class EmbedRasters(unittest.TestCase):
                             "Raster image from remote path '" + href + "' not embedded.")
 
 
+class ScourerObject(unittest.TestCase):
+
+    def test_same_output_as_scour_string(self):
+        options = parse_args(['--shorten-ids', '--set-precision=3', '--indent=tab', '--nindent=2'])
+        scourer = Scourer(options)
+        for filename in ['unittests/ids.svg', 'unittests/path-precision.svg', 'unittests/whitespace.svg']:
+            with open(filename, 'rb') as f:
+                svg = f.read()
+            output, stats = scourer.scour(svg)
+            self.assertEqual(output, scourString(svg, options),
+                             "Scourer.scour() output differs from scourString() for '%s'" % filename)
+            self.assertEqual(output, scourer.scour(svg.decode('utf-8'))[0],
+                             "Scourer.scour() output differs for bytes and strings")
+
+    def test_batch_file(self):
+        options = parse_args(['--set-precision=3'])
+        scourer = Scourer(options)
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        for filename in ['unittests/path-precision.svg', 'unittests/raster-formats.svg']:
+            outfilename = os.path.join(tempdir, os.path.basename(filename))
+            result = scour_batch_file(filename, outfilename, options, scourer)
+            self.assertEqual(result.error, None, "Scouring '%s' failed" % filename)
+            with open(filename, 'rb') as f:
+                expected_options = parse_args(['--set-precision=3', filename])
+                expected = scourString(f.read(), expected_options)
+            with open(outfilename, 'rb') as f:
+                self.assertEqual(f.read().decode('UTF-8'), expected,
+                                 "scour_batch_file() output differs from scourString() for '%s'" % filename)
+        self.assertEqual(scourer.options.infilename, None, "Options of reused Scourer modified")
+
+    def test_batch_file_hash(self):
+        import gzip
+
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        with open('unittests/ids.svg', 'rb') as f:
+            svg = f.read()
+        infilename = os.path.join(tempdir, 'ids.svgz')
+        with gzip.GzipFile(infilename, 'wb') as f:
+            f.write(svg)
+        options = parse_args([])
+        options.manifest = os.path.join(tempdir, 'manifest.json')
+
+        result = scour_batch_file(infilename, os.path.join(tempdir, 'out.svg'), options)
+        self.assertEqual(result.error, None, "Scouring compressed input failed")
+        self.assertEqual(result.input_hash, file_hash(infilename), "Unexpected hash of the input that was read")
+        self.assertEqual(result.oldsize, len(svg), "Compressed input not decompressed")
+        self.assertEqual(scour_batch_file(infilename, os.path.join(tempdir, 'out.svg'), parse_args([])).input_hash,
+                         None, "Input hashed without a manifest")
+
+    def test_stats(self):
+        scourer = Scourer(parse_args(['--shorten-ids']))
+        with open('unittests/ids.svg', 'rb') as f:
+            svg = f.read()
+
+        output, stats1 = scourer.scour(svg)
+        output, stats2 = scourer.scour(svg)
+        self.assertTrue(stats1 is not stats2, "Scourer.scour() reused statistics of previous call")
+        self.assertEqual(stats1.num_bytes_saved_in_ids, stats2.num_bytes_saved_in_ids,
+                         "Scourer.scour() statistics differ between calls")
+
+        stats = ScourStats()
+        scourer.scour(svg, stats)
+        scourer.scour(svg, stats)
+        self.assertEqual(stats.num_bytes_saved_in_ids, 2 * stats1.num_bytes_saved_in_ids,
+                         "Scourer.scour() did not accumulate statistics")
+
+    def test_scour_to_file(self):
+        options = parse_args(['--shorten-ids', '--indent=tab', '--keep-editor-data'])
+        scourer = Scourer(options)
+        for filename in ['unittests/ids.svg', 'unittests/whitespace.svg', 'unittests/xml-well-formed.svg',
+                         'unittests/comment-beside-xml-decl.svg', 'unittests/doctype.svg']:
+            with open(filename, 'rb') as f:
+                svg = f.read()
+            outfile = six.BytesIO()
+            size, stats = scourer.scour_to_file(svg, outfile)
+            output = scourString(svg, options)
+            self.assertEqual(outfile.getvalue(), output.encode('UTF-8'),
+                             "Scourer.scour_to_file() output differs from scourString() for '%s'" % filename)
+            self.assertEqual(size, len(outfile.getvalue()),
+                             "Scourer.scour_to_file() returned wrong number of bytes for '%s'" % filename)
+            self.assertTrue(isinstance(stats, ScourStats), "Scourer.scour_to_file() returned no statistics")
+
+    def test_invalid_options(self):
+        options = ScourOptions()
+        options.digits = 0
+        self.assertRaises(ValueError, Scourer, options)
+        options = ScourOptions()
+        options.indent_type = 'foo'
+        self.assertRaises(ValueError, Scourer, options)
+
+
+class WriteXML(unittest.TestCase):
+
+    def test_chunked_output(self):
+        options = Scourer(parse_args(['--indent=space', '--nindent=2'])).options
+        doc = xml.dom.minidom.parse('unittests/whitespace.svg')
+        outfile = six.BytesIO()
+        writer = OutputWriter(outfile, buffer_parts=1)
+        writeXML(doc.documentElement, options, writer)
+        self.assertEqual(writer.parts, [], "Writer did not write parts after they accumulated")
+        writer.flush()
+        self.assertEqual(outfile.getvalue(), serializeXML(doc.documentElement, options).encode('UTF-8'),
+                         "writeXML() output differs from serializeXML()")
+        self.assertEqual(writer.size, len(outfile.getvalue()), "Writer counted wrong number of bytes")
+
+    def test_unprepared_options(self):
+        doc = xml.dom.minidom.parse('unittests/whitespace.svg')
+        for args in [[], ['--indent=tab', '--nindent=2'], ['--no-line-breaks']]:
+            options = parse_args(args)
+            self.assertEqual(serializeXML(doc.documentElement, options),
+                             serializeXML(doc.documentElement, Scourer(options).options),
+                             "serializeXML() output differs for options not prepared by a Scourer %r" % args)
+            self.assertFalse(hasattr(options, 'indentation'), "Options passed to serializeXML() modified")
+
+    def test_buffered_output(self):
+        outfile = six.BytesIO()
+        writer = OutputWriter(outfile, buffer_parts=3)
+        writer.write(u'<svg>')
+        writer.write(u'\u00e4')
+        self.assertEqual(outfile.getvalue(), b'', "Writer wrote before enough parts accumulated")
+        writer.write(u'</svg>')
+        self.assertEqual(outfile.getvalue(), u'<svg>\u00e4</svg>'.encode('UTF-8'),
+                         "Writer did not write once enough parts accumulated")
+        self.assertEqual(writer.size, 13, "Writer counted wrong number of bytes")
+
+
+class DeepNesting(unittest.TestCase):
+
+    def _deep_svg(self, depth):
+        return ('<svg xmlns="http://www.w3.org/2000/svg">' +
+                '<g fill="red">' * depth + '<rect width="1" height="1"/>' + '</g>' * depth + '</svg>')
+
+    def test_deep_nesting(self):
+        depth = sys.getrecursionlimit() + 500
+        for backend in ['minidom', 'etree']:
+            out = scourString(self._deep_svg(depth), parse_args(['--xml-backend=' + backend]))
+            self.assertEqual(out.count('<rect'), 1, "Deeply nested element lost with backend '%s'" % backend)
+            self.assertEqual(out.count('</g>'), depth, "Nested groups not kept with backend '%s'" % backend)
+
+    def test_deep_nesting_in_defs(self):
+        depth = sys.getrecursionlimit() + 500
+        svg = ('<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink"><defs>' +
+               ''.join('<g id="g%d"><rect id="r%d" width="1" height="1"/>' % (i, i) for i in range(depth)) +
+               '</g>' * depth + '</defs><use xlink:href="#g%d"/></svg>' % (depth // 2))
+        out = scourString(svg)
+        self.assertEqual(out.count('<rect'), depth - depth // 2,
+                         "Unreferenced elements in deeply nested groups in defs not removed correctly")
+        self.assertEqual(out.count('</g>'), depth, "Nested groups in defs not kept")
+
+
+class Profiling(unittest.TestCase):
+
+    def _read(self, filename):
+        with open(filename, 'rb') as f:
+            return f.read()
+
+    def test_profile_disabled(self):
+        stats = ScourStats()
+        scourString(self._read('unittests/ids.svg'), stats=stats)
+        self.assertEqual(stats.profile, None, "Profile recorded although profiling was not requested")
+        self.assertFalse('profile' in stats.as_dict(), "Profile reported although profiling was not requested")
+
+    def test_profile(self):
+        stats = ScourStats()
+        svg = self._read('unittests/nested-defs.svg')
+        scourString(svg, parse_args(['--profile']), stats)
+        stages = stats.profile.as_dict()
+        for stage in ['parse', 'repairStyle', 'remove_unreferenced_elements', 'clean_path', 'serializeXML']:
+            self.assertTrue(stage in stages, "Stage '%s' missing in profile" % stage)
+        self.assertEqual(stages['parse']['calls'], 1, "Unexpected number of calls recorded")
+        doc = xml.dom.minidom.parseString(svg)
+        self.assertEqual(stages['clean_path']['calls'], len(doc.getElementsByTagName('path')),
+                         "Unexpected number of calls recorded for per-element stage")
+        self.assertEqual(stages['clean_path']['tree_size'], 0, "Tree size recorded for per-element stage")
+        self.assertEqual(stages['repairStyle']['tree_size'], len(doc.getElementsByTagName('*')),
+                         "Unexpected tree size recorded")
+        self.assertTrue(stats.profile.total_time() > 0, "Time not recorded")
+
+    def test_profile_iterations(self):
+        stats = ScourStats()
+        scourString(self._read('unittests/nested-useless-groups.svg'), parse_args(['--profile']), stats)
+        stages = stats.profile.as_dict()
+        self.assertTrue(stages['remove_nested_groups']['iterations'] >= 1,
+                        "Iterations of fixed-point loop not recorded")
+        self.assertEqual(stages['remove_unreferenced_elements']['iterations'], 0,
+                         "Unreferenced elements not removed in a single pass")
+
+    def test_profile_aggregation(self):
+        svg = self._read('unittests/ids.svg')
+        options = parse_args(['--profile'])
+        stats1 = ScourStats()
+        stats2 = ScourStats()
+        scourString(svg, options, stats1)
+        scourString(svg, options, stats2)
+
+        total = ScourStats()
+        total += stats1
+        total += stats2
+        self.assertEqual(total.profile.as_dict()['serializeXML']['calls'], 2, "Profiles not aggregated")
+        self.assertAlmostEqual(total.profile.total_time(),
+                               stats1.profile.total_time() + stats2.profile.total_time(),
+                               msg="Profile times not aggregated")
+
+
+class ThreadSafety(unittest.TestCase):
+
+    def test_concurrent_precision(self):
+        import threading
+
+        with open('unittests/path-precision.svg', 'rb') as f:
+            svg = f.read()
+        precisions = [1, 2, 3, 5, 8]
+        expected = dict((digits, scourString(svg, parse_args(['--set-precision', str(digits)])))
+                        for digits in precisions)
+        self.assertEqual(len(set(expected.values())), len(precisions), "Test document not sensitive to precision")
+
+        errors = []
+
+        def worker(digits):
+            options = parse_args(['--set-precision', str(digits)])
+            for _ in range(10):
+                if scourString(svg, options) != expected[digits]:
+                    errors.append(digits)
+
+        threads = [threading.Thread(target=worker, args=(digits,)) for digits in precisions * 2]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [], "Concurrent calls of scourString() with different precisions interfered")
+
+    def test_scour_strings(self):
+        inputs = []
+        for filename in ['unittests/minimal.svg', 'unittests/ids.svg', 'unittests/path-precision.svg']:
+            with open(filename, 'rb') as f:
+                inputs.append(f.read())
+        options = parse_args(['--shorten-ids'])
+
+        results = scour_strings(inputs, options, workers=2)
+
+        self.assertEqual([output for output, stats in results], [scourString(svg, options) for svg in inputs],
+                         "scour_strings() returned unexpected output")
+        self.assertTrue(results[1][1].num_bytes_saved_in_ids > 0, "scour_strings() returned unexpected stats")
+
+    def test_embed_rasters_keeps_working_dir(self):
+        cwd = os.getcwd()
+        doc = scourXmlFile('unittests/raster-paths-local.svg')
+        self.assertEqual(os.getcwd(), cwd, "Working directory changed while embedding rasters")
+        for image in doc.getElementsByTagName('image'):
+            self.assertTrue(image.getAttribute('xlink:href').startswith('data:image/'),
+                            "Raster image from local path not embedded")
+
+
 class ViewBox(unittest.TestCase):
 
     def test_viewbox_create(self):